@@ -1,5 +1,9 @@
 const db = require('../services/db');
 const { PLANS } = require('./userController');
+const { getStats: getSchedulerStats } = require('../utils/concurrencyLimiter');
+const { getStats: getEngineStats } = require('../services/enginePool');
+const authCache = require('../utils/authCache');
+const usageCounters = require('../utils/usageCounters');
 
 /**
  * Get system-wide statistics
@@ -43,7 +47,9 @@ exports.getStats = (req, res) => {
                 recentSignups,
                 totalCompressions,
                 planBreakdown
-            }
+            },
+            authCache: authCache.getStats(),
+            usageCounters: usageCounters.getStats()
         });
     } catch (error) {
         console.error('Admin getStats error:', error);
@@ -51,6 +57,18 @@ exports.getStats = (req, res) => {
     }
 };
 
+/**
+ * Get compression scheduler metrics (queue depth, wait time, shed counts per plan)
+ * and engine mode / worker pool stats
+ */
+exports.getScheduler = (req, res) => {
+    res.json({
+        success: true,
+        scheduler: getSchedulerStats(),
+        engine: getEngineStats()
+    });
+};
+
 /**
  * Get all users with pagination and filtering
  */
@@ -187,6 +205,8 @@ exports.updateUserPlan = (req, res) => {
             id
         );
 
+        authCache.invalidateUser(id);
+
         const updatedUser = db.prepare('SELECT * FROM users WHERE id = ?').get(id);
 
         res.json({
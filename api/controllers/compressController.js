@@ -1,9 +1,10 @@
 const path = require("path");
 const fs = require("fs");
-const archiver = require("archiver");
 const sharp = require("sharp");
-const { runCompression } = require("../services/engineService");
+const { runCompression, formatServerTiming } = require("../services/engineService");
 const { validateFileContent } = require("../utils/fileValidation");
+const { jobFromRequest } = require("../utils/concurrencyLimiter");
+const { streamBatch } = require("../services/batchArchive");
 
 // Helper to cleanup files
 const cleanup = (files) => {
@@ -134,7 +135,7 @@ exports.compressImage = async (req, res, next) => {
     };
 
     // Run Engine
-    await runCompression(inputPath, outputPath, outputFormat, quality, method, width, height, preserve);
+    const engine = await runCompression(inputPath, outputPath, outputFormat, quality, method, width, height, preserve, jobFromRequest(req));
 
     if (!fs.existsSync(outputPath)) {
       throw new Error("Compression engine failed to produce output");
@@ -171,6 +172,7 @@ exports.compressImage = async (req, res, next) => {
     res.setHeader("X-Saved-Percent", savedPercent);
     res.setHeader("X-Compression-Ratio", compressionRatio);
     res.setHeader("X-Output-Format", finalExt.replace(".", ""));
+    res.setHeader("Server-Timing", formatServerTiming(engine.timing, engine.cached));
     if (preserve) {
       res.setHeader("X-Metadata-Preserved", "true");
     }
@@ -273,110 +275,34 @@ exports.downloadResult = async (req, res) => {
   res.sendFile(filePath);
 };
 
+/**
+ * Batch compression, streamed as a ZIP (see batchArchive.streamBatch)
+ *
+ * All files are validated first, so bad input still gets a JSON error.
+ */
 exports.compressBatch = async (req, res, next) => {
   if (!req.files || req.files.length === 0) {
     return res.status(400).json({ success: false, error: "No images uploaded" });
   }
 
-  const results = [];
-  const tempFiles = [];
-  const compressedFiles = []; // Track compressed files for ZIP
+  const tempFiles = req.files.map(file => file.path);
 
   try {
-    // Process all files
+    // Validate file content for each file before anything is streamed
     for (const file of req.files) {
-      tempFiles.push(file.path);
-
-      // Validate file content for each file
       const contentValidation = await validateFileContent(file.path);
       if (!contentValidation.valid) {
         throw new Error(`Invalid file content for ${file.originalname}: ${contentValidation.error}`);
       }
-
-      const originalExt = path.extname(file.originalname);
-      const outputPath = path.join(__dirname, "..", "output", `batch-${Date.now()}-${Math.round(Math.random() * 1E5)}-${file.filename}`);
-      tempFiles.push(outputPath);
-
-      await runCompression(file.path, outputPath, null);
-
-      if (!fs.existsSync(outputPath)) {
-        throw new Error(`Compression failed for ${file.originalname}`);
-      }
-
-      const compressedSize = fs.statSync(outputPath).size;
-      const compressionRatio = ((file.size - compressedSize) / file.size * 100).toFixed(2);
-      const savedPercent = compressionRatio;
-
-      // Generate output filename (Sanitized)
-      const safeOriginalName = path.basename(file.originalname);
-      const nameWithoutExt = safeOriginalName.substring(0, safeOriginalName.lastIndexOf(".")) || safeOriginalName;
-      const outputFilename = `${nameWithoutExt}-min${originalExt}`;
-
-      results.push({
-        filename: file.originalname,
-        outputFilename: outputFilename,
-        originalSize: file.size,
-        compressedSize: compressedSize,
-        compressionRatio: parseFloat(compressionRatio),
-        savedPercent: parseFloat(savedPercent)
-      });
-
-      compressedFiles.push({
-        path: outputPath,
-        name: outputFilename
-      });
-    }
-
-    // Set response headers for ZIP download
-    res.setHeader("X-Total-Files", compressedFiles.length.toString());
-    res.setHeader("X-Total-Original-Size", results.reduce((sum, r) => sum + r.originalSize, 0).toString());
-    res.setHeader("X-Total-Compressed-Size", results.reduce((sum, r) => sum + r.compressedSize, 0).toString());
-    res.setHeader("Content-Type", "application/zip");
-    res.setHeader("Content-Disposition", `attachment; filename="compressed-images.zip"`);
-
-    // Create ZIP archive and stream directly to response (level 6 = good balance of speed vs compression)
-    const archive = archiver("zip", { zlib: { level: 6 } });
-
-    // Handle archive errors
-    archive.on("error", (err) => {
-      cleanup(tempFiles);
-      if (!res.headersSent) {
-        res.status(500).json({ success: false, error: "Failed to create ZIP archive" });
-      }
-    });
-
-    // Cleanup after ZIP is sent
-    res.on("finish", () => {
-      cleanup(tempFiles);
-    });
-
-    res.on("close", () => {
-      cleanup(tempFiles);
-      if (!archive.finalized) {
-        archive.abort();
-      }
-    });
-
-    // Pipe archive directly to response
-    archive.pipe(res);
-
-    // Add all compressed files to ZIP
-    for (const file of compressedFiles) {
-      archive.file(file.path, { name: file.name });
     }
-
-    // Finalize the archive (this will trigger the response)
-    await archive.finalize();
-
   } catch (err) {
     cleanup(tempFiles);
     console.error("Batch compression error:", err);
-    // If headers already sent, we can't send JSON error
-    if (!res.headersSent) {
-      next(err);
-    } else {
-      console.error("Error after headers sent:", err);
-      res.end();
-    }
+    return next(err);
   }
+
+  const job = jobFromRequest(req);
+  await streamBatch(res, req.files, (file, outputPath) =>
+    runCompression(file.path, outputPath, null, undefined, undefined, undefined, undefined, undefined, job)
+  );
 };
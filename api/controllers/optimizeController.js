@@ -1,12 +1,14 @@
 const sharp = require('sharp');
 const path = require('path');
 const fs = require('fs');
-const { runCompression } = require('../services/engineService');
-const { validateFile } = require('../utils/fileValidator');
+const { runCompression, runCompressionBuffer, getCachedResult, formatServerTiming } = require('../services/engineService');
+const { validateFile, validateFileSize, validateFileFormat } = require('../utils/fileValidator');
 const { checkQuotaSoft, incrementUsage } = require('../utils/quotaManager');
 const { countOperations, validateOperationCount, getOperationBreakdown } = require('../utils/operationCounter');
 const { buildOptimizeResponse } = require('../utils/responseBuilder');
 const { validateSandboxLimits } = require('../middleware/sandboxMode');
+const { jobFromRequest } = require('../utils/concurrencyLimiter');
+const { streamBatch } = require('../services/batchArchive');
 const logger = require('../utils/logger');
 
 /**
@@ -84,7 +86,10 @@ exports.optimize = async (req, res, next) => {
             }
         }
 
-        await validateFile(req.file, userPlan, req.id);
+        // In-memory uploads skip the full-decode integrity check: the encode
+        // pipeline decodes once and reports CORRUPTED_IMAGE itself
+        const inMemory = Buffer.isBuffer(req.file.buffer);
+        const validation = await validateFile(req.file, userPlan, req.id, { decode: !inMemory });
 
         // STEP 4: Check quota (skip for sandbox)
         let quotaStatus;
@@ -105,42 +110,70 @@ exports.optimize = async (req, res, next) => {
             }
         }
 
-        // STEP 5: Get original metadata
-        const originalMetadata = await sharp(inputPath).metadata();
+        // STEP 5-6: Run optimization
         const originalSize = req.file.size;
+        let original, optimized, outputData = null, engine;
 
-        // STEP 6: Run optimization
-        const result = await runCompression(inputPath, {
-            format: params.format,
-            quality: params.quality,
-            method: params.resize?.fit || 'fit',
-            width: params.resize?.width,
-            height: params.resize?.height,
-            preserve: params.metadata === 'keep'
-        });
+        if (inMemory) {
+            // One Sharp pipeline: buffer in, buffer out, input/output info from the same run
+            const result = await runCompressionBuffer(req.file.buffer, {
+                format: params.format,
+                quality: params.quality,
+                method: params.resize?.fit || 'fit',
+                width: params.resize?.width,
+                height: params.resize?.height,
+                preserve: params.metadata === 'keep',
+                filename: req.file.originalname,
+                metadata: validation.metadata,
+                job: jobFromRequest(req)
+            });
+            original = result.input;
+            optimized = result.info;
+            outputData = result.data;
+            engine = result;
+        } else {
+            const originalMetadata = await sharp(inputPath).metadata();
+
+            const outputExt = params.format ? `.${params.format}` : path.extname(req.file.originalname);
+            outputPath = path.join(__dirname, '..', 'output', `optimized-${Date.now()}-${Math.round(Math.random() * 1E5)}${outputExt}`);
+            fs.mkdirSync(path.dirname(outputPath), { recursive: true });
 
-        outputPath = result.outputPath;
-        const optimizedMetadata = await sharp(outputPath).metadata();
-        const optimizedSize = fs.statSync(outputPath).size;
+            engine = await runCompression(
+                inputPath,
+                outputPath,
+                params.format,
+                params.quality,
+                params.resize?.fit || 'fit',
+                params.resize?.width,
+                params.resize?.height,
+                params.metadata === 'keep',
+                { ...jobFromRequest(req), pixels: validation.metadata.pixels }
+            );
+
+            const optimizedMetadata = await sharp(outputPath).metadata();
+            original = originalMetadata;
+            optimized = { ...optimizedMetadata, size: fs.statSync(outputPath).size };
+        }
+        const optimizedSize = optimized.size;
 
         // STEP 7: Increment usage (skip for sandbox)
-        if (req.user && req.user.id && !req.sandbox) {
-            incrementUsage(req.user.id);
+        if (quotaStatus?.apiKey) {
+            incrementUsage(quotaStatus.apiKey.id, req.id);
         }
 
         // STEP 8: Build response
         const response = buildOptimizeResponse(
             {
                 size: originalSize,
-                format: originalMetadata.format,
-                width: originalMetadata.width,
-                height: originalMetadata.height
+                format: original.format,
+                width: original.width,
+                height: original.height
             },
             {
                 size: optimizedSize,
-                format: optimizedMetadata.format,
-                width: optimizedMetadata.width,
-                height: optimizedMetadata.height
+                format: optimized.format,
+                width: optimized.width,
+                height: optimized.height
             },
             {
                 used: quotaStatus?.used + 1 || 0,
@@ -155,26 +188,278 @@ exports.optimize = async (req, res, next) => {
         res.setHeader('X-Optimized-Size', optimizedSize);
         res.setHeader('X-Savings-Percent', response.savings.percent);
         res.setHeader('X-Operations', operationBreakdown.join(','));
+        res.setHeader('Server-Timing', formatServerTiming(engine.timing, engine.cached));
+
+        const logSuccess = () => logger.info('Optimization successful', {
+            request_id: req.id,
+            savings: response.savings.percent + '%',
+            operations: operationBreakdown
+        });
+
+        if (outputData) {
+            res.on('finish', logSuccess);
+            res.type(optimized.format === 'jpeg' ? 'jpg' : optimized.format);
+            res.send(outputData);
+            return;
+        }
 
         res.sendFile(path.resolve(outputPath), (err) => {
             cleanup([inputPath, outputPath]);
             if (err) {
                 logger.error('Error sending file', { error: err, request_id: req.id });
             } else {
-                logger.info('Optimization successful', {
-                    request_id: req.id,
-                    savings: response.savings.percent + '%',
+                logSuccess();
+            }
+        });
+
+    } catch (error) {
+        cleanup([inputPath, outputPath]);
+        next(error);
+    }
+};
+
+/**
+ * POST /api/v1/optimize/precheck
+ * Hash-first upload negotiation
+ *
+ * Client sends the SHA-256 of the image plus the same options it would send
+ * to /optimize. On a cache hit the optimized image is returned directly
+ * (no upload, no Sharp CPU). On a miss, 404 CACHE_MISS tells the client to
+ * upload as usual. Only results the same account produced can hit.
+ *
+ * Request (application/json):
+ * - hash: string (hex SHA-256 of the original file, required)
+ * - filename: string (used to infer output format when none is given)
+ * - resize, crop, format, quality, metadata: same as /optimize
+ */
+exports.precheck = async (req, res, next) => {
+    const body = req.body || {};
+
+    if (!body.hash || !/^[a-f0-9]{64}$/i.test(body.hash)) {
+        return res.status(400).json({
+            error: 'INVALID_HASH',
+            message: 'hash must be a hex-encoded SHA-256 digest',
+            request_id: req.id
+        });
+    }
+
+    try {
+        const userPlan = req.user?.plan_id || req.user?.plan || 'free';
+        const filename = body.filename ? path.basename(String(body.filename)) : '';
+
+        const params = {
+            resize: parseJsonParam(body.resize),
+            crop: parseJsonParam(body.crop),
+            format: body.format,
+            quality: body.quality ? parseInt(body.quality) : 80,
+            metadata: body.metadata || 'strip'
+        };
+
+        const operationCount = countOperations(params);
+        const operationBreakdown = getOperationBreakdown(params);
+
+        const opValidation = validateOperationCount(operationCount, userPlan, req.id);
+        if (!opValidation.valid) {
+            return res.status(400).json({
+                error: 'OPERATION_LIMIT_EXCEEDED',
+                message: `Too many operations. ${userPlan} plan allows max ${opValidation.allowed} operations`,
+                request_id: req.id,
+                details: {
+                    requested_operations: opValidation.requested,
+                    allowed_operations: opValidation.allowed,
+                    your_plan: userPlan,
                     operations: operationBreakdown
+                }
+            });
+        }
+
+        // Scoped to the caller's account: other tenants' results are never served
+        const cached = getCachedResult(jobFromRequest(req).flow, body.hash, {
+            format: params.format || path.extname(filename).replace('.', ''),
+            quality: params.quality,
+            method: params.resize?.fit || 'fit',
+            width: params.resize?.width,
+            height: params.resize?.height,
+            preserve: params.metadata === 'keep'
+        });
+
+        if (!cached) {
+            return res.status(404).json({
+                error: 'CACHE_MISS',
+                message: 'No cached result for this image; upload it to /optimize',
+                request_id: req.id
+            });
+        }
+
+        // Same plan gates the upload would have hit (size, format, sandbox)
+        const inputExt = cached.inputFormat === 'jpeg' ? 'jpg' : cached.inputFormat;
+        const originalFile = {
+            size: cached.originalSize,
+            originalname: inputExt ? `image.${inputExt}` : filename
+        };
+        if (req.sandbox) {
+            const sandboxValidation = validateSandboxLimits(req, originalFile);
+            if (!sandboxValidation.valid) {
+                return res.status(400).json({
+                    error: sandboxValidation.error,
+                    message: sandboxValidation.message,
+                    request_id: req.id,
+                    details: sandboxValidation.details
+                });
+            }
+        }
+
+        validateFileSize(originalFile, userPlan, req.id);
+        validateFileFormat(originalFile, userPlan, req.id);
+
+        let quotaStatus;
+        if (req.user && req.user.id && !req.sandbox) {
+            quotaStatus = checkQuotaSoft(req.user.apiKey, req.id);
+            if (quotaStatus.wouldBlock) {
+                return res.status(429).json({
+                    error: 'PLAN_LIMIT_REACHED',
+                    message: `Monthly limit of ${quotaStatus.limit} images exceeded`,
+                    request_id: req.id,
+                    details: {
+                        used: quotaStatus.used,
+                        limit: quotaStatus.limit,
+                        reset_at: quotaStatus.reset_at
+                    }
                 });
             }
+            if (quotaStatus.apiKey) {
+                // Only a delivered result uses quota
+                const apiKeyId = quotaStatus.apiKey.id;
+                res.on('finish', () => {
+                    if (res.statusCode < 400) {
+                        incrementUsage(apiKeyId, req.id);
+                    }
+                });
+            }
+        }
+
+        const optimizedSize = cached.data.length;
+        const savingsPercent = parseFloat(((1 - optimizedSize / cached.originalSize) * 100).toFixed(1));
+
+        logger.info('Precheck cache hit', {
+            request_id: req.id,
+            user: req.user?.id || 'guest',
+            plan: userPlan,
+            savings: savingsPercent + '%'
         });
 
+        res.setHeader('X-Cache', 'HIT');
+        res.setHeader('X-Original-Size', cached.originalSize);
+        res.setHeader('X-Optimized-Size', optimizedSize);
+        res.setHeader('X-Savings-Percent', savingsPercent);
+        res.setHeader('X-Operations', operationBreakdown.join(','));
+        res.setHeader('Server-Timing', formatServerTiming({}, true));
+        res.type(cached.format === 'jpeg' ? 'jpg' : cached.format);
+        res.send(cached.data);
+
     } catch (error) {
-        cleanup([inputPath, outputPath]);
         next(error);
     }
 };
 
+/**
+ * POST /api/v1/optimize/batch
+ * Several images in one request, streamed back as a ZIP
+ *
+ * Every file gets the same plan checks as /optimize before anything is
+ * streamed, and the whole batch must fit in the remaining monthly quota.
+ * Images use the default settings (quality 80, metadata stripped). The
+ * archive holds one entry per image plus manifest.json (see
+ * services/batchArchive). Each image delivered in the archive uses quota.
+ *
+ * Request (multipart/form-data):
+ * - images[]: File (1-10)
+ */
+exports.optimizeBatch = async (req, res, next) => {
+    const files = req.files || [];
+    if (files.length === 0) {
+        return res.status(400).json({
+            error: 'NO_IMAGE_PROVIDED',
+            message: 'No image files provided',
+            request_id: req.id
+        });
+    }
+
+    const tempFiles = files.map(file => file.path);
+    const userPlan = req.user?.plan_id || req.user?.plan || 'free';
+    const pixels = new Map();
+    let quotaStatus;
+
+    try {
+        for (const file of files) {
+            if (req.sandbox) {
+                const sandboxValidation = validateSandboxLimits(req, file);
+                if (!sandboxValidation.valid) {
+                    cleanup(tempFiles);
+                    return res.status(400).json({
+                        error: sandboxValidation.error,
+                        message: sandboxValidation.message,
+                        request_id: req.id,
+                        details: { ...sandboxValidation.details, filename: file.originalname }
+                    });
+                }
+            }
+
+            const validation = await validateFile(file, userPlan, req.id);
+            pixels.set(file, validation.metadata.pixels);
+        }
+
+        if (req.user && req.user.id && !req.sandbox) {
+            quotaStatus = checkQuotaSoft(req.user.apiKey, req.id);
+            if (quotaStatus.wouldBlock || quotaStatus.used + files.length > quotaStatus.limit) {
+                cleanup(tempFiles);
+                return res.status(429).json({
+                    error: 'PLAN_LIMIT_REACHED',
+                    message: `Monthly limit of ${quotaStatus.limit} images exceeded`,
+                    request_id: req.id,
+                    details: {
+                        used: quotaStatus.used,
+                        limit: quotaStatus.limit,
+                        requested: files.length,
+                        reset_at: quotaStatus.reset_at
+                    }
+                });
+            }
+        }
+    } catch (error) {
+        cleanup(tempFiles);
+        return next(error);
+    }
+
+    logger.info('Batch optimize request', {
+        request_id: req.id,
+        user: req.user?.id || 'guest',
+        plan: userPlan,
+        files: files.length,
+        sandbox: req.sandbox || false
+    });
+
+    const job = jobFromRequest(req);
+    const outcome = await streamBatch(res, files, (file, outputPath) =>
+        runCompression(file.path, outputPath, null, 80, 'fit', undefined, undefined, false, { ...job, pixels: pixels.get(file) })
+    );
+
+    // null: the client went away before the archive was complete
+    if (outcome && quotaStatus?.apiKey) {
+        for (const entry of outcome.results) {
+            if (!entry.error) {
+                incrementUsage(quotaStatus.apiKey.id, req.id);
+            }
+        }
+    }
+};
+
+// Options arrive as JSON strings (multipart) or objects (JSON body)
+const parseJsonParam = (value) => {
+    if (!value) return null;
+    return typeof value === 'string' ? JSON.parse(value) : value;
+};
+
 // Helper to cleanup files
 const cleanup = (files) => {
     if (!files) return;
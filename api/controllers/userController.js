@@ -5,6 +5,8 @@ const crypto = require('crypto');
 const bcrypt = require('bcrypt');
 const { sanitizeString, isValidEmail } = require('../utils/validation');
 const db = require('../services/db');
+const authCache = require('../utils/authCache');
+const usageCounters = require('../utils/usageCounters');
 
 // --- Helper: Parse User from DB ---
 const parseUser = (user) => {
@@ -181,31 +183,77 @@ exports.verifyToken = (req, res) => {
     });
 };
 
-// --- Check Limit (Used by Auth Middleware) ---
-exports.checkLimit = async (providedKey) => {
+// --- API Key Lookup (cached, see utils/authCache) ---
+const credentialOf = (user) => user.apiKeyHash || user.apiKey;
+
+const loadUserById = (id) => {
+    const row = db.prepare('SELECT * FROM users WHERE id = ?').get(id);
+    return row ? { credential: credentialOf(row), user: parseUser(row) } : null;
+};
+
+const findUserByKey = async (providedKey) => {
+    const cached = authCache.get(providedKey, loadUserById);
+    if (cached) return cached;
+
     // Get all users to check hash
     const users = db.prepare('SELECT * FROM users').all();
 
-    let matchedUser = null;
-
     // Find user by comparing hashes
     for (const user of users) {
+        let isMatch = false;
+
         if (user.apiKeyHash) {
-            const isMatch = await bcrypt.compare(providedKey, user.apiKeyHash);
-            if (isMatch) {
-                matchedUser = user;
-                break;
-            }
+            isMatch = await bcrypt.compare(providedKey, user.apiKeyHash);
         } else if (user.apiKey === providedKey) {
             // Fallback for users not yet migrated
-            matchedUser = user;
-            break;
+            isMatch = true;
+        }
+
+        if (isMatch) {
+            const parsedUser = parseUser(user);
+            authCache.set(providedKey, user.id, credentialOf(user), parsedUser);
+            return parsedUser;
         }
     }
 
+    return null;
+};
+
+// Stored usage plus this process's unflushed increments (same split as the flush)
+const withPendingUsage = (user) => {
+    const pending = usageCounters.pending('user', user.id);
+    const fromPlan = Math.min(pending, Math.max(user.apiCredits - user.usage, 0));
+    return {
+        ...user,
+        usage: user.usage + fromPlan,
+        credits: Math.max(user.credits - (pending - fromPlan), 0)
+    };
+};
+
+// Written usage makes cached snapshots stale
+usageCounters.onFlush((entries) => {
+    authCache.markStale(entries.filter(entry => entry.kind === 'user').map(entry => entry.id));
+});
+
+// Users this close to their limit have usage re-read on every check: the
+// cached snapshot misses what other cluster processes flushed since it loaded
+const USAGE_RECHECK_MARGIN = parseInt(process.env.USAGE_RECHECK_MARGIN || '100', 10);
+
+const withStoredUsage = (user) => {
+    const row = db.prepare('SELECT usage, credits FROM users WHERE id = ?').get(user.id);
+    return row ? { ...user, usage: Number(row.usage), credits: Number(row.credits) } : user;
+};
+
+// --- Check Limit (Used by Auth Middleware) ---
+exports.checkLimit = async (providedKey) => {
+    const matchedUser = await findUserByKey(providedKey);
+
     if (!matchedUser) return { allowed: false, user: null };
 
-    const parsedUser = parseUser(matchedUser);
+    let parsedUser = withPendingUsage(matchedUser);
+    if (parsedUser.apiCredits - parsedUser.usage + parsedUser.credits <= USAGE_RECHECK_MARGIN) {
+        parsedUser = withPendingUsage(withStoredUsage(matchedUser));
+    }
     const planConfig = PLANS[parsedUser.plan] || PLANS.free;
 
     let allowed = false;
@@ -222,30 +270,11 @@ exports.checkLimit = async (providedKey) => {
     return { allowed, user: parsedUser, error };
 };
 
+// Buffered; plan usage first, then prepaid credits (see utils/usageCounters)
 exports.incrementUsage = async (providedKey) => {
-    const users = db.prepare('SELECT * FROM users').all();
-
-    for (const user of users) {
-        let isMatch = false;
-
-        if (user.apiKeyHash) {
-            isMatch = await bcrypt.compare(providedKey, user.apiKeyHash);
-        } else if (user.apiKey === providedKey) {
-            isMatch = true;
-        }
-
-        if (isMatch) {
-            const parsedUser = parseUser(user);
-
-            if (parsedUser.usage < parsedUser.apiCredits) {
-                db.prepare('UPDATE users SET usage = usage + 1, lastUsedDate = ? WHERE id = ?')
-                    .run(new Date().toISOString(), user.id);
-            } else if (parsedUser.credits > 0) {
-                db.prepare('UPDATE users SET credits = credits - 1, lastUsedDate = ? WHERE id = ?')
-                    .run(new Date().toISOString(), user.id);
-            }
-            break;
-        }
+    const user = await findUserByKey(providedKey);
+    if (user) {
+        usageCounters.add('user', user.id);
     }
 };
 
@@ -272,6 +301,7 @@ exports.upgradeUserPlan = (email, planName, paymentId) => {
 
         db.prepare(`UPDATE users SET credits = ?, lastPaymentId = ? WHERE email = ?`)
             .run(newCredits, paymentId, email);
+        authCache.invalidateUser(user.id);
 
         user.credits = newCredits;
         return user;
@@ -289,6 +319,7 @@ exports.upgradeUserPlan = (email, planName, paymentId) => {
 
     db.prepare(`UPDATE users SET plan = ?, lastPaymentId = ?, planUpdatedAt = ? WHERE email = ?`)
         .run(targetPlan, paymentId, planUpdatedAt, email);
+    authCache.invalidateUser(user.id);
 
     user.plan = targetPlan;
     return user;
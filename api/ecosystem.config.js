@@ -22,6 +22,12 @@ module.exports = {
                 // With 2-core cluster (2 processes × 3 jobs) = 6 max concurrent jobs.
                 // Each job uses 1 Sharp thread. Total libvips threads = 6 max.
                 MAX_CONCURRENT_JOBS: 3,
+                // Waiting jobs per process before fast 503 SERVER_BUSY + Retry-After.
+                MAX_QUEUED_JOBS: 30,
+                // "pool" moves encodes into one worker process per core (see
+                // services/enginePool.js). Use it with instances: 1 so the
+                // cluster and the pool don't both claim every core.
+                ENGINE_MODE: "inline",
             },
 
             // ─── Logging ─────────────────────────────────────────────────────────
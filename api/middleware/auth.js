@@ -1,5 +1,6 @@
 const { checkLimit, incrementUsage } = require('../controllers/userController');
 const db = require('../services/db');
+const logger = require('../utils/logger');
 
 /**
  * Auth Middleware
@@ -40,7 +41,13 @@ module.exports = async (req, res, next) => {
     const authHeader = req.headers.authorization;
     const apiKeyHeader = req.headers['x-api-key'];
 
-    console.log(`[AuthMiddleware] ${req.method} ${req.url} - AuthHeader: ${authHeader ? 'Yes' : 'No'}, ApiKeyHeader: ${apiKeyHeader ? 'Yes' : 'No'}`);
+    logger.debug('Auth check', {
+        method: req.method,
+        url: req.url,
+        auth_header: !!authHeader,
+        api_key_header: !!apiKeyHeader,
+        request_id: req.id
+    });
 
     let token = null;
 
@@ -71,10 +78,14 @@ module.exports = async (req, res, next) => {
         return next();
     }
 
-    // Validate Token against DB (now async with bcrypt)
-    console.log(`[AuthMiddleware] Checking limit for token: ${token.substring(0, 10)}...`);
+    // Validate Token (bcrypt on first use, then served from the auth cache)
     const result = await checkLimit(token);
-    console.log(`[AuthMiddleware] Check result: allowed=${result.allowed}, user=${result.user ? 'Yes' : 'No'}`);
+    logger.debug('API key checked', {
+        key: token.substring(0, 10),
+        allowed: result.allowed,
+        user_found: !!result.user,
+        request_id: req.id
+    });
 
     // If the token is invalid (no user found), reject immediately
     if (!result.user) {
@@ -91,7 +102,7 @@ module.exports = async (req, res, next) => {
     req.user = result.user;
     req.apiKey = token;
 
-    // Increment usage on successful compression (now async)
+    // Increment usage on successful compression (buffered, see utils/usageCounters)
     res.on('finish', async () => {
         const isCompress = req.originalUrl && req.originalUrl.includes('/api/compress');
         const isSuccess = res.statusCode >= 200 && res.statusCode < 300;
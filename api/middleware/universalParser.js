@@ -4,9 +4,23 @@ const path = require("path");
 const https = require("https");
 const http = require("http");
 const { sanitizeFilename } = require("../utils/fileValidation");
+const { validatingStorage } = require("../utils/uploadValidator");
+
+// Web plans (userController.PLANS) cap only the file size; any supported
+// image format and resolution is accepted. Guests get 5MB.
+const WEB_FORMATS = ['jpeg', 'png', 'webp', 'avif'];
+
+const webUploadLimits = (req) => {
+    const { PLANS } = require("../controllers/userController");
+    return {
+        max_file_size: (req.user && PLANS[req.user.plan]?.maxFileSize) || 5 * 1024 * 1024,
+        allowed_formats: WEB_FORMATS,
+        maxPixels: Infinity
+    };
+};
 
-// Configure Multer Storage (Standard Multipart)
-const storage = multer.diskStorage({
+// Configure Multer Storage (Standard Multipart), checked while it streams in
+const storage = validatingStorage(multer.diskStorage({
     destination: (req, file, cb) => {
         const uploadDir = path.join(__dirname, '../uploads');
         if (!fs.existsSync(uploadDir)) fs.mkdirSync(uploadDir, { recursive: true });
@@ -16,7 +30,7 @@ const storage = multer.diskStorage({
         const uniqueName = `${Date.now()}-${Math.round(Math.random() * 1E9)}-${sanitizeFilename(file.originalname)}`;
         cb(null, uniqueName);
     }
-});
+}), webUploadLimits);
 
 const upload = multer({
     storage: storage,
@@ -149,3 +163,5 @@ exports.universalParser = async (req, res, next) => {
     // Fallback / Unknown
     next();
 };
+
+exports.webUploadLimits = webUploadLimits;
@@ -9,6 +9,9 @@ router.use(adminAuth);
 // System statistics
 router.get('/stats', adminController.getStats);
 
+// Compression scheduler metrics (per-plan queue depth, wait time, shed counts)
+router.get('/scheduler', adminController.getScheduler);
+
 // User management
 router.get('/users', adminController.getAllUsers);
 router.get('/users/:id', adminController.getUserDetails);
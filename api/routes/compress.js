@@ -2,7 +2,9 @@ const express = require("express");
 const multer = require("multer");
 const { compressImage, compressBatch } = require("../controllers/compressController");
 const { sanitizeFilename, validateFileSize, validateFileContent } = require("../utils/fileValidation");
-const { universalParser } = require("../middleware/universalParser");
+const { universalParser, webUploadLimits } = require("../middleware/universalParser");
+const { validatingStorage } = require("../utils/uploadValidator");
+const { APIError } = require("../utils/errors");
 
 
 
@@ -30,7 +32,8 @@ const anonymousLimiter = (req, res, next) => {
 
 const path = require("path");
 
-const storage = multer.diskStorage({
+// Each file is checked against the web plan's size limit while it streams in
+const storage = validatingStorage(multer.diskStorage({
   destination: (req, file, cb) => {
     cb(null, path.join(__dirname, "../uploads"));
   },
@@ -45,7 +48,7 @@ const storage = multer.diskStorage({
       cb(new Error("Invalid filename"), null);
     }
   }
-});
+}), webUploadLimits);
 
 const upload = multer({
   storage: storage,
@@ -55,22 +58,29 @@ const upload = multer({
   }
 });
 
+// Uploads rejected while streaming (uploadValidator) keep this API's
+// { success, error } shape, which the web client shows as is
+const legacyUploadError = (err, req, res, next) => {
+  if (!(err instanceof APIError) || res.headersSent) return next(err);
+  res.status(err.statusCode).json({ success: false, error: err.message });
+};
+
 /**
  * Single Image Compression
  * Returns binary image
  */
-router.post("/", anonymousLimiter, universalParser, compressImage);
+router.post("/", anonymousLimiter, universalParser, legacyUploadError, compressImage);
 
 /**
  * TinyPNG-compatible endpoint alias
  */
-router.post("/shrink", anonymousLimiter, universalParser, compressImage);
+router.post("/shrink", anonymousLimiter, universalParser, legacyUploadError, compressImage);
 
 /**
  * Batch Compression
  * Returns ZIP file with compressed images
  */
-router.post("/batch", anonymousLimiter, upload.array("images[]"), compressBatch);
+router.post("/batch", anonymousLimiter, upload.array("images[]"), legacyUploadError, compressBatch);
 
 /**
  * Result Download
@@ -2,15 +2,26 @@ const express = require('express');
 const router = express.Router();
 const multer = require('multer');
 const path = require('path');
+const fs = require('fs');
 const authMiddleware = require('../../middleware/auth');
 const { sandboxMode } = require('../../middleware/sandboxMode');
 const { addRateLimitHeaders } = require('../../middleware/rateLimitHeaders');
-const { optimize } = require('../../controllers/optimizeController');
+const { optimize, precheck, optimizeBatch } = require('../../controllers/optimizeController');
+const { validatingStorage } = require('../../utils/uploadValidator');
 
 // Multer configuration
-const storage = multer.diskStorage({
+// OPTIMIZE_STORAGE=memory (default): uploads stay in a Buffer and are encoded
+// in one Sharp pipeline, no temp files. OPTIMIZE_STORAGE=disk keeps the
+// original temp-file flow (useful for comparing the two, see scripts/bench/bench_optimize_pipeline.py)
+// Either way, format, dimensions and size are checked against the plan from
+// the header while the upload streams in (utils/uploadValidator.js)
+const OPTIMIZE_STORAGE = process.env.OPTIMIZE_STORAGE === 'disk' ? 'disk' : 'memory';
+
+const diskStorage = multer.diskStorage({
     destination: (req, file, cb) => {
-        cb(null, path.join(__dirname, '../uploads'));
+        const uploadDir = path.join(__dirname, '../../uploads');
+        fs.mkdirSync(uploadDir, { recursive: true });
+        cb(null, uploadDir);
     },
     filename: (req, file, cb) => {
         const uniqueName = `${Date.now()}-${Math.round(Math.random() * 1E9)}${path.extname(file.originalname)}`;
@@ -18,20 +29,32 @@ const storage = multer.diskStorage({
     }
 });
 
+const imageFilter = (req, file, cb) => {
+    const allowedTypes = /jpeg|jpg|png|webp|avif/;
+    const extname = allowedTypes.test(path.extname(file.originalname).toLowerCase());
+    const mimetype = allowedTypes.test(file.mimetype);
+
+    if (extname && mimetype) {
+        cb(null, true);
+    } else {
+        cb(new Error('Only image files (JPG, PNG, WebP, AVIF) are allowed'));
+    }
+};
+
 const upload = multer({
-    storage,
+    storage: validatingStorage(OPTIMIZE_STORAGE === 'memory' ? multer.memoryStorage() : diskStorage),
     limits: { fileSize: 50 * 1024 * 1024 }, // 50MB max (will be validated by plan)
-    fileFilter: (req, file, cb) => {
-        const allowedTypes = /jpeg|jpg|png|webp|avif/;
-        const extname = allowedTypes.test(path.extname(file.originalname).toLowerCase());
-        const mimetype = allowedTypes.test(file.mimetype);
+    fileFilter: imageFilter
+});
 
-        if (extname && mimetype) {
-            cb(null, true);
-        } else {
-            cb(new Error('Only image files (JPG, PNG, WebP, AVIF) are allowed'));
-        }
-    }
+// Batches always go to disk: the ZIP is streamed file by file and the
+// uploads are removed once it is sent
+const BATCH_MAX_FILES = 10;
+
+const batchUpload = multer({
+    storage: validatingStorage(diskStorage),
+    limits: { fileSize: 50 * 1024 * 1024 },
+    fileFilter: imageFilter
 });
 
 /**
@@ -55,6 +78,44 @@ router.post('/optimize',
     optimize
 );
 
+/**
+ * @route   POST /api/v1/optimize/precheck
+ * @desc    Hash-first negotiation: returns a cached optimized image without upload
+ * @access  Public (with API key) or Authenticated
+ *
+ * Request (application/json):
+ * - hash: string (SHA-256 of the original image)
+ * - filename: string (optional, used when no format is given)
+ * - resize, crop, format, quality, metadata: same as /optimize
+ *
+ * Responses: 200 image (X-Cache: HIT) | 404 CACHE_MISS
+ */
+router.post('/optimize/precheck',
+    authMiddleware,
+    sandboxMode,
+    addRateLimitHeaders,
+    precheck
+);
+
+/**
+ * @route   POST /api/v1/optimize/batch
+ * @desc    Up to 10 images in one request, returned as a streamed ZIP
+ * @access  Public (with API key) or Authenticated
+ *
+ * Request (multipart/form-data):
+ * - images[]: File (1-10), each checked against the plan like /optimize
+ *
+ * Response: application/zip with one "<name>-min<ext>" entry per image and a
+ * final manifest.json; totals also arrive as X-Total-* trailers
+ */
+router.post('/optimize/batch',
+    authMiddleware,
+    sandboxMode,
+    addRateLimitHeaders,
+    batchUpload.array('images[]', BATCH_MAX_FILES),
+    optimizeBatch
+);
+
 /**
  * @route   GET /api/v1/limits
  * @desc    Get plan limits for authenticated user
@@ -69,7 +69,7 @@ app.use(cors({
     process.env.FRONTEND_URL
   ].filter(Boolean),
   credentials: true,
-  exposedHeaders: ["X-Original-Size", "X-Compressed-Size", "X-Saved-Percent", "X-Compression-Ratio", "X-Output-Format", "X-Compression-Count"]
+  exposedHeaders: ["X-Original-Size", "X-Compressed-Size", "X-Saved-Percent", "X-Compression-Ratio", "X-Output-Format", "X-Compression-Count", "Server-Timing"]
 }));
 
 // Body parser with size limits
@@ -203,6 +203,21 @@ app.use((err, req, res, next) => {
   // Don't log sensitive error details in production
   const isDevelopment = process.env.NODE_ENV === 'development';
 
+  // Structured API errors (utils/errors.js, fileValidator) keep their status and code
+  if (err.statusCode && err.code && !res.headersSent) {
+    // 503 SERVER_BUSY / 429 quota errors tell clients when to come back
+    if (err.retryAfter !== undefined) {
+      res.setHeader("Retry-After", String(err.retryAfter));
+    }
+    return res.status(err.statusCode).json({
+      error: err.code,
+      message: err.message,
+      request_id: req.id,
+      details: err.details || {},
+      docs_url: err.docs_url || `https://docs.shrinkix.com/errors/${err.code}`
+    });
+  }
+
   // Multer Error
   if (err.code === "LIMIT_FILE_SIZE") {
     return res.status(413).json({ success: false, error: "File too large" });
@@ -244,7 +259,7 @@ app.use((err, req, res, next) => {
 });
 
 const PORT = process.env.PORT || 5001;
-app.listen(PORT, '0.0.0.0', () => {
+const server = app.listen(PORT, '0.0.0.0', () => {
   console.log(`✅ API running on http://localhost:${PORT}`);
 
   // Safety Net: Cleanup old files every 1 hour
@@ -275,3 +290,23 @@ app.listen(PORT, '0.0.0.0', () => {
     });
   }, 60 * 60 * 1000); // 1 hour
 });
+
+// Graceful shutdown: pm2 sends SIGINT, then SIGKILL after kill_timeout (5s).
+// Stop accepting connections, let in-flight requests finish, then write
+// buffered usage counts before exiting.
+const usageCounters = require("./utils/usageCounters");
+const SHUTDOWN_TIMEOUT_MS = 4000;
+
+function shutdown(signal) {
+  console.log(`${signal} received, shutting down...`);
+  const exit = () => {
+    usageCounters.close();
+    process.exit(0);
+  };
+  server.close(exit);
+  // Keep-alive or slow uploads must not outlast kill_timeout
+  setTimeout(exit, SHUTDOWN_TIMEOUT_MS).unref();
+}
+
+process.once("SIGINT", shutdown);
+process.once("SIGTERM", shutdown);
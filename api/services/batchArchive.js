@@ -0,0 +1,159 @@
+/**
+ * Batch Archive
+ *
+ * Streams a ZIP of compressed outputs. The response starts immediately, files
+ * compress concurrently (bounded by the engine's concurrency limiter) and each
+ * output is appended as soon as it is ready. Images are already compressed,
+ * so entries are stored rather than deflated. Totals are only known at the
+ * end: they are sent as HTTP trailers and in a final manifest.json entry.
+ */
+
+const path = require("path");
+const fs = require("fs");
+const archiver = require("archiver");
+
+const OUTPUT_DIR = path.join(__dirname, "..", "output");
+
+// Totals are only known once every entry is done, so they travel as trailers
+const BATCH_TRAILERS = ["X-Total-Files", "X-Failed-Files", "X-Total-Original-Size", "X-Total-Compressed-Size"];
+
+const removeFiles = (files) => {
+  for (const file of files) {
+    try {
+      if (fs.existsSync(file)) fs.unlinkSync(file);
+    } catch (e) {
+      console.error("Cleanup error:", e);
+    }
+  }
+};
+
+// "<name>-min<ext>", numbered when the name is already taken in this archive
+function entryName(originalname, usedNames) {
+  const safeOriginalName = path.basename(originalname);
+  const originalExt = path.extname(safeOriginalName);
+  const nameWithoutExt = safeOriginalName.substring(0, safeOriginalName.lastIndexOf(".")) || safeOriginalName;
+
+  let name = `${nameWithoutExt}-min${originalExt}`;
+  for (let n = 2; usedNames.has(name); n++) {
+    name = `${nameWithoutExt}-min-${n}${originalExt}`;
+  }
+  usedNames.add(name);
+  return name;
+}
+
+/**
+ * Stream `files` (multer disk files) through `compressOne` into a ZIP response
+ *
+ * @param {Object} res - Express response (nothing may have been sent yet)
+ * @param {Array} files - { path, originalname, filename, size }; removed when done
+ * @param {Function} compressOne - async (file, outputPath) writing the output to
+ *   outputPath; a throw marks the entry as failed in the manifest
+ * @returns {Promise<{results: Array, totals: Object}|null>} null when the client went away
+ */
+async function streamBatch(res, files, compressOne) {
+  const tempFiles = files.map(file => file.path);
+
+  res.setHeader("Content-Type", "application/zip");
+  res.setHeader("Content-Disposition", `attachment; filename="compressed-images.zip"`);
+  res.setHeader("Trailer", BATCH_TRAILERS.join(", "));
+
+  // Only manifest.json is deflated; image entries use store: true
+  const archive = archiver("zip", { zlib: { level: 6 } });
+  let aborted = false;
+
+  archive.on("error", (err) => {
+    aborted = true;
+    removeFiles(tempFiles);
+    console.error("Batch ZIP error:", err);
+    if (!res.headersSent) {
+      res.status(500).json({ success: false, error: "Failed to create ZIP archive" });
+    } else {
+      res.destroy(err);
+    }
+  });
+
+  // Cleanup after ZIP is sent
+  res.on("finish", () => {
+    removeFiles(tempFiles);
+  });
+
+  res.on("close", () => {
+    if (!res.writableFinished) {
+      aborted = true;
+      archive.abort();
+    }
+    removeFiles(tempFiles);
+  });
+
+  archive.pipe(res);
+  fs.mkdirSync(OUTPUT_DIR, { recursive: true });
+
+  const usedNames = new Set();
+  const results = await Promise.all(files.map(async (file) => {
+    const outputPath = path.join(OUTPUT_DIR, `batch-${Date.now()}-${Math.round(Math.random() * 1E5)}-${file.filename}`);
+    tempFiles.push(outputPath);
+
+    try {
+      await compressOne(file, outputPath);
+      if (!fs.existsSync(outputPath)) {
+        throw new Error(`Compression failed for ${file.originalname}`);
+      }
+    } catch (err) {
+      console.error(`Batch entry failed (${file.originalname}):`, err.message);
+      return { filename: file.originalname, error: err.message };
+    }
+
+    const compressedSize = fs.statSync(outputPath).size;
+    const compressionRatio = ((file.size - compressedSize) / file.size * 100).toFixed(2);
+    const outputFilename = entryName(file.originalname, usedNames);
+
+    // Append as soon as this entry is ready (archiver writes entries in append order)
+    if (!aborted) {
+      archive.file(outputPath, { name: outputFilename, store: true });
+    }
+
+    return {
+      filename: file.originalname,
+      outputFilename: outputFilename,
+      originalSize: file.size,
+      compressedSize: compressedSize,
+      compressionRatio: parseFloat(compressionRatio),
+      savedPercent: parseFloat(compressionRatio)
+    };
+  }));
+
+  if (aborted) {
+    // Client went away mid-batch: outputs finished after the close still need removing
+    removeFiles(tempFiles);
+    return null;
+  }
+
+  const succeeded = results.filter(r => !r.error);
+  const totals = {
+    files: succeeded.length,
+    failed: results.length - succeeded.length,
+    originalSize: succeeded.reduce((sum, r) => sum + r.originalSize, 0),
+    compressedSize: succeeded.reduce((sum, r) => sum + r.compressedSize, 0)
+  };
+
+  archive.append(JSON.stringify({ files: results, totals }, null, 2), { name: "manifest.json" });
+
+  // Trailers go out with the final chunk
+  res.addTrailers({
+    "X-Total-Files": totals.files.toString(),
+    "X-Failed-Files": totals.failed.toString(),
+    "X-Total-Original-Size": totals.originalSize.toString(),
+    "X-Total-Compressed-Size": totals.compressedSize.toString()
+  });
+
+  // Finalize the archive (ends the response once all entries are written)
+  try {
+    await archive.finalize();
+  } catch (err) {
+    // Already reported by the archive "error" handler
+  }
+
+  return { results, totals };
+}
+
+module.exports = { streamBatch, entryName, BATCH_TRAILERS };
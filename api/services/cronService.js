@@ -1,5 +1,7 @@
 const cron = require('node-cron');
 const db = require('./db');
+const usageCounters = require('../utils/usageCounters');
+const authCache = require('../utils/authCache');
 
 const initCron = () => {
     console.log('⏰ Initializing Cron Jobs...');
@@ -30,7 +32,10 @@ const initCron = () => {
     cron.schedule('0 0 1 * *', () => {
         console.log('📅 Running Monthly Usage Reset Job...');
         try {
+            // Write buffered usage first so it counts toward the closing month
+            usageCounters.flush();
             const info = db.prepare('UPDATE users SET usage = 0').run();
+            authCache.clear();
             console.log(`✅ Monthly usage reset complete. Updated ${info.changes} users.`);
         } catch (error) {
             console.error('❌ Monthly Reset Job Failed:', error);
@@ -2,8 +2,8 @@ const Database = require('better-sqlite3');
 const path = require('path');
 const fs = require('fs');
 
-// Database File Path
-const DB_PATH = path.join(__dirname, '../data/users.db');
+// Database File Path (DB_PATH overrides, e.g. ':memory:' in unit tests)
+const DB_PATH = process.env.DB_PATH || path.join(__dirname, '../data/users.db');
 const JSON_DB_PATH = path.join(__dirname, '../data/users.json');
 
 // Ensure data directory exists
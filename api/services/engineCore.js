@@ -0,0 +1,168 @@
+/**
+ * Engine Core
+ *
+ * The Sharp encode steps shared by engineService (in-process) and the
+ * engine pool workers (ENGINE_MODE=pool). Nothing here touches the
+ * scheduler, cache or database, so a worker process can load it alone.
+ */
+
+const sharp = require("sharp");
+const path = require("path");
+const fs = require("fs");
+const { CorruptedImageError, isCorruptedImageError } = require("../utils/errors");
+
+// Output format: explicit format wins, otherwise inferred from the output extension
+function resolveTargetFormat(format, output) {
+  let targetFormat = format ? format.toLowerCase() : path.extname(output || '').replace('.', '').toLowerCase();
+  if (targetFormat === 'jpg') targetFormat = 'jpeg';
+  return targetFormat;
+}
+
+// Same truthiness rules as the metadata step in compressFile
+function wantsMetadata(preserve) {
+  if (Array.isArray(preserve)) return preserve.length > 0;
+  return !!preserve && preserve !== 'false';
+}
+
+async function compressFile(input, output, format, quality, method, width, height, preserve) {
+  try {
+    // Get input file size for comparison
+    const inputSize = fs.statSync(input).size;
+
+    const pipeline = sharp(input);
+    applyOperations(pipeline, resolveTargetFormat(format, output), inputSize, { quality, method, width, height, preserve });
+
+    // 4. Output
+    await pipeline.toFile(output);
+
+    // 5. Smart Size Check - Return original if compressed is larger
+    const outputSize = fs.statSync(output).size;
+
+    // If output is larger than input (compression made it worse)
+    if (outputSize >= inputSize && !width && !height && !format) {
+      // Only return original if we're not resizing or converting format
+      // Copy original to output location
+      fs.copyFileSync(input, output);
+      console.log(`⚠️ Compression increased size (${inputSize} -> ${outputSize}). Returning original.`);
+    }
+
+    return "Compression successful";
+
+  } catch (error) {
+    throw new Error(`Compression failed: ${error.message}`);
+  }
+}
+
+/**
+ * Single-pipeline, in-memory compression
+ * When the caller already read the input header from `pipeline`, each image
+ * is decoded once and never touches the disk.
+ *
+ * @returns {Promise<{data: Buffer, info: Object, input: Object, keptOriginal: boolean}>}
+ */
+async function compressBuffer(pipeline, input, inputInfo, targetFormat, { format, quality, method, width, height, preserve }) {
+  applyOperations(pipeline, targetFormat, input.length, { quality, method, width, height, preserve });
+
+  let data, info;
+  try {
+    ({ data, info } = await pipeline.toBuffer({ resolveWithObject: true }));
+  } catch (error) {
+    // Header parsed but pixel data did not decode
+    if (isCorruptedImageError(error)) {
+      throw new CorruptedImageError();
+    }
+    throw new Error(`Compression failed: ${error.message}`);
+  }
+
+  // Return original if compression made it larger (only without resize/convert)
+  if (data.length >= input.length && !width && !height && !format) {
+    return { data: input, info: { ...inputInfo }, input: inputInfo, keptOriginal: true };
+  }
+
+  return {
+    data,
+    info: { format: apiFormat(info.format), width: info.width, height: info.height, size: info.size },
+    input: inputInfo,
+    keptOriginal: false
+  };
+}
+
+// libvips reports AVIF as its container format
+function apiFormat(format) {
+  return format === 'heif' ? 'avif' : format;
+}
+
+// Adaptive quality based on file size (CPU-friendly settings)
+function adaptiveQuality(inputSize) {
+  if (inputSize < 50 * 1024) {
+    // Small files (< 50KB) - likely already optimized
+    return 90; // High quality to avoid re-encoding bloat
+  } else if (inputSize < 500 * 1024) {
+    // Medium files (50KB - 500KB)
+    return 82;
+  } else if (inputSize < 2 * 1024 * 1024) {
+    // Large files (500KB - 2MB)
+    return 78; // Reduced from 75 to balance quality and CPU usage
+  }
+  // Very large files (> 2MB) - reduce CPU load significantly
+  return 75; // Conservative compression to prevent CPU overload
+}
+
+// Resize, format/quality and metadata steps shared by the file and buffer pipelines
+function applyOperations(pipeline, targetFormat, inputSize, { quality, method, width, height, preserve }) {
+  // 1. Resize
+  if (width || height) {
+    // Parse integers if they are strings
+    const w = width ? parseInt(width) : null;
+    const h = height ? parseInt(height) : null;
+
+    // Method mapping: 'fit' -> { fit: 'inside' }, 'fill' -> { fit: 'cover' }
+    // Default to 'inside' to preserve aspect ratio within box, unless otherwise specified
+    const options = {
+      fit: method === 'fill' ? 'cover' : 'inside',
+      withoutEnlargement: true
+    };
+
+    pipeline.resize(w, h, options);
+  }
+
+  // 2. Format & Quality
+  // Smart Quality Selection
+  // For small files (already optimized), use higher quality to avoid size increase
+  // For large files, use more aggressive compression
+  const q = quality ? parseInt(quality) : adaptiveQuality(inputSize);
+
+  // Apply format-specific options
+  if (targetFormat === 'jpeg') {
+    pipeline.jpeg({ quality: q, mozjpeg: true });
+  } else if (targetFormat === 'png') {
+    pipeline.png({ quality: q, compressionLevel: 6 }); // level 9 = max CPU; 6 = good balance
+  } else if (targetFormat === 'webp') {
+    pipeline.webp({ quality: q, effort: 4 }); // effort 4 = balanced compression/speed for production
+  } else if (targetFormat === 'avif') {
+    pipeline.avif({ quality: q, effort: 3 }); // effort 3 = good quality, much less CPU than 4
+  } else {
+    // Fallback for others or if format detection failed
+    // (Sharp infers from toFile extension if not explicit; buffers keep the input format)
+  }
+
+  // 3. Metadata Preservation (TinyPNG-compatible)
+  // TinyPNG supports: copyright, creation, location
+  // Sharp's withMetadata() preserves: exif, icc, xmp
+  // Sharp doesn't support selective metadata preservation, so any requested
+  // option (true, 'true', ["copyright", ...], "copyright,creation") keeps all
+  if (wantsMetadata(preserve)) {
+    pipeline.withMetadata();
+  }
+
+  return pipeline;
+}
+
+module.exports = {
+  compressFile,
+  compressBuffer,
+  applyOperations,
+  apiFormat,
+  resolveTargetFormat,
+  wantsMetadata
+};
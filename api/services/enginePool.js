@@ -0,0 +1,145 @@
+/**
+ * Engine Worker Pool (ENGINE_MODE=pool)
+ *
+ * Runs Sharp compression in child processes instead of the API process.
+ * The pool has ENGINE_WORKERS processes, one per available core by default.
+ * Each worker runs one job at a time with ENGINE_VIPS_THREADS libvips
+ * threads (default 1). Workers have their own libvips and libuv thread
+ * pools, so encodes use every core while the API process stays free for
+ * upload parsing and JSON handling.
+ *
+ * Every job reports the worker's CPU time, which responses expose via
+ * Server-Timing. A worker that dies fails its current job and is replaced.
+ */
+
+const { fork } = require("child_process");
+const os = require("os");
+const path = require("path");
+const { CorruptedImageError } = require("../utils/errors");
+const logger = require("../utils/logger");
+
+const ENABLED = process.env.ENGINE_MODE === 'pool';
+const POOL_SIZE = parseInt(process.env.ENGINE_WORKERS || String(availableCores()), 10);
+const VIPS_THREADS = parseInt(process.env.ENGINE_VIPS_THREADS || '1', 10);
+
+const workers = new Set();
+const idle = [];
+const pending = [];
+let nextId = 0;
+let restarts = 0;
+let completed = 0;
+let cpuMsTotal = 0;
+
+function availableCores() {
+  return os.availableParallelism ? os.availableParallelism() : os.cpus().length;
+}
+
+function spawn() {
+  const child = fork(path.join(__dirname, "engineWorker.js"), [], {
+    serialization: 'advanced', // Buffers cross the IPC channel as Buffers, not JSON
+    env: {
+      ...process.env,
+      ENGINE_VIPS_THREADS: String(VIPS_THREADS),
+      // One job at a time: one libuv thread for Sharp, one for fs
+      UV_THREADPOOL_SIZE: '2'
+    }
+  });
+  const worker = { child, job: null, completed: 0 };
+  workers.add(worker);
+
+  child.on('message', (message) => {
+    const job = worker.job;
+    worker.job = null;
+    idle.push(worker);
+
+    if (job) {
+      completed++;
+      worker.completed++;
+      cpuMsTotal += message.cpu;
+      if (message.error) {
+        job.reject(message.error.code === 'CORRUPTED_IMAGE'
+          ? new CorruptedImageError()
+          : new Error(message.error.message));
+      } else {
+        job.resolve({ result: message.result, cpu: message.cpu });
+      }
+    }
+    drain();
+  });
+
+  child.on('exit', (code, signal) => {
+    workers.delete(worker);
+    const index = idle.indexOf(worker);
+    if (index !== -1) idle.splice(index, 1);
+
+    logger.error('Engine worker exited', { pid: child.pid, code, signal, busy: !!worker.job });
+    if (worker.job) {
+      worker.job.reject(new Error(`Compression failed: engine worker exited (${signal || code})`));
+    }
+
+    restarts++;
+    if (worker.completed > 0) {
+      spawn();
+      drain();
+    } else {
+      // Died before finishing any job (e.g. failed to load Sharp): don't spin
+      setTimeout(() => {
+        spawn();
+        drain();
+      }, 1000).unref();
+    }
+  });
+
+  idle.push(worker);
+  return worker;
+}
+
+function start() {
+  while (workers.size < POOL_SIZE) spawn();
+  logger.info('Engine pool started', { workers: POOL_SIZE, vips_threads: VIPS_THREADS });
+}
+
+function drain() {
+  while (pending.length > 0 && idle.length > 0) {
+    const worker = idle.pop();
+    const job = pending.shift();
+    worker.job = job;
+    worker.child.send({ id: nextId++, ...job.task }, (error) => {
+      if (error && worker.job === job) {
+        worker.job = null;
+        job.reject(new Error(`Compression failed: ${error.message}`));
+      }
+    });
+  }
+}
+
+/**
+ * Run a job on the next free worker
+ *
+ * @param {Object} task - { type: 'buffer', input, targetFormat, inputInfo, options }
+ *   or { type: 'file', input, output, options }
+ * @returns {Promise<{result: Object, cpu: number}>} cpu in ms (user + system)
+ */
+function run(task) {
+  if (workers.size === 0) start();
+  return new Promise((resolve, reject) => {
+    pending.push({ task, resolve, reject });
+    drain();
+  });
+}
+
+function getStats() {
+  return {
+    mode: ENABLED ? 'pool' : 'inline',
+    workers: workers.size,
+    pool_size: POOL_SIZE,
+    vips_threads: VIPS_THREADS,
+    busy: workers.size - idle.length,
+    pending: pending.length,
+    completed,
+    restarts,
+    avg_cpu_ms: completed ? Math.round(cpuMsTotal / completed) : 0
+  };
+}
+
+module.exports = { run, start, getStats, ENABLED, POOL_SIZE, VIPS_THREADS };
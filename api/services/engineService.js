@@ -1,120 +1,165 @@
 const sharp = require("sharp");
-const path = require("path");
 const fs = require("fs");
 const { withConcurrencyLimit } = require("../utils/concurrencyLimiter");
+const resultCache = require("../utils/resultCache");
+const { validateByMagicBytes } = require("../utils/fileValidation");
+const { CorruptedImageError } = require("../utils/errors");
+const logger = require("../utils/logger");
+const enginePool = require("./enginePool");
+const { compressFile, compressBuffer, apiFormat, resolveTargetFormat, wantsMetadata } = require("./engineCore");
 
 // Cap Sharp's internal libvips thread pool to 1 thread per job.
 // This prevents a single compression from grabbing all CPU cores.
 // Multiple jobs still run (up to MAX_CONCURRENT), providing throughput.
+// With ENGINE_MODE=pool the encodes run in worker processes instead (see enginePool.js).
 sharp.concurrency(1);
 
-exports.runCompression = async (input, output, format, quality, method, width, height, preserve) => {
-  return withConcurrencyLimit(() => _compress(input, output, format, quality, method, width, height, preserve));
-};
-
-async function _compress(input, output, format, quality, method, width, height, preserve) {
-  try {
-    // Get input file size for comparison
-    const inputSize = fs.statSync(input).size;
-
-    const pipeline = sharp(input);
-
-    // 1. Resize
-    if (width || height) {
-      // Parse integers if they are strings
-      const w = width ? parseInt(width) : null;
-      const h = height ? parseInt(height) : null;
-
-      // Method mapping: 'fit' -> { fit: 'inside' }, 'fill' -> { fit: 'cover' }
-      // Default to 'inside' to preserve aspect ratio within box, unless otherwise specified
-      const options = {
-        fit: method === 'fill' ? 'cover' : 'inside',
-        withoutEnlargement: true
-      };
+/**
+ * @param {Object} job - Scheduler info { plan, flow, pixels, requestId } (optional).
+ *   pixels is read from the image header when not supplied.
+ * @returns {Promise<{cached: boolean, timing: Object}>} timing: see formatServerTiming
+ */
+exports.runCompression = async (input, output, format, quality, method, width, height, preserve, job = {}) => {
+  // Content-addressed cache: identical input + params => reuse the stored output
+  const inputBuffer = await fs.promises.readFile(input);
+  const targetFormat = resolveTargetFormat(format, output);
+  const cacheKey = resultCache.buildKey(job.flow, resultCache.hashBuffer(inputBuffer), {
+    format: targetFormat, quality, method, width, height, preserve: wantsMetadata(preserve)
+  });
+
+  const cached = resultCache.get(cacheKey);
+  if (cached) {
+    await fs.promises.writeFile(output, cached.data);
+    return { cached: true, timing: {} };
+  }
 
-      pipeline.resize(w, h, options);
+  let pixels = job.pixels;
+  if (!pixels) {
+    try {
+      const meta = await sharp(inputBuffer).metadata();
+      pixels = meta.width * meta.height;
+    } catch (error) {
+      // Unreadable header: scheduled at the default cost, compressFile reports the error
     }
+  }
 
-    // 2. Format & Quality
-    // Map 'jpg' -> 'jpeg' for sharp
-    let targetFormat = format ? format.toLowerCase() : path.extname(output).replace('.', '').toLowerCase();
-    if (targetFormat === 'jpg') targetFormat = 'jpeg';
-
-    // Smart Quality Selection
-    // For small files (already optimized), use higher quality to avoid size increase
-    // For large files, use more aggressive compression
-    let q = quality ? parseInt(quality) : null;
-
-    if (!q) {
-      // Adaptive quality based on file size (CPU-friendly settings)
-      if (inputSize < 50 * 1024) {
-        // Small files (< 50KB) - likely already optimized
-        q = 90; // High quality to avoid re-encoding bloat
-      } else if (inputSize < 500 * 1024) {
-        // Medium files (50KB - 500KB)
-        q = 82;
-      } else if (inputSize < 2 * 1024 * 1024) {
-        // Large files (500KB - 2MB)
-        q = 78; // Reduced from 75 to balance quality and CPU usage
-      } else {
-        // Very large files (> 2MB) - reduce CPU load significantly
-        q = 75; // Conservative compression to prevent CPU overload
-      }
+  const { timing } = await scheduled(async () => {
+    if (enginePool.ENABLED) {
+      const { cpu } = await enginePool.run({
+        type: 'file', input, output, options: { format, quality, method, width, height, preserve }
+      });
+      return { cpu };
     }
+    await compressFile(input, output, format, quality, method, width, height, preserve);
+    return {};
+  }, { ...job, pixels, format: targetFormat });
+
+  const detected = validateByMagicBytes(inputBuffer);
+  resultCache.set(cacheKey, {
+    data: await fs.promises.readFile(output),
+    format: targetFormat,
+    inputFormat: detected.valid ? detected.mime.replace('image/', '') : null,
+    originalSize: inputBuffer.length
+  });
+
+  return { cached: false, timing };
+};
 
-    // Apply format-specific options
-    if (targetFormat === 'jpeg') {
-      pipeline.jpeg({ quality: q, mozjpeg: true });
-    } else if (targetFormat === 'png') {
-      pipeline.png({ quality: q, compressionLevel: 6 }); // level 9 = max CPU; 6 = good balance
-    } else if (targetFormat === 'webp') {
-      pipeline.webp({ quality: q, effort: 4 }); // effort 4 = balanced compression/speed for production
-    } else if (targetFormat === 'avif') {
-      pipeline.avif({ quality: q, effort: 3 }); // effort 3 = good quality, much less CPU than 4
-    } else {
-      // Fallback for others or if format detection failed
-      // (Sharp infers from toFile extension if not explicit)
-    }
+/**
+ * In-memory variant of runCompression (used by /v1/optimize)
+ *
+ * @param {Buffer} input - Uploaded image bytes
+ * @param {Object} options - { format, quality, method, width, height, preserve, filename, metadata, job }
+ *   filename supplies the output format when none is given; metadata is the
+ *   input header already read by the validator (saves a second parse); job is
+ *   the scheduler info { plan, flow, requestId }
+ * @returns {Promise<{data: Buffer, info: Object, input: Object, cached: boolean, timing: Object}>}
+ *   info/input: { format, width, height, size } of the output and the input
+ */
+exports.runCompressionBuffer = async (input, { format, quality, method, width, height, preserve, filename, metadata, job = {} } = {}) => {
+  const targetFormat = resolveTargetFormat(format, filename);
+  const cacheKey = resultCache.buildKey(job.flow, resultCache.hashBuffer(input), {
+    format: targetFormat, quality, method, width, height, preserve: wantsMetadata(preserve)
+  });
+
+  // Entries written by the file pipeline carry no image info; treat as a miss
+  const cached = resultCache.get(cacheKey);
+  if (cached && cached.info) {
+    return { data: cached.data, info: cached.info, input: cached.input, cached: true, timing: {} };
+  }
 
-    // 3. Metadata Preservation (TinyPNG-compatible)
-    // TinyPNG supports: copyright, creation, location
-    // Sharp's withMetadata() preserves: exif, icc, xmp
-    if (preserve) {
-      // If preserve is a boolean true or string 'true', keep all metadata
-      if (preserve === true || preserve === 'true') {
-        pipeline.withMetadata();
-      }
-      // If preserve is an array (TinyPNG format: ["copyright", "creation", "location"])
-      else if (Array.isArray(preserve)) {
-        // Sharp doesn't support selective metadata preservation
-        // So we preserve all if any option is requested
-        if (preserve.length > 0) {
-          pipeline.withMetadata();
-        }
-      }
-      // If preserve is a string like "copyright,creation"
-      else if (typeof preserve === 'string' && preserve !== 'false') {
-        pipeline.withMetadata();
-      }
-    }
+  const pipeline = sharp(input);
+  let meta;
+  try {
+    // Header only (no pixel decode); skipped when the validator already read it
+    meta = metadata || await pipeline.metadata();
+  } catch (error) {
+    throw new CorruptedImageError();
+  }
+  const inputInfo = { format: apiFormat(meta.format), width: meta.width, height: meta.height, size: input.length };
+  const options = { format, quality, method, width, height, preserve };
 
-    // 4. Output
-    await pipeline.toFile(output);
+  const { value: result, timing } = await scheduled(async () => {
+    if (enginePool.ENABLED) {
+      const { result, cpu } = await enginePool.run({ type: 'buffer', input, targetFormat, inputInfo, options });
+      return { ...result, data: result.keptOriginal ? input : result.data, cpu };
+    }
+    return compressBuffer(pipeline, input, inputInfo, targetFormat, options);
+  }, { ...job, pixels: meta.width * meta.height, format: targetFormat || inputInfo.format });
 
-    // 5. Smart Size Check - Return original if compressed is larger
-    const outputSize = fs.statSync(output).size;
+  if (result.keptOriginal) {
+    logger.info('Compression increased size, returning original', { input: input.length, request_id: job.requestId });
+  }
 
-    // If output is larger than input (compression made it worse)
-    if (outputSize >= inputSize && !width && !height && !format) {
-      // Only return original if we're not resizing or converting format
-      // Copy original to output location
-      fs.copyFileSync(input, output);
-      console.log(`⚠️ Compression increased size (${inputSize} -> ${outputSize}). Returning original.`);
-    }
+  const detected = validateByMagicBytes(input);
+  resultCache.set(cacheKey, {
+    data: result.data,
+    format: targetFormat,
+    inputFormat: detected.valid ? detected.mime.replace('image/', '') : null,
+    originalSize: input.length,
+    info: result.info,
+    input: result.input
+  });
+
+  return { data: result.data, info: result.info, input: result.input, cached: false, timing };
+};
 
-    return "Compression successful";
+/**
+ * Look up a previously optimized output by input hash (used by /v1/optimize/precheck)
+ * Only results produced for the same account (scheduler flow) are found.
+ */
+exports.getCachedResult = (flow, hash, { format, quality, method, width, height, preserve } = {}) => {
+  return resultCache.get(resultCache.buildKey(flow, hash, {
+    format, quality, method, width, height, preserve: wantsMetadata(preserve)
+  }));
+};
 
-  } catch (error) {
-    throw new Error(`Compression failed: ${error.message}`);
+/**
+ * Server-Timing header value for a compression result
+ * e.g. `queue;dur=12, encode;dur=340, cpu;dur=331;desc="worker"`
+ * A cached result is reported as `cache;desc="hit"`.
+ */
+exports.formatServerTiming = (timing, cached) => {
+  if (cached) return 'cache;desc="hit"';
+
+  const metrics = [`queue;dur=${timing.queue}`, `encode;dur=${timing.encode}`];
+  if (timing.cpu !== undefined) {
+    metrics.push(`cpu;dur=${timing.cpu.toFixed(1)};desc="worker"`);
   }
+  return metrics.join(', ');
 };
+
+// Run fn in a scheduler slot, timing the wait and the encode.
+// fn may return { cpu } (pool workers measure their own CPU time).
+async function scheduled(fn, options) {
+  const queuedAt = Date.now();
+  let startedAt;
+  const value = await withConcurrencyLimit(() => {
+    startedAt = Date.now();
+    return fn();
+  }, options);
+
+  const timing = { queue: startedAt - queuedAt, encode: Date.now() - startedAt };
+  if (value.cpu !== undefined) timing.cpu = value.cpu;
+  return { value, timing };
+}
@@ -0,0 +1,39 @@
+/**
+ * Engine Pool Worker
+ *
+ * Child process started by enginePool.js. Runs one compression job at a
+ * time, so process.cpuUsage() around a job is that job's CPU time,
+ * libvips threads included.
+ */
+
+const sharp = require("sharp");
+const core = require("./engineCore");
+
+// libvips threads for this worker's single job (set per worker by the pool)
+sharp.concurrency(parseInt(process.env.ENGINE_VIPS_THREADS || '1', 10));
+
+process.on('message', async ({ id, type, input, output, targetFormat, inputInfo, options }) => {
+  const cpuStart = process.cpuUsage();
+  const cpuMs = () => {
+    const cpu = process.cpuUsage(cpuStart);
+    return (cpu.user + cpu.system) / 1000;
+  };
+
+  try {
+    let result = null;
+    if (type === 'buffer') {
+      result = await core.compressBuffer(sharp(input), input, inputInfo, targetFormat, options);
+      // The parent still holds the input; don't send it back
+      if (result.keptOriginal) result.data = null;
+    } else {
+      const { format, quality, method, width, height, preserve } = options;
+      await core.compressFile(input, output, format, quality, method, width, height, preserve);
+    }
+    process.send({ id, result, cpu: cpuMs() });
+  } catch (error) {
+    process.send({ id, error: { code: error.code, message: error.message }, cpu: cpuMs() });
+  }
+});
+
+// Parent gone (restart, crash): nothing left to serve
+process.on('disconnect', () => process.exit(0));
@@ -0,0 +1,72 @@
+// Short TTL and a tiny cache so expiry and eviction are quick to reach
+process.env.AUTH_CACHE_TTL_MS = '50';
+process.env.AUTH_CACHE_MAX_ENTRIES = '3';
+
+const test = require('node:test');
+const assert = require('node:assert');
+const authCache = require('../../utils/authCache');
+
+const delay = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+const noReload = () => assert.fail('reloaded within the TTL');
+
+test.beforeEach(() => authCache.clear());
+
+test('a cached key is served without reloading within the TTL', () => {
+    assert.strictEqual(authCache.get('sk_live_a', noReload), null);
+    authCache.set('sk_live_a', 'user-a', 'hash-a', { id: 'user-a', plan: 'pro' });
+    assert.deepStrictEqual(authCache.get('sk_live_a', noReload), { id: 'user-a', plan: 'pro' });
+});
+
+test('an expired snapshot is reloaded by user id', async () => {
+    authCache.set('sk_live_a', 'user-a', 'hash-a', { id: 'user-a', plan: 'pro' });
+    await delay(60);
+
+    const reloaded = [];
+    const user = authCache.get('sk_live_a', (userId) => {
+        reloaded.push(userId);
+        return { credential: 'hash-a', user: { id: 'user-a', plan: 'business' } };
+    });
+    assert.deepStrictEqual(reloaded, ['user-a']);
+    assert.strictEqual(user.plan, 'business');
+
+    // The reload restarts the TTL
+    assert.strictEqual(authCache.get('sk_live_a', noReload).plan, 'business');
+});
+
+test('a rotated key or removed user misses after the TTL', async () => {
+    authCache.set('sk_live_a', 'user-a', 'hash-a', { id: 'user-a' });
+    authCache.set('sk_live_b', 'user-b', 'hash-b', { id: 'user-b' });
+    await delay(60);
+
+    assert.strictEqual(authCache.get('sk_live_a', () => ({ credential: 'hash-new', user: { id: 'user-a' } })), null);
+    assert.strictEqual(authCache.get('sk_live_b', () => null), null);
+    assert.strictEqual(authCache.getStats().entries, 0);
+});
+
+test('markStale forces a reload before the TTL', () => {
+    authCache.set('sk_live_a', 'user-a', 'hash-a', { id: 'user-a', usage: 1 });
+    authCache.markStale(['user-a']);
+    const user = authCache.get('sk_live_a', () => ({ credential: 'hash-a', user: { id: 'user-a', usage: 2 } }));
+    assert.strictEqual(user.usage, 2);
+});
+
+test('invalidateUser drops every key of that user', () => {
+    authCache.set('sk_live_a', 'user-a', 'hash-a', { id: 'user-a' });
+    authCache.set('sk_live_a2', 'user-a', 'hash-a2', { id: 'user-a' });
+    authCache.set('sk_live_b', 'user-b', 'hash-b', { id: 'user-b' });
+    authCache.invalidateUser('user-a');
+    assert.strictEqual(authCache.get('sk_live_a', noReload), null);
+    assert.strictEqual(authCache.get('sk_live_a2', noReload), null);
+    assert.ok(authCache.get('sk_live_b', noReload));
+});
+
+test('the least recently used key is evicted when full', () => {
+    for (const name of ['a', 'b', 'c']) {
+        authCache.set(`sk_live_${name}`, `user-${name}`, `hash-${name}`, { id: `user-${name}` });
+    }
+    authCache.get('sk_live_a', noReload);
+    authCache.set('sk_live_d', 'user-d', 'hash-d', { id: 'user-d' });
+
+    assert.strictEqual(authCache.get('sk_live_b', noReload), null);
+    assert.ok(authCache.get('sk_live_a', noReload));
+});
@@ -0,0 +1,106 @@
+const test = require('node:test');
+const assert = require('node:assert');
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const http = require('http');
+const zlib = require('zlib');
+const { streamBatch, entryName } = require('../../services/batchArchive');
+
+// Entries from the central directory: { name, method, data }
+function readZip(buffer) {
+    const eocd = buffer.lastIndexOf(Buffer.from([0x50, 0x4b, 0x05, 0x06]));
+    const count = buffer.readUInt16LE(eocd + 10);
+    let offset = buffer.readUInt32LE(eocd + 16);
+    const entries = [];
+    for (let i = 0; i < count; i++) {
+        const method = buffer.readUInt16LE(offset + 10);
+        const compressedSize = buffer.readUInt32LE(offset + 20);
+        const nameLength = buffer.readUInt16LE(offset + 28);
+        const extraLength = buffer.readUInt16LE(offset + 30);
+        const commentLength = buffer.readUInt16LE(offset + 32);
+        const localOffset = buffer.readUInt32LE(offset + 42);
+        const name = buffer.toString('utf8', offset + 46, offset + 46 + nameLength);
+
+        const dataStart = localOffset + 30 + buffer.readUInt16LE(localOffset + 26) + buffer.readUInt16LE(localOffset + 28);
+        const raw = buffer.subarray(dataStart, dataStart + compressedSize);
+        entries.push({ name, method, data: method === 8 ? zlib.inflateRawSync(raw) : raw });
+        offset += 46 + nameLength + extraLength + commentLength;
+    }
+    return entries;
+}
+
+function inputFiles(names) {
+    const dir = fs.mkdtempSync(path.join(os.tmpdir(), 'batch-'));
+    return names.map((name, i) => {
+        const filePath = path.join(dir, `upload-${i}`);
+        fs.writeFileSync(filePath, Buffer.alloc(1000, i));
+        return { path: filePath, originalname: name, filename: `upload-${i}`, size: 1000 };
+    });
+}
+
+// Serve one batch, collect the response body and trailers
+function runBatch(files, compressOne) {
+    return new Promise((resolve, reject) => {
+        let outcome;
+        const server = http.createServer(async (req, res) => {
+            outcome = await streamBatch(res, files, compressOne);
+        });
+        server.listen(0, '127.0.0.1', () => {
+            http.get({ port: server.address().port, path: '/' }, (res) => {
+                const chunks = [];
+                res.on('data', chunk => chunks.push(chunk));
+                res.on('end', () => {
+                    server.close();
+                    resolve({ res, body: Buffer.concat(chunks), trailers: res.trailers, outcome });
+                });
+            }).on('error', reject);
+        });
+    });
+}
+
+const delay = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+test('entry names are unique within an archive', () => {
+    const used = new Set();
+    assert.strictEqual(entryName('photo.jpg', used), 'photo-min.jpg');
+    assert.strictEqual(entryName('dir/photo.jpg', used), 'photo-min-2.jpg');
+    assert.strictEqual(entryName('photo.jpg', used), 'photo-min-3.jpg');
+    assert.strictEqual(entryName('README', used), 'README-min');
+});
+
+test('entries are written in completion order, then the manifest', async () => {
+    const files = inputFiles(['slow.png', 'fast.png', 'broken.png', 'fast.png']);
+    const delays = { 'upload-0': 60, 'upload-1': 0, 'upload-2': 10, 'upload-3': 30 };
+
+    const { res, body, trailers } = await runBatch(files, async (file, outputPath) => {
+        await delay(delays[file.filename]);
+        if (file.originalname === 'broken.png') throw new Error('decode failed');
+        fs.writeFileSync(outputPath, Buffer.alloc(400, 7));
+    });
+
+    assert.strictEqual(res.headers['content-type'], 'application/zip');
+    const entries = readZip(body);
+    assert.deepStrictEqual(entries.map(e => e.name), ['fast-min.png', 'fast-min-2.png', 'slow-min.png', 'manifest.json']);
+    assert.ok(entries.slice(0, 3).every(e => e.method === 0 && e.data.length === 400), 'images are stored');
+
+    const manifest = JSON.parse(entries[3].data.toString());
+    assert.deepStrictEqual(manifest.totals, { files: 3, failed: 1, originalSize: 3000, compressedSize: 1200 });
+    assert.deepStrictEqual(manifest.files[2], { filename: 'broken.png', error: 'decode failed' });
+    assert.strictEqual(manifest.files[0].compressionRatio, 60);
+
+    assert.strictEqual(trailers['x-total-files'], '3');
+    assert.strictEqual(trailers['x-failed-files'], '1');
+});
+
+test('uploads and outputs are removed once the archive is sent', async () => {
+    const files = inputFiles(['a.png']);
+    let output;
+    await runBatch(files, async (file, outputPath) => {
+        output = outputPath;
+        fs.writeFileSync(outputPath, Buffer.alloc(10));
+    });
+    await delay(20);
+    assert.strictEqual(fs.existsSync(files[0].path), false);
+    assert.strictEqual(fs.existsSync(output), false);
+});
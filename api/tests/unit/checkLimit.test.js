@@ -0,0 +1,34 @@
+process.env.DB_PATH = ':memory:';
+process.env.USAGE_RECHECK_MARGIN = '5';
+
+const test = require('node:test');
+const assert = require('node:assert');
+const db = require('../../services/db');
+const { checkLimit } = require('../../controllers/userController');
+
+// Legacy plain keys match without bcrypt
+const insertUser = db.prepare(`
+    INSERT INTO users (id, email, apiKey, plan, apiCredits, usage, credits)
+    VALUES (?, ?, ?, 'pro', 100, ?, 0)
+`);
+insertUser.run('near-user', 'near@example.com', 'key_near', 97);
+insertUser.run('far-user', 'far@example.com', 'key_far', 10);
+
+// What another cluster process's flush looks like from here
+const flushElsewhere = (id, usage) => db.prepare('UPDATE users SET usage = ? WHERE id = ?').run(usage, id);
+
+test('a user near the limit sees usage flushed by other processes', async () => {
+    assert.strictEqual((await checkLimit('key_near')).allowed, true);
+
+    flushElsewhere('near-user', 100);
+    const result = await checkLimit('key_near');
+    assert.strictEqual(result.allowed, false);
+    assert.strictEqual(result.user.usage, 100);
+});
+
+test('a user far from the limit is served from the cached snapshot', async () => {
+    await checkLimit('key_far');
+
+    flushElsewhere('far-user', 50);
+    assert.strictEqual((await checkLimit('key_far')).user.usage, 10);
+});
@@ -0,0 +1,119 @@
+const test = require('node:test');
+const assert = require('node:assert');
+
+// One slot and three queue places make ordering and shedding observable
+process.env.DB_PATH = ':memory:';
+process.env.MAX_CONCURRENT_JOBS = '1';
+process.env.MAX_QUEUED_JOBS = '3';
+
+const { withConcurrencyLimit, estimateCost, getStats } = require('../../utils/concurrencyLimiter');
+const { ServerBusyError } = require('../../utils/errors');
+
+// Hold a slot (once scheduled) until the returned function is called
+function occupy(options = { flow: 'holder' }) {
+    let open;
+    const gate = new Promise(resolve => { open = resolve; });
+    const done = withConcurrencyLimit(() => gate, options);
+    return async () => {
+        open();
+        await done;
+    };
+}
+
+// Queue a job that records its name when it starts
+function submit(order, name, options) {
+    return withConcurrencyLimit(async () => { order.push(name); }, options);
+}
+
+test('cost scales with megapixels and format effort', () => {
+    assert.strictEqual(estimateCost({ pixels: 4e6, format: 'avif' }), 16);
+    assert.strictEqual(estimateCost({ pixels: 2e6, format: 'PNG' }), 3);
+    assert.strictEqual(estimateCost({}), 1);
+    assert.strictEqual(estimateCost({ pixels: 100, format: 'jpeg' }), 0.05);
+});
+
+test('a full queue sheds the newcomer with a Retry-After from the queued work', async () => {
+    const release = occupy();
+    const order = [];
+    // 3 x 50MP AVIF = 600 cost units at 0.1s each: capped at 60s
+    const big = { plan: 'free', pixels: 50e6, format: 'avif' };
+    const queued = [1, 2, 3].map(n => submit(order, `big${n}`, { ...big, flow: `shed-${n}` }));
+
+    await assert.rejects(submit(order, 'late', { ...big, flow: 'shed-late' }), (error) => {
+        assert.ok(error instanceof ServerBusyError);
+        assert.strictEqual(error.statusCode, 503);
+        assert.strictEqual(error.retryAfter, 60);
+        assert.strictEqual(error.details.your_plan, 'free');
+        return true;
+    });
+
+    await release();
+    await Promise.all(queued);
+    assert.deepStrictEqual(order, ['big1', 'big2', 'big3']);
+    assert.strictEqual(getStats().plans.free.shed, 1);
+});
+
+test('a full queue evicts the job that would be served last', async () => {
+    const release = occupy();
+    const order = [];
+    const outcomes = [
+        submit(order, 'free', { plan: 'free', flow: 'evict-free', pixels: 4e6 }),
+        submit(order, 'pro', { plan: 'pro', flow: 'evict-pro' }),
+        submit(order, 'starter', { plan: 'starter', flow: 'evict-starter' }),
+        submit(order, 'business', { plan: 'business', flow: 'evict-business' })
+    ].map(p => p.then(() => 'ok', error => error.code));
+
+    await release();
+    assert.deepStrictEqual(await Promise.all(outcomes), ['SERVER_BUSY', 'ok', 'ok', 'ok']);
+    assert.deepStrictEqual(order, ['business', 'pro', 'starter']);
+    assert.strictEqual(getStats().queued, 0);
+});
+
+test('flows with equal weight take turns', async () => {
+    const release = occupy();
+    const order = [];
+    const jobs = [
+        submit(order, 'a1', { plan: 'pro', flow: 'turns-a' }),
+        submit(order, 'a2', { plan: 'pro', flow: 'turns-a' }),
+        submit(order, 'b1', { plan: 'pro', flow: 'turns-b' })
+    ];
+    await release();
+    await Promise.all(jobs);
+    assert.deepStrictEqual(order, ['a1', 'b1', 'a2']);
+});
+
+test('higher plan weights are served first for equal work', async () => {
+    const release = occupy();
+    const order = [];
+    const jobs = [
+        submit(order, 'free', { plan: 'free', flow: 'weight-free' }),
+        submit(order, 'starter', { plan: 'starter', flow: 'weight-starter' }),
+        submit(order, 'business', { plan: 'business', flow: 'weight-business' })
+    ];
+    await release();
+    await Promise.all(jobs);
+    assert.deepStrictEqual(order, ['business', 'starter', 'free']);
+});
+
+test('an evicted job does not push back its flow', async () => {
+    const release = occupy();
+    const order = [];
+    const evicted = submit(order, 'evicted', { plan: 'free', flow: 'rollback-free' });
+    const releaseB1 = occupy({ plan: 'business', flow: 'rollback-b1' });
+    const queued = [
+        submit(order, 'b2', { plan: 'business', flow: 'rollback-b2' }),
+        submit(order, 'b3', { plan: 'business', flow: 'rollback-b3' })
+    ];
+    await assert.rejects(evicted, ServerBusyError);
+    await release();
+
+    // Same flow again: its tag starts from now, not after the evicted job,
+    // so a slightly larger job from a fresh free flow is the one shed
+    const retry = submit(order, 'retry', { plan: 'free', flow: 'rollback-free' });
+    const other = submit(order, 'other', { plan: 'free', flow: 'rollback-other', pixels: 1.1e6 });
+    await assert.rejects(other, ServerBusyError);
+
+    await releaseB1();
+    await Promise.all([...queued, retry]);
+    assert.deepStrictEqual(order, ['b2', 'b3', 'retry']);
+});
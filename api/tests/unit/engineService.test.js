@@ -0,0 +1,18 @@
+const test = require('node:test');
+const assert = require('node:assert');
+const { formatServerTiming } = require('../../services/engineService');
+
+test('server timing lists queue and encode time', () => {
+    assert.strictEqual(formatServerTiming({ queue: 12, encode: 340 }, false), 'queue;dur=12, encode;dur=340');
+});
+
+test('server timing includes worker cpu time', () => {
+    assert.strictEqual(
+        formatServerTiming({ queue: 0, encode: 50, cpu: 47.25 }, false),
+        'queue;dur=0, encode;dur=50, cpu;dur=47.3;desc="worker"'
+    );
+});
+
+test('a cache hit needs no timing', () => {
+    assert.strictEqual(formatServerTiming({}, true), 'cache;desc="hit"');
+});
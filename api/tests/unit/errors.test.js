@@ -0,0 +1,41 @@
+const test = require('node:test');
+const assert = require('node:assert');
+const { isCorruptedImageError, CorruptedImageError } = require('../../utils/errors');
+
+test('decoder messages for broken input map to CORRUPTED_IMAGE', () => {
+    const messages = [
+        'Input buffer contains unsupported image format',
+        'Input buffer has corrupt header: VipsJpeg: Premature end of input file',
+        'VipsJpeg: Premature end of JPEG file\nVipsJpeg: out of order read at line 48',
+        'VipsJpeg: Corrupt JPEG data: 12 extraneous bytes before marker 0xd9',
+        'VipsJpeg: Huffman table 0x01 was not defined',
+        'pngload_buffer: libspng read error',
+        'vipspng: libpng read error',
+        'webpload_buffer: unable to parse image',
+        'heifload_buffer: Invalid input: Unspecified: Bitstream not supported by this decoder'
+    ];
+    for (const message of messages) {
+        assert.ok(isCorruptedImageError(new Error(message)), message);
+    }
+});
+
+test('server-side failures are not blamed on the image', () => {
+    const messages = [
+        'Expected positive integer for width but received -1 of type number',
+        'Invalid value for quality',
+        'bad allocation',
+        'VipsImage: memory area too small',
+        'ENOSPC: no space left on device, write',
+        'Worker exited with code 1'
+    ];
+    for (const message of messages) {
+        assert.strictEqual(isCorruptedImageError(new Error(message)), false, message);
+    }
+    assert.strictEqual(isCorruptedImageError(undefined), false);
+});
+
+test('CorruptedImageError is a 400 with the API error shape', () => {
+    const error = new CorruptedImageError();
+    assert.strictEqual(error.statusCode, 400);
+    assert.strictEqual(error.toJSON().error, 'CORRUPTED_IMAGE');
+});
@@ -0,0 +1,132 @@
+process.env.DB_PATH = ':memory:';
+
+const test = require('node:test');
+const assert = require('node:assert');
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const http = require('http');
+const db = require('../../services/db');
+const engineService = require('../../services/engineService');
+const fileValidator = require('../../utils/fileValidator');
+const usageCounters = require('../../utils/usageCounters');
+const { ResolutionExceededError } = require('../../utils/errors');
+
+// The controller destructures these on require, so mock them first
+const compressed = [];
+test.mock.method(engineService, 'runCompression', async (input, output) => {
+    if (input.endsWith('broken.png')) throw new Error('decode failed');
+    compressed.push(path.basename(input));
+    fs.writeFileSync(output, Buffer.alloc(400, 7));
+});
+test.mock.method(fileValidator, 'validateFile', async (file) => {
+    if (file.originalname === 'huge.png') throw new ResolutionExceededError(10000, 10000, 16e6);
+    return { valid: true, metadata: { pixels: 1e6 } };
+});
+
+const { optimizeBatch } = require('../../controllers/optimizeController');
+
+// Same schema as scripts/createApiKeysTable.js
+db.prepare(`
+    CREATE TABLE IF NOT EXISTS api_keys (
+        id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        key TEXT UNIQUE NOT NULL,
+        key_hash TEXT NOT NULL,
+        plan_id TEXT DEFAULT 'free',
+        monthly_limit INTEGER DEFAULT 500,
+        used_count INTEGER DEFAULT 0,
+        reset_at TEXT,
+        billing_cycle_start TEXT,
+        is_sandbox BOOLEAN DEFAULT 0,
+        is_active BOOLEAN DEFAULT 1,
+        created_at TEXT,
+        last_used_at TEXT
+    )
+`).run();
+const insertKey = db.prepare(`
+    INSERT INTO api_keys (id, user_id, key, key_hash, plan_id, monthly_limit, used_count, reset_at)
+    VALUES (?, 'user-1', ?, 'hash', 'pro', 100, ?, '2999-01-01T00:00:00.000Z')
+`);
+insertKey.run('key-batch', 'sk_live_batch', 0);
+insertKey.run('key-full', 'sk_live_full', 99);
+
+// Multer disk files as the route would hand them over
+function uploads(names) {
+    const dir = fs.mkdtempSync(path.join(os.tmpdir(), 'optimize-batch-'));
+    return names.map((name) => {
+        const filePath = path.join(dir, name);
+        fs.writeFileSync(filePath, Buffer.alloc(1000, 1));
+        return { path: filePath, originalname: name, filename: name, size: 1000 };
+    });
+}
+
+// Run the controller behind a real server; resolves once the response is read
+function run(files, apiKey) {
+    return new Promise((resolve, reject) => {
+        let nextError;
+        const server = http.createServer(async (req, res) => {
+            res.status = (code) => { res.statusCode = code; return res; };
+            res.json = (body) => {
+                res.setHeader('Content-Type', 'application/json');
+                res.end(JSON.stringify(body));
+            };
+            req.id = 'req-batch';
+            req.files = files;
+            req.user = { id: 'user-1', plan: 'pro', apiKey };
+            await optimizeBatch(req, res, (error) => {
+                nextError = error;
+                res.statusCode = error.statusCode;
+                res.end();
+            });
+        });
+        server.listen(0, '127.0.0.1', () => {
+            http.get({ port: server.address().port, path: '/' }, (res) => {
+                const chunks = [];
+                res.on('data', chunk => chunks.push(chunk));
+                res.on('end', () => {
+                    server.close();
+                    resolve({ res, body: Buffer.concat(chunks), nextError });
+                });
+            }).on('error', reject);
+        });
+    });
+}
+
+const settle = () => new Promise(resolve => setTimeout(resolve, 20));
+
+test('each delivered image uses quota', async () => {
+    const before = usageCounters.pending('api_key', 'key-batch');
+    const { res } = await run(uploads(['a.png', 'broken.png', 'b.png']), 'sk_live_batch');
+
+    assert.strictEqual(res.statusCode, 200);
+    assert.strictEqual(res.headers['content-type'], 'application/zip');
+    assert.strictEqual(res.trailers['x-total-files'], '2');
+    assert.strictEqual(res.trailers['x-failed-files'], '1');
+    await settle();
+    assert.strictEqual(usageCounters.pending('api_key', 'key-batch'), before + 2);
+});
+
+test('a batch larger than the remaining quota is refused up front', async () => {
+    compressed.length = 0;
+    const files = uploads(['a.png', 'b.png']);
+    const { res, body } = await run(files, 'sk_live_full');
+
+    assert.strictEqual(res.statusCode, 429);
+    const error = JSON.parse(body);
+    assert.strictEqual(error.error, 'PLAN_LIMIT_REACHED');
+    assert.deepStrictEqual([error.details.used, error.details.limit, error.details.requested], [99, 100, 2]);
+    assert.deepStrictEqual(compressed, []);
+    assert.ok(files.every(file => !fs.existsSync(file.path)));
+});
+
+test('one file over the plan limits fails the whole batch', async () => {
+    compressed.length = 0;
+    const files = uploads(['a.png', 'huge.png']);
+    const { res, nextError } = await run(files, 'sk_live_batch');
+
+    assert.ok(nextError instanceof ResolutionExceededError);
+    assert.strictEqual(res.statusCode, 413);
+    assert.deepStrictEqual(compressed, []);
+    assert.ok(files.every(file => !fs.existsSync(file.path)));
+});
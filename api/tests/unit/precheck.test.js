@@ -0,0 +1,103 @@
+process.env.DB_PATH = ':memory:';
+
+const test = require('node:test');
+const assert = require('node:assert');
+const crypto = require('crypto');
+const { EventEmitter } = require('events');
+const db = require('../../services/db');
+const resultCache = require('../../utils/resultCache');
+const usageCounters = require('../../utils/usageCounters');
+const { jobFromRequest } = require('../../utils/concurrencyLimiter');
+const { precheck } = require('../../controllers/optimizeController');
+
+const API_KEY = 'sk_live_precheck';
+const HASH = crypto.createHash('sha256').update('original image').digest('hex');
+const OPTIMIZED = Buffer.alloc(300, 1);
+
+// Same schema as scripts/createApiKeysTable.js
+db.prepare(`
+    CREATE TABLE IF NOT EXISTS api_keys (
+        id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        key TEXT UNIQUE NOT NULL,
+        key_hash TEXT NOT NULL,
+        plan_id TEXT DEFAULT 'free',
+        monthly_limit INTEGER DEFAULT 500,
+        used_count INTEGER DEFAULT 0,
+        reset_at TEXT,
+        billing_cycle_start TEXT,
+        is_sandbox BOOLEAN DEFAULT 0,
+        is_active BOOLEAN DEFAULT 1,
+        created_at TEXT,
+        last_used_at TEXT
+    )
+`).run();
+db.prepare(`
+    INSERT INTO api_keys (id, user_id, key, key_hash, plan_id, monthly_limit, reset_at)
+    VALUES ('key-1', 'user-1', ?, 'hash', 'pro', 100, '2999-01-01T00:00:00.000Z')
+`).run(API_KEY);
+
+function request() {
+    return {
+        id: 'req-1',
+        ip: '127.0.0.1',
+        body: { hash: HASH, filename: 'photo.png' },
+        user: { id: 'user-1', plan: 'pro', apiKey: API_KEY },
+        apiKey: API_KEY,
+        headers: {},
+        query: {}
+    };
+}
+
+// Just enough of an Express response; 'finish' fires once the body is out
+function response() {
+    const res = new EventEmitter();
+    res.statusCode = 200;
+    res.headers = {};
+    res.setHeader = (name, value) => { res.headers[name.toLowerCase()] = value; };
+    res.status = (code) => { res.statusCode = code; return res; };
+    res.type = (type) => res.setHeader('Content-Type', type);
+    res.send = (body) => { res.body = body; };
+    res.json = (body) => { res.body = body; };
+    return res;
+}
+
+test.before(() => {
+    const key = resultCache.buildKey(jobFromRequest(request()).flow, HASH, { format: 'png', quality: 80 });
+    resultCache.set(key, { data: OPTIMIZED, format: 'png', originalSize: 1000 });
+});
+
+test('a cached hash is served without an upload', async () => {
+    const res = response();
+    await precheck(request(), res, assert.fail);
+
+    assert.strictEqual(res.statusCode, 200);
+    assert.strictEqual(res.body, OPTIMIZED);
+    assert.strictEqual(res.headers['x-cache'], 'HIT');
+    assert.strictEqual(res.headers['x-savings-percent'], 70);
+    assert.strictEqual(res.headers['server-timing'], 'cache;desc="hit"');
+
+    // Metered once the response is delivered, not before
+    const before = usageCounters.pending('api_key', 'key-1');
+    res.emit('finish');
+    assert.strictEqual(usageCounters.pending('api_key', 'key-1'), before + 1);
+});
+
+test('an undelivered hit does not use quota', async () => {
+    const res = response();
+    await precheck(request(), res, assert.fail);
+
+    const before = usageCounters.pending('api_key', 'key-1');
+    res.emit('close');
+    assert.strictEqual(usageCounters.pending('api_key', 'key-1'), before);
+});
+
+test('another account misses', async () => {
+    const req = request();
+    req.apiKey = req.user.apiKey = 'sk_live_other';
+    const res = response();
+    await precheck(req, res, assert.fail);
+
+    assert.strictEqual(res.statusCode, 404);
+    assert.strictEqual(res.body.error, 'CACHE_MISS');
+});
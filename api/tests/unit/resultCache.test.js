@@ -0,0 +1,52 @@
+// Small cache so eviction is easy to reach: 1MB total, 128KB per entry
+process.env.RESULT_CACHE_MAX_MB = '1';
+
+const test = require('node:test');
+const assert = require('node:assert');
+const resultCache = require('../../utils/resultCache');
+
+const HASH = 'a'.repeat(64);
+
+test('equivalent params share a key', () => {
+    const a = resultCache.buildKey('key:1', HASH, { format: 'jpg', quality: '80' });
+    const b = resultCache.buildKey('key:1', HASH.toUpperCase(), { format: 'JPEG', quality: 80, method: 'fit', width: null });
+    assert.strictEqual(a, b);
+});
+
+test('different params get different keys', () => {
+    const base = resultCache.buildKey('key:1', HASH, { quality: 80 });
+    assert.notStrictEqual(base, resultCache.buildKey('key:1', HASH, { quality: 81 }));
+    assert.notStrictEqual(base, resultCache.buildKey('key:1', HASH, { quality: 80, width: 100 }));
+    assert.notStrictEqual(base, resultCache.buildKey('key:1', HASH, { quality: 80, preserve: true }));
+});
+
+test('entries are scoped to the account', () => {
+    const key = resultCache.buildKey('key:owner', HASH, { quality: 80 });
+    resultCache.set(key, { data: Buffer.alloc(10), format: 'png', originalSize: 20 });
+
+    assert.ok(resultCache.get(key));
+    assert.strictEqual(resultCache.get(resultCache.buildKey('key:other', HASH, { quality: 80 })), null);
+    assert.strictEqual(resultCache.get(resultCache.buildKey(undefined, HASH, { quality: 80 })), null);
+});
+
+test('least recently used entries are evicted first', () => {
+    const entry = () => ({ data: Buffer.alloc(100 * 1024), format: 'png', originalSize: 1 });
+    const keys = [];
+    for (let i = 0; i < 12; i++) {
+        keys.push(resultCache.buildKey('key:lru', HASH, { quality: i + 1 }));
+        resultCache.set(keys[i], entry());
+        if (i === 0) continue;
+        // Keep the first entry hot
+        resultCache.get(keys[0]);
+    }
+
+    assert.ok(resultCache.get(keys[0]), 'recently used entry kept');
+    assert.strictEqual(resultCache.get(keys[1]), null, 'oldest unused entry evicted');
+    assert.ok(resultCache.stats().bytes <= resultCache.MAX_BYTES);
+});
+
+test('oversized entries are not cached', () => {
+    const key = resultCache.buildKey('key:big', HASH, {});
+    resultCache.set(key, { data: Buffer.alloc(200 * 1024), format: 'png', originalSize: 1 });
+    assert.strictEqual(resultCache.get(key), null);
+});
@@ -0,0 +1,193 @@
+process.env.DB_PATH = ':memory:';
+
+const test = require('node:test');
+const assert = require('node:assert');
+const { EventEmitter } = require('events');
+const { PassThrough } = require('stream');
+const { validatingStorage, readImageHeader, HEADER_LIMIT } = require('../../utils/uploadValidator');
+const { ImageSizeExceededError, UnsupportedFormatError, ResolutionExceededError } = require('../../utils/errors');
+
+const u32be = (n) => { const b = Buffer.alloc(4); b.writeUInt32BE(n); return b; };
+const u16be = (n) => { const b = Buffer.alloc(2); b.writeUInt16BE(n); return b; };
+const box = (type, ...payload) => {
+    const body = Buffer.concat(payload);
+    return Buffer.concat([u32be(8 + body.length), Buffer.from(type, 'latin1'), body]);
+};
+
+function png(width, height) {
+    return Buffer.concat([
+        Buffer.from([0x89, 0x50, 0x4E, 0x47, 0x0D, 0x0A, 0x1A, 0x0A]),
+        u32be(13), Buffer.from('IHDR'), u32be(width), u32be(height), Buffer.alloc(9)
+    ]);
+}
+
+// SOI, `exifBytes` of APP1 (EXIF) segments, then a baseline frame header
+function jpeg(width, height, exifBytes = 16) {
+    const parts = [Buffer.from([0xFF, 0xD8])];
+    for (let left = exifBytes; left > 0; left -= 60000) {
+        const size = Math.min(left, 60000);
+        parts.push(Buffer.from([0xFF, 0xE1]), u16be(2 + size), Buffer.alloc(size));
+    }
+    parts.push(Buffer.from([0xFF, 0xC0]), u16be(17), Buffer.from([8]), u16be(height), u16be(width), Buffer.alloc(10));
+    return Buffer.concat(parts);
+}
+
+function webp(chunk, payload) {
+    const data = Buffer.concat([Buffer.from(chunk, 'latin1'), Buffer.alloc(4), payload]);
+    return Buffer.concat([Buffer.from('RIFF'), Buffer.alloc(4), Buffer.from('WEBP'), data]);
+}
+
+function avif(width, height) {
+    const ftyp = box('ftyp', Buffer.from('avif'), Buffer.alloc(4), Buffer.from('mif1'));
+    const ispe = box('ispe', Buffer.alloc(4), u32be(width), u32be(height));
+    const meta = box('meta', Buffer.alloc(4), box('hdlr', Buffer.alloc(20)), box('iprp', box('ipco', ispe)));
+    return Buffer.concat([ftyp, meta, box('mdat', Buffer.alloc(16))]);
+}
+
+test('png dimensions come from IHDR', () => {
+    assert.deepStrictEqual(readImageHeader(png(640, 480)), { format: 'png', width: 640, height: 480 });
+});
+
+test('jpeg frame header is found behind APP segments', () => {
+    assert.deepStrictEqual(readImageHeader(jpeg(1920, 1080, 60000)), { format: 'jpeg', width: 1920, height: 1080 });
+    // Cut inside the EXIF segment: more bytes are needed
+    assert.strictEqual(readImageHeader(jpeg(1920, 1080, 60000).subarray(0, 1000)), undefined);
+});
+
+test('webp lossy, lossless and extended headers', () => {
+    const lossy = Buffer.alloc(10);
+    lossy.set([0x9D, 0x01, 0x2A], 3);
+    lossy.writeUInt16LE(800, 6);
+    lossy.writeUInt16LE(600, 8);
+    assert.deepStrictEqual(readImageHeader(webp('VP8 ', lossy)), { format: 'webp', width: 800, height: 600 });
+
+    const lossless = Buffer.alloc(10);
+    lossless[0] = 0x2F;
+    lossless.writeUInt32LE((800 - 1) | ((600 - 1) << 14), 1);
+    assert.deepStrictEqual(readImageHeader(webp('VP8L', lossless)), { format: 'webp', width: 800, height: 600 });
+
+    const extended = Buffer.alloc(10);
+    extended.writeUIntLE(5000 - 1, 4, 3);
+    extended.writeUIntLE(4000 - 1, 7, 3);
+    assert.deepStrictEqual(readImageHeader(webp('VP8X', extended)), { format: 'webp', width: 5000, height: 4000 });
+});
+
+test('avif extents come from the ispe property', () => {
+    assert.deepStrictEqual(readImageHeader(avif(4096, 2160)), { format: 'avif', width: 4096, height: 2160 });
+    // Other ISOBMFF files (e.g. MP4) are not AVIF
+    const mp4 = box('ftyp', Buffer.from('isom'), Buffer.alloc(4), Buffer.from('mp41'));
+    assert.strictEqual(readImageHeader(Buffer.concat([mp4, box('mdat')])).format, null);
+});
+
+test('short input needs more bytes, unknown content has no format', () => {
+    assert.strictEqual(readImageHeader(Buffer.alloc(4)), undefined);
+    assert.strictEqual(readImageHeader(png(1, 1).subarray(0, 16)), undefined);
+    assert.deepStrictEqual(readImageHeader(Buffer.from('%PDF-1.7 not an image')), { format: null, width: null, height: null });
+});
+
+// Wrapped storage that keeps what it receives
+function memoryStorage() {
+    const storage = {
+        received: null,
+        removed: 0,
+        _handleFile(req, file, cb) {
+            const chunks = [];
+            file.stream.on('data', chunk => chunks.push(chunk));
+            file.stream.on('end', () => {
+                storage.received = Buffer.concat(chunks);
+                cb(null, { size: storage.received.length });
+            });
+        },
+        _removeFile(req, file, cb) {
+            storage.removed++;
+            cb();
+        }
+    };
+    return storage;
+}
+
+const LIMITS = { max_file_size: 100000, allowed_formats: ['png', 'jpeg'], maxPixels: 1000 * 1000 };
+
+// Stream `chunks` through a validating storage engine; resolves with cb's (err, info)
+function upload(engine, chunks, req = {}) {
+    return new Promise((resolve) => {
+        const stream = new PassThrough();
+        engine._handleFile(req, { originalname: 'upload.png', stream }, (err, info) => {
+            resolve({ err, info });
+        });
+        for (const chunk of chunks) stream.write(chunk);
+        stream.end();
+    });
+}
+
+test('an accepted upload reaches the wrapped storage intact', async () => {
+    const storage = memoryStorage();
+    const image = Buffer.concat([png(800, 600), Buffer.alloc(5000, 7)]);
+    const { err, info } = await upload(validatingStorage(storage, () => LIMITS), [image.subarray(0, 10), image.subarray(10)]);
+    assert.ifError(err);
+    assert.strictEqual(info.size, image.length);
+    assert.ok(storage.received.equals(image));
+});
+
+test('a disallowed format is rejected before the storage sees it', async () => {
+    const storage = memoryStorage();
+    const { err } = await upload(validatingStorage(storage, () => LIMITS), [webp('VP8X', Buffer.alloc(10))]);
+    assert.ok(err instanceof UnsupportedFormatError);
+    assert.strictEqual(err.details.your_format, 'webp');
+    assert.strictEqual(storage.received, null);
+});
+
+test('too many pixels are rejected from the header', async () => {
+    const storage = memoryStorage();
+    const { err } = await upload(validatingStorage(storage, () => LIMITS), [jpeg(2000, 1000)]);
+    assert.ok(err instanceof ResolutionExceededError);
+    assert.strictEqual(err.statusCode, 413);
+    assert.strictEqual(storage.received, null);
+});
+
+test('an upload growing past the size limit is removed from the storage', async () => {
+    const storage = memoryStorage();
+    const chunks = [png(100, 100)];
+    for (let i = 0; i < 20; i++) chunks.push(Buffer.alloc(10000));
+    const { err } = await upload(validatingStorage(storage, () => LIMITS), chunks);
+    assert.ok(err instanceof ImageSizeExceededError);
+    await new Promise(resolve => setImmediate(resolve));
+    assert.strictEqual(storage.removed, 1);
+});
+
+test('a header that cannot be found within the limit passes through', async () => {
+    const storage = memoryStorage();
+    const engine = validatingStorage(storage, () => ({ ...LIMITS, max_file_size: HEADER_LIMIT * 2 }));
+    // EXIF larger than HEADER_LIMIT: the frame header is out of reach
+    const image = jpeg(5000, 5000, HEADER_LIMIT + 1000);
+    const chunks = [];
+    for (let i = 0; i < image.length; i += 16384) chunks.push(image.subarray(i, i + 16384));
+    const { err } = await upload(engine, chunks);
+    assert.ifError(err);
+    assert.strictEqual(storage.received.length, image.length);
+});
+
+test('plan limits apply by default', async () => {
+    // Free plan: 16MP max, business: 64MP
+    const free = await upload(validatingStorage(memoryStorage()), [png(5000, 4000)], { user: { plan: 'free' } });
+    assert.ok(free.err instanceof ResolutionExceededError);
+
+    const business = await upload(validatingStorage(memoryStorage()), [png(5000, 4000)], { user: { plan_id: 'business' } });
+    assert.ifError(business.err);
+});
+
+test('a rejection closes the connection once the response is out', async () => {
+    const socket = { ended: false, destroyed: false, end() { this.ended = true; }, destroy() { this.destroyed = true; } };
+    const req = { id: 'req-1', res: new EventEmitter(), socket };
+
+    const { err } = await upload(validatingStorage(memoryStorage(), () => LIMITS), [Buffer.from('not an image at all')], req);
+    assert.ok(err instanceof UnsupportedFormatError);
+    assert.strictEqual(err.requestId, 'req-1');
+    assert.strictEqual(socket.ended, false);
+
+    req.res.emit('finish');
+    assert.strictEqual(socket.ended, true);
+    assert.strictEqual(socket.destroyed, false);
+    await new Promise(resolve => setTimeout(resolve, 1100));
+    assert.strictEqual(socket.destroyed, true);
+});
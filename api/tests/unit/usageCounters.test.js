@@ -0,0 +1,71 @@
+// Flush after 5 increments or 100ms, whichever comes first
+process.env.DB_PATH = ':memory:';
+process.env.USAGE_FLUSH_MAX = '5';
+process.env.USAGE_FLUSH_MS = '100';
+
+const test = require('node:test');
+const assert = require('node:assert');
+const db = require('../../services/db');
+const usageCounters = require('../../utils/usageCounters');
+
+db.prepare(`
+    CREATE TABLE IF NOT EXISTS api_keys (
+        id TEXT PRIMARY KEY,
+        used_count INTEGER DEFAULT 0,
+        last_used_at TEXT
+    )
+`).run();
+db.prepare("INSERT INTO api_keys (id) VALUES ('key-a'), ('key-b')").run();
+db.prepare(`
+    INSERT INTO users (id, email, plan, apiCredits, usage, credits)
+    VALUES ('usage-user', 'usage@example.com', 'pro', 3, 1, 10)
+`).run();
+
+const usedCount = (id) => db.prepare('SELECT used_count FROM api_keys WHERE id = ?').get(id).used_count;
+const delay = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+test('increments are buffered, then written together', async () => {
+    const flushed = [];
+    usageCounters.onFlush(entries => flushed.push(entries));
+
+    usageCounters.add('api_key', 'key-a');
+    usageCounters.add('api_key', 'key-a');
+    usageCounters.add('api_key', 'key-b');
+    assert.strictEqual(usageCounters.pending('api_key', 'key-a'), 2);
+    assert.strictEqual(usedCount('key-a'), 0);
+
+    await delay(300);
+    assert.strictEqual(usageCounters.pending('api_key', 'key-a'), 0);
+    assert.strictEqual(usedCount('key-a'), 2);
+    assert.strictEqual(usedCount('key-b'), 1);
+    assert.deepStrictEqual(flushed.pop().map(entry => `${entry.id}:${entry.count}`), ['key-a:2', 'key-b:1']);
+});
+
+test('a full buffer is written at once', () => {
+    const before = usageCounters.getStats().flushes;
+    usageCounters.add('api_key', 'key-a', 4);
+    assert.strictEqual(usageCounters.getStats().flushes, before);
+    usageCounters.add('api_key', 'key-b');
+    assert.strictEqual(usageCounters.getStats().flushes, before + 1);
+    assert.strictEqual(usedCount('key-a'), 6);
+});
+
+test('user usage draws on apiCredits, then prepaid credits', () => {
+    usageCounters.add('user', 'usage-user', 5);
+    const user = db.prepare('SELECT usage, credits FROM users WHERE id = ?').get('usage-user');
+    assert.deepStrictEqual({ ...user }, { usage: 3, credits: 7 });
+});
+
+test('unknown counters are rejected', () => {
+    assert.throws(() => usageCounters.add('bogus', 1), /Unknown usage counter/);
+});
+
+test('close writes what is buffered and every later increment', () => {
+    usageCounters.add('api_key', 'key-b');
+    usageCounters.close();
+    assert.strictEqual(usageCounters.pending('api_key', 'key-b'), 0);
+
+    const written = usedCount('key-b');
+    usageCounters.add('api_key', 'key-b');
+    assert.strictEqual(usedCount('key-b'), written + 1);
+});
@@ -0,0 +1,121 @@
+/**
+ * API Key Auth Cache
+ *
+ * Resolving an API key bcrypt-compares it against every user's hash
+ * (userController.checkLimit), far too slow to repeat on every request.
+ * Resolved keys are cached, indexed by SHA-256 so raw keys are not kept:
+ *
+ * - The user snapshot (plan, limits, usage) is reused for AUTH_CACHE_TTL_MS
+ *   (default 30s), then reloaded by user id with one indexed query.
+ * - The key -> user mapping survives reloads while the user's stored key
+ *   hash is unchanged, so bcrypt only runs for new or rotated keys.
+ * - invalidateUser() drops a user's entries at once (plan change, upgrade).
+ *   Other cluster processes pick the change up within the TTL.
+ */
+
+const crypto = require('crypto');
+
+const TTL_MS = parseInt(process.env.AUTH_CACHE_TTL_MS || '30000', 10);
+const MAX_ENTRIES = parseInt(process.env.AUTH_CACHE_MAX_ENTRIES || '10000', 10);
+
+const entries = new Map(); // sha256(key) -> { userId, credential, user, loadedAt }
+
+const stats = {
+    hits: 0,
+    misses: 0,
+    reloads: 0,
+    invalidations: 0
+};
+
+function hashKey(key) {
+    return crypto.createHash('sha256').update(key).digest('hex');
+}
+
+/**
+ * Cached user for an API key, or null on a miss
+ *
+ * @param {string} key - Raw API key
+ * @param {Function} reload - (userId) => { credential, user } | null, used
+ *   once the snapshot is older than the TTL
+ */
+function get(key, reload) {
+    const hash = hashKey(key);
+    const entry = entries.get(hash);
+    if (!entry) {
+        stats.misses++;
+        return null;
+    }
+
+    if (Date.now() - entry.loadedAt >= TTL_MS) {
+        stats.reloads++;
+        const fresh = reload(entry.userId);
+        // User removed or key rotated: the caller falls back to a full lookup
+        if (!fresh || fresh.credential !== entry.credential) {
+            entries.delete(hash);
+            stats.misses++;
+            return null;
+        }
+        entry.user = fresh.user;
+        entry.loadedAt = Date.now();
+    }
+
+    // Re-insert so the Map's insertion order doubles as LRU order
+    entries.delete(hash);
+    entries.set(hash, entry);
+    stats.hits++;
+    return entry.user;
+}
+
+/**
+ * Cache a resolved key
+ *
+ * @param {string} credential - The user's stored key hash (or legacy plain
+ *   key); a reload with a different value means the key was rotated
+ */
+function set(key, userId, credential, user) {
+    entries.set(hashKey(key), { userId, credential, user, loadedAt: Date.now() });
+    if (entries.size > MAX_ENTRIES) {
+        entries.delete(entries.keys().next().value);
+    }
+}
+
+/**
+ * Forget a user's keys (plan or key changed)
+ */
+function invalidateUser(userId) {
+    for (const [hash, entry] of entries) {
+        if (entry.userId === userId) {
+            entries.delete(hash);
+            stats.invalidations++;
+        }
+    }
+}
+
+/**
+ * Reload these users' snapshots on next use (usage written to the database)
+ *
+ * @param {Iterable} userIds
+ */
+function markStale(userIds) {
+    const ids = new Set(userIds);
+    if (ids.size === 0) return;
+    for (const entry of entries.values()) {
+        if (ids.has(entry.userId)) entry.loadedAt = 0;
+    }
+}
+
+function clear() {
+    stats.invalidations += entries.size;
+    entries.clear();
+}
+
+function getStats() {
+    return {
+        ttl_ms: TTL_MS,
+        entries: entries.size,
+        max_entries: MAX_ENTRIES,
+        ...stats
+    };
+}
+
+module.exports = { get, set, invalidateUser, markStale, clear, getStats };
@@ -1,56 +1,302 @@
 /**
- * Compression Concurrency Limiter (Semaphore)
+ * Compression Scheduler (Weighted-Fair, Bounded)
  *
  * Prevents CPU spikes by capping how many Sharp compression
  * jobs run simultaneously. On a shared Hostinger VPS with limited
  * cores, running 10 compressions at once = 100% CPU.
  *
- * MAX_CONCURRENT = 3 means at most 3 images are being compressed
- * at any moment. Excess requests wait in queue — they don't fail.
+ * MAX_CONCURRENT (MAX_CONCURRENT_JOBS) images are compressed at any moment:
+ * default 3 in this process, or one per worker with ENGINE_MODE=pool.
+ * Waiting jobs are ordered by weighted fair queuing:
+ *
+ * - Each flow (API key, user or IP) gets a share of the CPU proportional
+ *   to its plan weight (the plan's rate_limit: free 0.5 ... business 10).
+ * - Each job costs megapixels x format effort (AVIF is ~4x JPEG), so one
+ *   free-tier user's large AVIF conversions cannot starve paying customers.
+ * - The queue is bounded (MAX_QUEUED_JOBS, default 10 x MAX_CONCURRENT).
+ *   When full, the job with the latest finish tag is shed with a fast
+ *   503 SERVER_BUSY and a Retry-After estimated from the queued work.
+ *
+ * Depth, wait time and shed counts are kept per plan (see getStats()).
  */
 
-const MAX_CONCURRENT = parseInt(process.env.MAX_CONCURRENT_JOBS || '3', 10);
+const crypto = require('crypto');
+const { PLAN_LIMITS } = require('./quotaManager');
+const { ServerBusyError } = require('./errors');
+const logger = require('./logger');
+const enginePool = require('../services/enginePool');
+
+const MAX_CONCURRENT = parseInt(
+    process.env.MAX_CONCURRENT_JOBS || String(enginePool.ENABLED ? enginePool.POOL_SIZE : 3),
+    10
+);
+const MAX_QUEUED = parseInt(process.env.MAX_QUEUED_JOBS || String(MAX_CONCURRENT * 10), 10);
+
+// Relative CPU per megapixel at the engine's effort settings (JPEG = 1)
+const FORMAT_EFFORT = {
+    jpeg: 1,
+    jpg: 1,
+    png: 1.5,
+    webp: 2,
+    avif: 4
+};
+
+// Retry-After bounds (seconds)
+const MIN_RETRY_AFTER = 1;
+const MAX_RETRY_AFTER = 60;
 
 let running = 0;
-const queue = [];
+let virtualTime = 0;           // start tag of the most recently dispatched job
+let sequence = 0;
+const queue = [];              // waiting jobs (bounded, so linear scans are cheap)
+const flowFinish = new Map();  // flow -> finish tag of its last queued job
+const classes = new Map();     // plan -> metrics
+
+// Seconds of service per unit of cost (EWMA), used for Retry-After
+let secondsPerCost = 0.1;
 
 /**
- * Acquire a slot. Resolves when a slot is free.
+ * Estimate the CPU cost of a job: megapixels x format effort
  */
-function acquire() {
-    return new Promise((resolve) => {
-        if (running < MAX_CONCURRENT) {
-            running++;
-            resolve();
-        } else {
-            queue.push(resolve);
-        }
+function estimateCost({ pixels, format } = {}) {
+    const megapixels = pixels ? pixels / 1e6 : 1;
+    const effort = FORMAT_EFFORT[String(format || '').toLowerCase()] || 1;
+    return Math.max(0.05, megapixels * effort);
+}
+
+function planWeight(plan) {
+    const limits = PLAN_LIMITS[plan] || PLAN_LIMITS.free;
+    return limits.rate_limit || 1;
+}
+
+function classStats(plan) {
+    let stats = classes.get(plan);
+    if (!stats) {
+        stats = {
+            queued: 0,
+            running: 0,
+            admitted: 0,
+            completed: 0,
+            shed: 0,
+            wait_ms_total: 0,
+            wait_ms_max: 0,
+            service_ms_total: 0
+        };
+        classes.set(plan, stats);
+    }
+    return stats;
+}
+
+/**
+ * Seconds until a newly queued job would likely start
+ */
+function estimateRetryAfter() {
+    const queuedCost = queue.reduce((sum, job) => sum + job.cost, 0);
+    const seconds = Math.ceil((queuedCost / MAX_CONCURRENT) * secondsPerCost);
+    return Math.min(MAX_RETRY_AFTER, Math.max(MIN_RETRY_AFTER, seconds));
+}
+
+function shed(job) {
+    const stats = classStats(job.plan);
+    stats.shed++;
+
+    const retryAfter = estimateRetryAfter();
+    logger.warn('Compression job shed', {
+        request_id: job.requestId,
+        plan: job.plan,
+        flow: job.flow,
+        cost: job.cost,
+        queued: queue.length,
+        retry_after: retryAfter
     });
+
+    job.reject(new ServerBusyError(retryAfter, {
+        queued_jobs: queue.length,
+        max_queued_jobs: MAX_QUEUED,
+        your_plan: job.plan
+    }, job.requestId));
 }
 
 /**
- * Release a slot. Wakes up next waiting job.
+ * Undo a shed job's finish tag so its flow is not charged for work that
+ * never ran. The evicted job has the latest tag, so it is its flow's last.
  */
-function release() {
-    const next = queue.shift();
-    if (next) {
-        next(); // hand the slot directly to the next waiter
+function forgetFinish(job) {
+    if (flowFinish.get(job.flow) !== job.finish) return;
+    if (job.previousFinish === undefined) {
+        flowFinish.delete(job.flow);
     } else {
-        running--;
+        flowFinish.set(job.flow, job.previousFinish);
+    }
+}
+
+function dispatch(job) {
+    running++;
+    virtualTime = Math.max(virtualTime, job.start);
+    job.startedAt = Date.now();
+
+    const stats = classStats(job.plan);
+    const waited = job.startedAt - job.enqueuedAt;
+    stats.queued -= job.queued ? 1 : 0;
+    stats.running++;
+    stats.wait_ms_total += waited;
+    stats.wait_ms_max = Math.max(stats.wait_ms_max, waited);
+
+    job.resolve(job);
+}
+
+/**
+ * Acquire a slot. Resolves with the job when it may run; rejects with
+ * ServerBusyError when the queue is full and this job loses.
+ *
+ * @param {Object} options - { plan, flow, pixels, format, requestId }
+ */
+function acquire({ plan = 'free', flow = 'anonymous', pixels, format, requestId } = {}) {
+    return new Promise((resolve, reject) => {
+        const cost = estimateCost({ pixels, format });
+        const previousFinish = flowFinish.get(flow);
+        const start = Math.max(virtualTime, previousFinish || 0);
+        const job = {
+            plan,
+            flow,
+            cost,
+            requestId,
+            previousFinish,
+            start,
+            finish: start + cost / planWeight(plan),
+            seq: sequence++,
+            enqueuedAt: Date.now(),
+            queued: false,
+            resolve,
+            reject
+        };
+
+        classStats(plan).admitted++;
+
+        if (running < MAX_CONCURRENT && queue.length === 0) {
+            flowFinish.set(flow, job.finish);
+            dispatch(job);
+            return;
+        }
+
+        if (queue.length >= MAX_QUEUED) {
+            // Shed whichever job would be served last: the newcomer or the worst queued one
+            let worst = 0;
+            for (let i = 1; i < queue.length; i++) {
+                if (queue[i].finish > queue[worst].finish) worst = i;
+            }
+            if (queue.length === 0 || queue[worst].finish <= job.finish) {
+                shed(job);
+                return;
+            }
+            const [evicted] = queue.splice(worst, 1);
+            classStats(evicted.plan).queued--;
+            forgetFinish(evicted);
+            shed(evicted);
+        }
+
+        flowFinish.set(flow, job.finish);
+        job.queued = true;
+        classStats(plan).queued++;
+        queue.push(job);
+    });
+}
+
+/**
+ * Release a slot. Starts the waiting job with the smallest finish tag.
+ */
+function release(job) {
+    running--;
+
+    const serviceMs = Date.now() - job.startedAt;
+    const stats = classStats(job.plan);
+    stats.running--;
+    stats.completed++;
+    stats.service_ms_total += serviceMs;
+    secondsPerCost += 0.1 * (serviceMs / 1000 / job.cost - secondsPerCost);
+
+    if (queue.length > 0 && running < MAX_CONCURRENT) {
+        let next = 0;
+        for (let i = 1; i < queue.length; i++) {
+            const a = queue[i], b = queue[next];
+            if (a.finish < b.finish || (a.finish === b.finish && a.seq < b.seq)) next = i;
+        }
+        dispatch(queue.splice(next, 1)[0]);
+    }
+
+    // Forget idle flows whose tags are already in the past
+    if (flowFinish.size > 1000 || queue.length === 0) {
+        for (const [flow, finish] of flowFinish) {
+            if (finish <= virtualTime) flowFinish.delete(flow);
+        }
     }
 }
 
 /**
  * Run a function with a concurrency slot.
  * Always releases the slot — even on error.
+ *
+ * @param {Function} fn - async work to run
+ * @param {Object} options - { plan, flow, pixels, format, requestId } used for
+ *   fair ordering; omitted options schedule as a 1MP free-tier JPEG job
  */
-async function withConcurrencyLimit(fn) {
-    await acquire();
+async function withConcurrencyLimit(fn, options = {}) {
+    const job = await acquire(options);
     try {
         return await fn();
     } finally {
-        release();
+        release(job);
+    }
+}
+
+/**
+ * Scheduler options for a request: plan class and fairness flow
+ * (API key, else logged-in user, else client IP)
+ */
+function jobFromRequest(req) {
+    let flow = `ip:${req.ip}`;
+    if (req.apiKey) {
+        // Never keep raw keys in scheduler state or logs
+        flow = `key:${crypto.createHash('sha256').update(req.apiKey).digest('hex').slice(0, 16)}`;
+    } else if (req.user && req.user.id) {
+        flow = `user:${req.user.id}`;
     }
+
+    return {
+        plan: req.user?.plan_id || req.user?.plan || 'free',
+        flow,
+        requestId: req.id
+    };
+}
+
+/**
+ * Scheduler metrics, overall and per plan
+ */
+function getStats() {
+    const perPlan = {};
+    for (const [plan, stats] of classes) {
+        const started = stats.completed + stats.running;
+        perPlan[plan] = {
+            weight: planWeight(plan),
+            queued: stats.queued,
+            running: stats.running,
+            admitted: stats.admitted,
+            completed: stats.completed,
+            shed: stats.shed,
+            avg_wait_ms: started ? Math.round(stats.wait_ms_total / started) : 0,
+            max_wait_ms: stats.wait_ms_max,
+            avg_service_ms: stats.completed ? Math.round(stats.service_ms_total / stats.completed) : 0
+        };
+    }
+
+    return {
+        max_concurrent: MAX_CONCURRENT,
+        max_queued: MAX_QUEUED,
+        running,
+        queued: queue.length,
+        retry_after_estimate: estimateRetryAfter(),
+        plans: perPlan
+    };
 }
 
-module.exports = { withConcurrencyLimit, MAX_CONCURRENT };
+module.exports = { withConcurrencyLimit, jobFromRequest, estimateCost, getStats, MAX_CONCURRENT, MAX_QUEUED };
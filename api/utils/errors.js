@@ -92,6 +92,21 @@ class RateLimitError extends APIError {
     }
 }
 
+class ServerBusyError extends APIError {
+    constructor(retryAfter, details = {}, requestId = null) {
+        super(
+            'SERVER_BUSY',
+            `Server is at capacity. Retry after ${retryAfter} seconds`,
+            503,
+            { ...details, retry_after: retryAfter },
+            requestId
+        );
+
+        // Sent as the Retry-After header
+        this.retryAfter = retryAfter;
+    }
+}
+
 // Specific validation errors
 class ImageSizeExceededError extends ValidationError {
     constructor(maxSize, actualSize) {
@@ -149,6 +164,24 @@ class CorruptedImageError extends ValidationError {
     }
 }
 
+// Decoder messages (sharp / libvips and the codec libraries it wraps) that
+// mean the input itself is broken, as opposed to a server-side failure
+const CORRUPTED_IMAGE_MESSAGES = [
+    /Input (buffer|file) (contains unsupported image format|has corrupt header)/,
+    /VipsJpeg: (Premature end of (JPEG|input) file|Corrupt JPEG data|Invalid SOS parameters|Bogus (marker|Huffman table)|Huffman table 0x[0-9a-f]+ was not defined|Not a JPEG file)/i,
+    /lib(s)?png read error|pngload(_buffer|_source)?: (end of stream|read error)|IDAT: CRC error/,
+    /webpload(_buffer|_source)?: unable to (parse|decode) image/,
+    /heifload(_buffer|_source)?: Invalid input/
+];
+
+/**
+ * Whether an encode error was caused by corrupted input (-> CORRUPTED_IMAGE)
+ */
+function isCorruptedImageError(error) {
+    const message = error && error.message ? String(error.message) : '';
+    return CORRUPTED_IMAGE_MESSAGES.some((pattern) => pattern.test(message));
+}
+
 class TransformationLimitExceededError extends ValidationError {
     constructor(requested, allowed, plan) {
         super(
@@ -167,6 +200,9 @@ class TransformationLimitExceededError extends ValidationError {
 const errorHandler = (err, req, res, next) => {
     // If it's our custom API error
     if (err instanceof APIError) {
+        if (err.retryAfter !== undefined) {
+            res.setHeader('Retry-After', String(err.retryAfter));
+        }
         return res.status(err.statusCode).json(err.toJSON());
     }
 
@@ -198,10 +234,12 @@ module.exports = {
     ValidationError,
     FeatureNotAvailableError,
     RateLimitError,
+    ServerBusyError,
     ImageSizeExceededError,
     UnsupportedFormatError,
     ResolutionExceededError,
     CorruptedImageError,
     TransformationLimitExceededError,
+    isCorruptedImageError,
     errorHandler
 };
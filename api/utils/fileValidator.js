@@ -82,6 +82,7 @@ const validateFileFormat = (file, plan, requestId) => {
 
 /**
  * Validate image resolution (CORRECTED with safety guards)
+ * Accepts a file path or an in-memory Buffer; reads the header only
  */
 const validateResolution = async (filePath, plan, requestId) => {
     const limits = PLAN_LIMITS[plan] || PLAN_LIMITS.free;
@@ -158,7 +159,7 @@ const validateResolution = async (filePath, plan, requestId) => {
 };
 
 /**
- * Check if file is corrupted
+ * Check if file is corrupted (full decode; accepts a path or a Buffer)
  */
 const validateImageIntegrity = async (filePath, requestId) => {
     try {
@@ -183,8 +184,13 @@ const validateImageIntegrity = async (filePath, requestId) => {
 /**
  * Complete file validation
  * Run ALL validations before processing
+ *
+ * Options:
+ * - decode: run the full-decode integrity check (default true). In-memory
+ *   uploads skip it: the encode pipeline decodes once and reports
+ *   CORRUPTED_IMAGE itself.
  */
-const validateFile = async (file, plan, requestId) => {
+const validateFile = async (file, plan, requestId, { decode = true } = {}) => {
     logger.info('Validating file', {
         request_id: requestId,
         filename: file.originalname || file.name,
@@ -198,11 +204,16 @@ const validateFile = async (file, plan, requestId) => {
     // 2. File format (fast check)
     validateFileFormat(file, plan, requestId);
 
+    // Memory storage uploads carry a buffer instead of a path
+    const source = file.buffer || file.path;
+
     // 3. Image integrity (requires reading file)
-    await validateImageIntegrity(file.path, requestId);
+    if (decode) {
+        await validateImageIntegrity(source, requestId);
+    }
 
     // 4. Resolution (requires metadata) - with safety guards
-    const metadata = await validateResolution(file.path, plan, requestId);
+    const metadata = await validateResolution(source, plan, requestId);
 
     logger.info('File validation passed', {
         request_id: requestId,
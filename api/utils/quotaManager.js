@@ -1,5 +1,6 @@
 const db = require('../services/db');
 const logger = require('./logger');
+const usageCounters = require('./usageCounters');
 
 /**
  * Quota Manager (API Key Level)
@@ -100,9 +101,14 @@ const PLAN_LIMITS = {
 
 /**
  * Get API key details from database
+ * used_count includes this process's increments not yet flushed
  */
 const getApiKey = (key) => {
-    return db.prepare('SELECT * FROM api_keys WHERE key = ? AND is_active = 1').get(key);
+    const apiKey = db.prepare('SELECT * FROM api_keys WHERE key = ? AND is_active = 1').get(key);
+    if (apiKey) {
+        apiKey.used_count += usageCounters.pending('api_key', apiKey.id);
+    }
+    return apiKey;
 };
 
 /**
@@ -113,6 +119,9 @@ const checkAndResetCycle = (apiKey) => {
     const resetDate = new Date(apiKey.reset_at);
 
     if (now >= resetDate) {
+        // Land buffered increments before zeroing, so they count toward the old cycle
+        usageCounters.flush();
+
         // Calculate next reset date
         const nextReset = new Date(now);
         nextReset.setMonth(nextReset.getMonth() + 1);
@@ -197,14 +206,11 @@ const checkQuotaSoft = (key, requestId) => {
 
 /**
  * Increment usage counter
+ * Buffered and written in batches (see usageCounters); quota checks
+ * include pending increments.
  */
 const incrementUsage = (apiKeyId, requestId) => {
-    db.prepare(`
-        UPDATE api_keys 
-        SET used_count = used_count + 1,
-            last_used_at = ?
-        WHERE id = ?
-    `).run(new Date().toISOString(), apiKeyId);
+    usageCounters.add('api_key', apiKeyId);
 
     logger.info('Incremented usage', {
         api_key_id: apiKeyId,
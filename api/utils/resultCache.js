@@ -0,0 +1,113 @@
+/**
+ * Optimized Result Cache (Content-Addressed LRU)
+ *
+ * Stores compressed outputs keyed on (account, input SHA-256, normalized
+ * params). Assets re-submitted by the same account are served from memory
+ * instead of re-running Sharp, and the /v1/optimize/precheck endpoint lets
+ * clients skip the upload entirely on a hit.
+ *
+ * Entries are never shared between accounts: with precheck a shared entry
+ * would tell anyone holding a file's hash that another tenant uploaded it,
+ * and hand them that tenant's output. The account is the scheduler flow
+ * (hashed API key, else user id, else client IP; see jobFromRequest).
+ *
+ * Bounded by total bytes (RESULT_CACHE_MAX_MB, default 64MB per process).
+ * Set RESULT_CACHE_MAX_MB=0 to disable.
+ */
+
+const crypto = require('crypto');
+
+const MAX_BYTES = parseInt(process.env.RESULT_CACHE_MAX_MB || '64', 10) * 1024 * 1024;
+
+// Never let a single entry take more than 1/8 of the cache
+const MAX_ENTRY_BYTES = Math.floor(MAX_BYTES / 8);
+
+// Map preserves insertion order: first key = least recently used
+const entries = new Map();
+let totalBytes = 0;
+let hits = 0;
+let misses = 0;
+
+/**
+ * SHA-256 hex digest of a buffer (same digest clients send to precheck)
+ */
+function hashBuffer(buffer) {
+    return crypto.createHash('sha256').update(buffer).digest('hex');
+}
+
+/**
+ * Build a cache key from the account, input hash and normalized compression
+ * params. Equivalent requests (jpg vs jpeg, "80" vs 80, missing vs null)
+ * from the same account share a key.
+ */
+function buildKey(scope, hash, params = {}) {
+    let format = params.format ? String(params.format).toLowerCase() : 'auto';
+    if (format === 'jpg') format = 'jpeg';
+
+    const normalized = [
+        format,
+        params.quality ? parseInt(params.quality, 10) : 'auto',
+        params.method === 'fill' ? 'fill' : 'fit',
+        params.width ? parseInt(params.width, 10) : 0,
+        params.height ? parseInt(params.height, 10) : 0,
+        params.preserve ? 1 : 0
+    ];
+
+    return `${scope || 'anonymous'}|${String(hash).toLowerCase()}:${normalized.join(':')}`;
+}
+
+/**
+ * Look up a cached result. Refreshes its LRU position on hit.
+ */
+function get(key) {
+    const entry = entries.get(key);
+    if (!entry) {
+        misses++;
+        return null;
+    }
+
+    entries.delete(key);
+    entries.set(key, entry);
+    hits++;
+    return entry;
+}
+
+/**
+ * Store a result: { data: Buffer, format, originalSize, width, height }
+ */
+function set(key, entry) {
+    if (MAX_BYTES <= 0 || !entry.data || entry.data.length > MAX_ENTRY_BYTES) {
+        return;
+    }
+
+    const existing = entries.get(key);
+    if (existing) {
+        totalBytes -= existing.data.length;
+        entries.delete(key);
+    }
+
+    entries.set(key, entry);
+    totalBytes += entry.data.length;
+
+    // Evict least recently used entries until under budget
+    for (const [oldKey, oldEntry] of entries) {
+        if (totalBytes <= MAX_BYTES) break;
+        entries.delete(oldKey);
+        totalBytes -= oldEntry.data.length;
+    }
+}
+
+/**
+ * Cache statistics for monitoring
+ */
+function stats() {
+    return {
+        entries: entries.size,
+        bytes: totalBytes,
+        max_bytes: MAX_BYTES,
+        hits,
+        misses
+    };
+}
+
+module.exports = { hashBuffer, buildKey, get, set, stats, MAX_BYTES };
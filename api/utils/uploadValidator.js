@@ -0,0 +1,309 @@
+const path = require('path');
+const { PassThrough } = require('stream');
+const { PLAN_LIMITS } = require('./quotaManager');
+const { ImageSizeExceededError, UnsupportedFormatError, ResolutionExceededError } = require('./errors');
+
+/**
+ * Streaming Upload Validator
+ *
+ * Wraps a multer storage engine and checks each upload while it streams
+ * in. Nothing is buffered in full or written to disk before these checks:
+ *
+ * 1. Format from the magic bytes (UNSUPPORTED_FORMAT 415)
+ * 2. Dimensions from the image header (RESOLUTION_EXCEEDED 413 above the
+ *    plan's maxPixels). At most HEADER_LIMIT bytes are held back for this.
+ * 3. Bytes received (IMAGE_SIZE_EXCEEDED 413 above max_file_size)
+ *
+ * A rejected upload gets its error response at once. The connection
+ * closes ABORT_LINGER_MS later instead of reading the rest of the body; a
+ * client still sending after that sees a reset rather than the response.
+ * Headers that can't be parsed within HEADER_LIMIT pass through;
+ * fileValidator still runs the full checks after the upload.
+ *
+ * Limits come from the API plan (PLAN_LIMITS) by default; the web upload
+ * routes pass their own (size only, see middleware/universalParser.js).
+ */
+
+// JPEG APP segments (EXIF, ICC) can push the frame header far back
+const HEADER_LIMIT = 256 * 1024;
+
+// Keep reading (and discarding) this long after a rejection before closing,
+// so a client that is still sending can read the response
+const ABORT_LINGER_MS = 1000;
+
+/**
+ * Read format and dimensions from the start of an image
+ *
+ * @param {Buffer} buf - First bytes of the file
+ * @returns {Object|undefined} { format, width, height }, undefined while more
+ *   bytes are needed. format is null for unknown content; width/height are
+ *   null when the header can't be parsed.
+ */
+function readImageHeader(buf) {
+    if (buf.length < 12) return undefined;
+
+    // PNG: IHDR is always the first chunk
+    if (buf.readUInt32BE(0) === 0x89504E47) {
+        if (buf.length < 24) return undefined;
+        if (buf.toString('latin1', 12, 16) !== 'IHDR') return { format: 'png', width: null, height: null };
+        return { format: 'png', width: buf.readUInt32BE(16), height: buf.readUInt32BE(20) };
+    }
+
+    if (buf[0] === 0xFF && buf[1] === 0xD8 && buf[2] === 0xFF) {
+        return jpegHeader(buf);
+    }
+
+    if (buf.toString('latin1', 0, 4) === 'RIFF' && buf.toString('latin1', 8, 12) === 'WEBP') {
+        return webpHeader(buf);
+    }
+
+    if (buf.toString('latin1', 4, 8) === 'ftyp') {
+        return avifHeader(buf);
+    }
+
+    return { format: null, width: null, height: null };
+}
+
+// Walk the marker segments up to the first SOFn (frame header)
+function jpegHeader(buf) {
+    let pos = 2;
+    while (pos + 4 <= buf.length) {
+        if (buf[pos] !== 0xFF) return { format: 'jpeg', width: null, height: null };
+
+        const marker = buf[pos + 1];
+        if (marker === 0xFF) {
+            pos++; // fill byte
+            continue;
+        }
+        if (marker === 0x01 || (marker >= 0xD0 && marker <= 0xD7)) {
+            pos += 2; // standalone marker, no length
+            continue;
+        }
+        // Scan data or end of image before any frame header
+        if (marker === 0xDA || marker === 0xD9) return { format: 'jpeg', width: null, height: null };
+
+        // SOF0-SOF15, except DHT (C4), JPG (C8) and DAC (CC)
+        if (marker >= 0xC0 && marker <= 0xCF && marker !== 0xC4 && marker !== 0xC8 && marker !== 0xCC) {
+            if (pos + 9 > buf.length) return undefined;
+            return { format: 'jpeg', height: buf.readUInt16BE(pos + 5), width: buf.readUInt16BE(pos + 7) };
+        }
+
+        pos += 2 + buf.readUInt16BE(pos + 2);
+    }
+    return undefined;
+}
+
+function webpHeader(buf) {
+    if (buf.length < 30) return undefined;
+
+    const chunk = buf.toString('latin1', 12, 16);
+    if (chunk === 'VP8 ') {
+        // Lossy: 14-bit sizes after the frame tag and start code
+        return { format: 'webp', width: buf.readUInt16LE(26) & 0x3FFF, height: buf.readUInt16LE(28) & 0x3FFF };
+    }
+    if (chunk === 'VP8L') {
+        // Lossless: signature byte, then 14 bits width - 1, 14 bits height - 1
+        const bits = buf.readUInt32LE(21);
+        return { format: 'webp', width: (bits & 0x3FFF) + 1, height: ((bits >>> 14) & 0x3FFF) + 1 };
+    }
+    if (chunk === 'VP8X') {
+        // Extended: 24-bit canvas width - 1, height - 1
+        return { format: 'webp', width: buf.readUIntLE(24, 3) + 1, height: buf.readUIntLE(27, 3) + 1 };
+    }
+    return { format: 'webp', width: null, height: null };
+}
+
+function avifHeader(buf) {
+    const ftypSize = buf.readUInt32BE(0);
+    if (ftypSize < 16 || ftypSize > HEADER_LIMIT) return { format: null, width: null, height: null };
+    if (buf.length < ftypSize) return undefined;
+
+    // Major brand (8) and compatible brands (16...); 12 is the minor version
+    const brands = [buf.toString('latin1', 8, 12)];
+    for (let i = 16; i + 4 <= ftypSize; i += 4) {
+        brands.push(buf.toString('latin1', i, i + 4));
+    }
+    if (!brands.includes('avif') && !brands.includes('avis')) {
+        return { format: null, width: null, height: null };
+    }
+
+    const extents = ispeExtents(buf, ftypSize, buf.length, 0);
+    if (extents === undefined) return undefined;
+    return { format: 'avif', width: extents ? extents.width : null, height: extents ? extents.height : null };
+}
+
+// Largest ispe (image spatial extents) property under meta > iprp > ipco.
+// undefined while the meta box is incomplete, null when there is none.
+const AVIF_PATH = ['meta', 'iprp', 'ipco'];
+
+function ispeExtents(buf, start, end, depth) {
+    let pos = start;
+    let best = null;
+
+    while (pos + 8 <= end) {
+        let size = buf.readUInt32BE(pos);
+        const type = buf.toString('latin1', pos + 4, pos + 8);
+        let header = 8;
+        if (size === 1) {
+            if (pos + 16 > end) return undefined;
+            size = Number(buf.readBigUInt64BE(pos + 8));
+            header = 16;
+        }
+        // size 0 runs to the end of the file: only media data does that
+        if (size === 0 || size < header) return null;
+
+        if (depth === AVIF_PATH.length) {
+            if (type === 'ispe' && pos + header + 12 <= end) {
+                // Full box: version/flags, then 32-bit width and height
+                const width = buf.readUInt32BE(pos + header + 4);
+                const height = buf.readUInt32BE(pos + header + 8);
+                if (!best || width * height > best.width * best.height) best = { width, height };
+            }
+        } else if (type === AVIF_PATH[depth]) {
+            if (pos + size > buf.length) return undefined;
+            const contentStart = pos + header + (type === 'meta' ? 4 : 0);
+            return ispeExtents(buf, contentStart, pos + size, depth + 1);
+        } else if (depth === 0 && type === 'mdat') {
+            return null; // media data before metadata: give up rather than buffer it
+        }
+
+        pos += size;
+    }
+
+    if (depth === 0) return undefined;
+    return best;
+}
+
+/**
+ * API plan limits for the request (quotaManager.PLAN_LIMITS)
+ */
+function planLimits(req) {
+    const plan = req.user?.plan_id || req.user?.plan || 'free';
+    return PLAN_LIMITS[plan] || PLAN_LIMITS.free;
+}
+
+/**
+ * Limits check for a parsed header; returns the error to reject with, if any
+ */
+function checkHeader(header, file, limits) {
+    if (!header.format) {
+        const declared = path.extname(file.originalname || '').replace('.', '').toLowerCase();
+        return new UnsupportedFormatError(declared || 'unknown', limits.allowed_formats);
+    }
+    if (!limits.allowed_formats.includes(header.format)) {
+        return new UnsupportedFormatError(header.format, limits.allowed_formats);
+    }
+    if (header.width && header.height && header.width * header.height > limits.maxPixels) {
+        return new ResolutionExceededError(header.width, header.height, limits.maxPixels);
+    }
+    return null;
+}
+
+// Send the error now, stop reading the body shortly after: FIN once the
+// response is out, then close. Clients read the response when their send fails.
+function closeAfterResponse(req) {
+    const res = req.res;
+    const socket = req.socket;
+    if (!res || !socket) return;
+
+    res.once('finish', () => {
+        socket.end();
+        setTimeout(() => socket.destroy(), ABORT_LINGER_MS).unref();
+    });
+}
+
+function handleFile(storage, limitsFor, req, file, cb) {
+    const limits = limitsFor(req);
+    const maxSize = limits.max_file_size;
+    const source = file.stream;
+    const head = [];
+    let headLength = 0;
+    let received = 0;
+    let output = null; // feeds the wrapped storage once the header passed
+    let settled = false;
+
+    const finish = (err, info) => {
+        if (settled) {
+            // Rejected after the wrapped storage started: delete what it wrote
+            if (!err && info) storage._removeFile(req, { ...file, ...info }, () => {});
+            return;
+        }
+        settled = true;
+        cb(err, info);
+    };
+
+    const reject = (error) => {
+        error.requestId = req.id;
+        source.removeListener('data', onData);
+        source.removeListener('end', onEnd);
+        source.resume(); // discard whatever the parser still emits
+        closeAfterResponse(req);
+        finish(error);
+        if (output) output.end();
+    };
+
+    const write = (chunk) => {
+        if (!output.write(chunk)) {
+            source.pause();
+            output.once('drain', () => source.resume());
+        }
+    };
+
+    const start = (header) => {
+        const error = header && checkHeader(header, file, limits);
+        if (error) return reject(error);
+
+        output = new PassThrough();
+        storage._handleFile(req, { ...file, stream: output }, finish);
+        write(Buffer.concat(head, headLength));
+    };
+
+    function onData(chunk) {
+        received += chunk.length;
+        if (received > maxSize) {
+            // your_size is what arrived before the cut-off, not the full file
+            return reject(new ImageSizeExceededError(maxSize, received));
+        }
+        if (output) return write(chunk);
+
+        head.push(chunk);
+        headLength += chunk.length;
+        const header = readImageHeader(Buffer.concat(head, headLength));
+        if (header !== undefined || headLength >= HEADER_LIMIT) {
+            start(header);
+        }
+    }
+
+    function onEnd() {
+        if (!output) {
+            // Shorter than the header needed: a truncated file is left to
+            // fileValidator (CORRUPTED_IMAGE)
+            start(readImageHeader(Buffer.concat(head, headLength)));
+        }
+        if (output && !settled) output.end();
+    }
+
+    source.on('data', onData);
+    source.on('end', onEnd);
+    source.on('error', (error) => {
+        finish(error);
+        if (output) output.end();
+    });
+}
+
+/**
+ * Multer storage engine that validates uploads against the user's plan
+ * while they stream in, then hands them to `storage`
+ *
+ * @param {Object} storage - multer.memoryStorage() or multer.diskStorage(...)
+ * @param {Function} limitsFor - (req) => { max_file_size, allowed_formats,
+ *   maxPixels }; defaults to the API plan limits
+ */
+function validatingStorage(storage, limitsFor = planLimits) {
+    return {
+        _handleFile: (req, file, cb) => handleFile(storage, limitsFor, req, file, cb),
+        _removeFile: (req, file, cb) => storage._removeFile(req, file, cb)
+    };
+}
+
+module.exports = { validatingStorage, readImageHeader, HEADER_LIMIT };
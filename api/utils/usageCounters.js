@@ -0,0 +1,183 @@
+/**
+ * Usage Counters (Write-Behind)
+ *
+ * Successful API calls used to run an UPDATE in the request path, so busy
+ * API keys serialized on the SQLite writer. Increments are buffered in
+ * memory instead and written in one transaction every USAGE_FLUSH_MS
+ * (default 1000), sooner once USAGE_FLUSH_MAX (default 100) are pending,
+ * and by close() on shutdown.
+ *
+ * Quota checks add pending() to the stored count, so one process never
+ * overshoots a quota. Across cluster processes, the other processes' use
+ * shows up once they flush:
+ *
+ * - api_keys (quotaManager) are read from the database on every check, so
+ *   the overshoot is bounded by what the others buffer in one flush interval.
+ * - users (userController.checkLimit) come from the auth cache snapshot,
+ *   reused for AUTH_CACHE_TTL_MS. Users within USAGE_RECHECK_MARGIN
+ *   (default 100) of their limit have usage re-read on every check, which
+ *   gives the same one-interval bound. Farther from the limit, the snapshot
+ *   can lag by one TTL plus one flush interval.
+ */
+
+const db = require('../services/db');
+const logger = require('./logger');
+
+const FLUSH_MS = parseInt(process.env.USAGE_FLUSH_MS || '1000', 10);
+const FLUSH_MAX = parseInt(process.env.USAGE_FLUSH_MAX || '100', 10);
+
+// Counter kind -> UPDATE applying @count increments to row @id
+const STATEMENTS = {
+    // api_keys.used_count (quotaManager, /v1 API)
+    api_key: `
+        UPDATE api_keys
+        SET used_count = used_count + @count,
+            last_used_at = @now
+        WHERE id = @id
+    `,
+    // users.usage until apiCredits is used up, then prepaid credits (userController)
+    user: `
+        UPDATE users
+        SET usage = usage + MIN(@count, MAX(apiCredits - usage, 0)),
+            credits = MAX(credits - (@count - MIN(@count, MAX(apiCredits - usage, 0))), 0),
+            lastUsedDate = @now
+        WHERE id = @id
+    `
+};
+
+const prepared = {};
+const pendingCounts = new Map(); // "kind:id" -> { kind, id, count }
+const listeners = [];
+let pendingTotal = 0;
+let timer = null;
+let closed = false;  // after close(): flush on every add, no timer
+
+const stats = {
+    increments: 0,
+    flushes: 0,
+    rows_written: 0,
+    failures: 0,
+    last_flush_ms: 0
+};
+
+function schedule() {
+    if (!timer && !closed) {
+        timer = setTimeout(flush, FLUSH_MS);
+        timer.unref();
+    }
+}
+
+/**
+ * Record `count` uses of a row; written on the next flush
+ *
+ * @param {string} kind - 'api_key' or 'user'
+ * @param {string|number} id - Row id
+ */
+function add(kind, id, count = 1) {
+    if (!STATEMENTS[kind]) {
+        throw new Error(`Unknown usage counter: ${kind}`);
+    }
+
+    const key = `${kind}:${id}`;
+    const entry = pendingCounts.get(key);
+    if (entry) {
+        entry.count += count;
+    } else {
+        pendingCounts.set(key, { kind, id, count });
+    }
+    pendingTotal += count;
+    stats.increments += count;
+
+    if (closed || pendingTotal >= FLUSH_MAX) {
+        flush();
+    } else {
+        schedule();
+    }
+}
+
+/**
+ * Increments recorded by this process but not yet written
+ */
+function pending(kind, id) {
+    const entry = pendingCounts.get(`${kind}:${id}`);
+    return entry ? entry.count : 0;
+}
+
+/**
+ * Write all pending increments in one transaction.
+ * Synchronous (better-sqlite3), so no increment can slip in mid-flush.
+ */
+function flush() {
+    if (timer) {
+        clearTimeout(timer);
+        timer = null;
+    }
+    if (pendingCounts.size === 0) return;
+
+    const entries = [...pendingCounts.values()];
+    const started = Date.now();
+    const now = new Date().toISOString();
+
+    try {
+        db.transaction(() => {
+            for (const entry of entries) {
+                if (!prepared[entry.kind]) {
+                    prepared[entry.kind] = db.prepare(STATEMENTS[entry.kind]);
+                }
+                prepared[entry.kind].run({ id: entry.id, count: entry.count, now });
+            }
+        })();
+    } catch (error) {
+        // Keep the counts and try again next interval
+        stats.failures++;
+        logger.error('Usage counter flush failed', { error: error.message, rows: entries.length });
+        schedule();
+        return;
+    }
+
+    pendingCounts.clear();
+    pendingTotal = 0;
+    stats.flushes++;
+    stats.rows_written += entries.length;
+    stats.last_flush_ms = Date.now() - started;
+
+    for (const listener of listeners) {
+        listener(entries);
+    }
+}
+
+/**
+ * Call listener(entries) after each successful flush
+ * (e.g. to refresh cached usage snapshots)
+ */
+function onFlush(listener) {
+    listeners.push(listener);
+}
+
+function getStats() {
+    return {
+        flush_ms: FLUSH_MS,
+        flush_max: FLUSH_MAX,
+        pending_rows: pendingCounts.size,
+        pending_increments: pendingTotal,
+        ...stats
+    };
+}
+
+/**
+ * Write what is still buffered; later increments are written at once.
+ * Called from the server's shutdown path. Counts that fail to write are
+ * logged as lost.
+ */
+function close() {
+    closed = true;
+    flush();
+    if (pendingCounts.size > 0) {
+        logger.error('Usage counts lost on shutdown', { rows: pendingCounts.size, increments: pendingTotal });
+    }
+}
+
+// Last resort for exits that skip close() (e.g. process.exit() in a script)
+process.on('exit', flush);
+
+module.exports = { add, pending, flush, close, onFlush, getStats, FLUSH_MS, FLUSH_MAX };
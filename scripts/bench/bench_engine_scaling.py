@@ -0,0 +1,137 @@
+"""
+Benchmark: engine throughput vs client concurrency, inline vs worker pool
+
+Start the API once per engine mode, with the result cache disabled so every
+request really encodes:
+
+    RESULT_CACHE_MAX_MB=0 ENGINE_MODE=inline PORT=5001 node server.js
+    RESULT_CACHE_MAX_MB=0 ENGINE_MODE=pool   PORT=5002 node server.js
+
+Then sweep client concurrency through the Python SDK:
+
+    python bench_engine_scaling.py --api-key KEY --levels 1 2 4 8 16 \
+        inline=http://localhost:5001/api/v1 pool=http://localhost:5002/api/v1
+
+Per level the table shows throughput, p50 latency and the server's own
+timing from the Server-Timing header: time queued for a slot, encode wall
+time, and (pool mode) worker CPU time. "cores" is total worker CPU time
+divided by elapsed time, i.e. how many cores the engine kept busy. In pool
+mode it should climb with concurrency up to ENGINE_WORKERS.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'sdks', 'shrinkix-python'))
+
+from shrinkix import Shrinkix, ApiError, NetworkError  # noqa: E402
+from bench_optimize_pipeline import DEFAULT_IMAGES, FIXTURES, percentile, _named  # noqa: E402
+
+
+def run_level(client, payloads, requests, concurrency, options):
+    def one(i):
+        name, content = payloads[i % len(payloads)]
+        start = time.perf_counter()
+        try:
+            result = client.optimize.optimize(file=_named(name, content), **options)
+        except (ApiError, NetworkError) as e:
+            return time.perf_counter() - start, None, e
+        return time.perf_counter() - start, result.server_timing, None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    ok = [s for s in samples if s[2] is None]
+    errors = [s[2] for s in samples if s[2] is not None]
+    if errors:
+        print(f'  [c={concurrency}] {len(errors)} errors, first: {getattr(errors[0], "code", "")} {errors[0]}')
+    if not ok:
+        return None
+
+    timings = [s[1] for s in ok]
+    cpu = [t['cpu'] for t in timings if 'cpu' in t]
+    return {
+        'concurrency': concurrency,
+        'ok': len(ok),
+        'throughput': len(ok) / elapsed,
+        'p50_ms': percentile([s[0] for s in ok], 50) * 1000,
+        'queue_ms': statistics.mean(t.get('queue', 0.0) for t in timings),
+        'encode_ms': statistics.mean(t.get('encode', 0.0) for t in timings),
+        'cpu_ms': statistics.mean(cpu) if cpu else None,
+        'cores': sum(cpu) / 1000 / elapsed if cpu else None
+    }
+
+
+def print_table(label, rows):
+    print(f'\n=== {label} ===')
+    print(f"{'conc':>5} {'ok':>5} {'img/s':>8} {'speedup':>8} {'p50 ms':>8} "
+          f"{'queue ms':>9} {'encode ms':>10} {'cpu ms':>8} {'cores':>6}")
+    base = rows[0]['throughput']
+    for row in rows:
+        cpu_ms = f"{row['cpu_ms']:>8.1f}" if row['cpu_ms'] is not None else f"{'-':>8}"
+        cores = f"{row['cores']:>6.2f}" if row['cores'] is not None else f"{'-':>6}"
+        print(f"{row['concurrency']:>5} {row['ok']:>5} {row['throughput']:>8.1f} "
+              f"{row['throughput'] / base:>7.2f}x {row['p50_ms']:>8.1f} "
+              f"{row['queue_ms']:>9.1f} {row['encode_ms']:>10.1f} {cpu_ms} {cores}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('targets', nargs='+', help='label=base_url pairs, e.g. pool=http://localhost:5002/api/v1')
+    parser.add_argument('--api-key', default=os.environ.get('SHRINKIX_API_KEY'), required='SHRINKIX_API_KEY' not in os.environ)
+    parser.add_argument('--images', nargs='+', default=[os.path.join(FIXTURES, name) for name in DEFAULT_IMAGES])
+    parser.add_argument('--levels', nargs='+', type=int, default=[1, 2, 4, 8, 16], help='Client concurrency levels')
+    parser.add_argument('--requests', type=int, default=64, help='Requests per level')
+    parser.add_argument('--format', help='e.g. avif for a CPU-heavy run')
+    parser.add_argument('--quality', type=int)
+    parser.add_argument('--sandbox', action='store_true')
+    args = parser.parse_args()
+
+    options = {}
+    if args.format:
+        options['format'] = args.format
+    if args.quality:
+        options['quality'] = args.quality
+
+    payloads = []
+    for path in args.images:
+        with open(path, 'rb') as f:
+            payloads.append((os.path.basename(path), f.read()))
+
+    print('Benchmarking engine scaling...')
+    print(f'Images: {", ".join(name for name, _ in payloads)}')
+    print(f'Levels: {args.levels}, {args.requests} requests each, options {options or "default"}')
+
+    failed = False
+    for target in args.targets:
+        label, _, base_url = target.partition('=')
+        # No SDK retries: a 503 SERVER_BUSY should show up as an error, not as latency
+        client = Shrinkix(api_key=args.api_key, base_url=base_url, sandbox=args.sandbox, max_retries=0)
+        print(f'\nRunning {label} ({base_url})...')
+
+        # Warm up connections and start the engine workers
+        run_level(client, payloads, max(args.levels), max(args.levels), options)
+
+        rows = []
+        for level in args.levels:
+            row = run_level(client, payloads, args.requests, level, options)
+            if row:
+                rows.append(row)
+        client.close()
+
+        if rows:
+            print_table(label, rows)
+        else:
+            print(f'[FAIL] {label}: no successful requests')
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,146 @@
+"""
+Benchmark: /v1/optimize disk pipeline vs in-memory pipeline
+
+Start the API twice, once per storage mode, with the result cache disabled
+so every request really encodes:
+
+    RESULT_CACHE_MAX_MB=0 OPTIMIZE_STORAGE=disk   PORT=5001 node server.js
+    RESULT_CACHE_MAX_MB=0 OPTIMIZE_STORAGE=memory PORT=5002 node server.js
+
+Then drive both through the Python SDK:
+
+    python bench_optimize_pipeline.py --api-key KEY \
+        disk=http://localhost:5001/api/v1 memory=http://localhost:5002/api/v1
+
+Targets run one after another with identical settings. Use a sandbox key or
+an account with enough quota for requests x targets.
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'sdks', 'shrinkix-python'))
+
+from shrinkix import Shrinkix, ApiError, NetworkError  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(__file__), '..', '..', 'tests', 'fixtures')
+DEFAULT_IMAGES = ['compressed_python.png', 'compressed_java_test.jpg', 'compressed_python_test.webp']
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_target(label, base_url, api_key, images, requests, concurrency, options, sandbox):
+    client = Shrinkix(api_key=api_key, base_url=base_url, sandbox=sandbox)
+    payloads = []
+    for path in images:
+        with open(path, 'rb') as f:
+            payloads.append((os.path.basename(path), f.read()))
+
+    def one(i):
+        name, content = payloads[i % len(payloads)]
+        start = time.perf_counter()
+        try:
+            result = client.optimize.optimize(file=_named(name, content), **options)
+        except (ApiError, NetworkError) as e:
+            return time.perf_counter() - start, None, e
+        return time.perf_counter() - start, result, None
+
+    # Warm up connections and the JIT
+    for i in range(min(concurrency, requests)):
+        one(i)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    client.close()
+
+    latencies = [s[0] for s in samples if s[2] is None]
+    errors = [s[2] for s in samples if s[2] is not None]
+    if errors:
+        print(f'  [{label}] {len(errors)} errors, first: {getattr(errors[0], "code", "")} {errors[0]}')
+    if not latencies:
+        return None
+
+    return {
+        'label': label,
+        'ok': len(latencies),
+        'errors': len(errors),
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'mean_ms': statistics.mean(latencies) * 1000
+    }
+
+
+def _named(name, content):
+    stream = io.BytesIO(content)
+    stream.name = name  # lets the server infer the output format
+    return stream
+
+
+def print_table(rows):
+    print('\n=== Results ===')
+    print(f"{'target':<10} {'ok':>5} {'err':>5} {'img/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8}")
+    for row in rows:
+        print(f"{row['label']:<10} {row['ok']:>5} {row['errors']:>5} {row['throughput']:>8.1f} "
+              f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['mean_ms']:>8.1f}")
+
+    if len(rows) == 2:
+        base, other = rows
+        print(f"\n{other['label']} vs {base['label']}: "
+              f"{other['throughput'] / base['throughput']:.2f}x throughput, "
+              f"{base['p50_ms'] / other['p50_ms']:.2f}x faster p50")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('targets', nargs='+', help='label=base_url pairs, e.g. disk=http://localhost:5001/api/v1')
+    parser.add_argument('--api-key', default=os.environ.get('SHRINKIX_API_KEY'), required='SHRINKIX_API_KEY' not in os.environ)
+    parser.add_argument('--images', nargs='+', default=[os.path.join(FIXTURES, name) for name in DEFAULT_IMAGES])
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--format')
+    parser.add_argument('--quality', type=int)
+    parser.add_argument('--width', type=int, help='Also resize to this width')
+    parser.add_argument('--sandbox', action='store_true')
+    args = parser.parse_args()
+
+    options = {}
+    if args.format:
+        options['format'] = args.format
+    if args.quality:
+        options['quality'] = args.quality
+    if args.width:
+        options['resize'] = {'width': args.width, 'fit': 'fit'}
+
+    print('Benchmarking /v1/optimize pipelines...')
+    print(f'Images: {", ".join(os.path.basename(p) for p in args.images)}')
+    print(f'Requests: {args.requests} per target, concurrency {args.concurrency}, options {options or "default"}')
+
+    rows = []
+    for target in args.targets:
+        label, _, base_url = target.partition('=')
+        print(f'\nRunning {label} ({base_url})...')
+        row = run_target(label, base_url, args.api_key, args.images, args.requests, args.concurrency, options, args.sandbox)
+        if row:
+            rows.append(row)
+
+    if not rows:
+        print('[FAIL] No successful requests')
+        return 1
+
+    print_table(rows)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -2,9 +2,17 @@
 Shrinkix Python SDK
 Official Python client for Shrinkix Image Optimization API
 """
+from typing import Optional
+
 from .transport import Transport
+from .local import LocalTransport
 from .resources import Optimize, Usage, Limits, Validate
-from .errors import ApiError, NetworkError
+from .errors import ApiError, NetworkError, AdmissionError
+from .predictor import SavingsPredictor
+from .admission import ByteBudget
+from .ratelimit import SharedRateLimiter
+from .concurrency import AdaptiveLimiter
+from .streaming import Progress
 
 
 class Shrinkix:
@@ -14,38 +22,99 @@ class Shrinkix:
     Example:
         client = Shrinkix(api_key="sk_live_xxx")
         result = client.optimize.optimize(file="photo.jpg", quality=80)
+
+        # Offline / CI: same interface, encoded locally with Pillow
+        client = Shrinkix(local=True)
     """
     
     def __init__(
         self,
-        api_key: str,
+        api_key: Optional[str] = None,
         base_url: str = "https://api.shrinkix.com/v1",
-        sandbox: bool = False
+        sandbox: bool = False,
+        predictor: Optional[SavingsPredictor] = None,
+        local: bool = False,
+        workers: Optional[int] = None,
+        max_inflight_bytes: Optional[int] = None,
+        block_on_budget: bool = True,
+        budget_timeout: Optional[float] = None,
+        rate_limiter: Optional[SharedRateLimiter] = None,
+        concurrency: Optional[AdaptiveLimiter] = None,
+        max_retries: int = 2,
+        max_retry_wait: float = 30.0
     ):
         """
         Initialize Shrinkix client
         
         Args:
-            api_key: Your API key
+            api_key: Your API key (not needed in local mode)
             base_url: API base URL (optional)
             sandbox: Enable sandbox mode (optional)
+            predictor: SavingsPredictor used to skip uploads unlikely to shrink (optional)
+            local: Run optimizations on this machine instead of the API (requires Pillow)
+            workers: Local engine worker processes (optional, defaults to all cores)
+            max_inflight_bytes: Cap on image bytes held in flight across threads (optional, unbounded)
+            block_on_budget: Wait for room in the budget (True) or raise AdmissionError (False)
+            budget_timeout: Maximum wait in seconds for budget room (optional, waits forever)
+            rate_limiter: SharedRateLimiter pacing all processes that use this API key (optional)
+            concurrency: AdaptiveLimiter for optimize_many/optimize_iter/optimize_async (optional, default limiter)
+            max_retries: Retries for 429/503 responses, honoring Retry-After
+            max_retry_wait: Longest Retry-After (seconds) worth waiting for; longer waits raise
         """
-        if not api_key:
+        if not api_key and not local:
             raise ValueError("API key is required")
         
         self.api_key = api_key
         self.base_url = base_url
         self.sandbox = sandbox
+        self.predictor = predictor
+        self.rate_limiter = rate_limiter
+        
+        self.local = local
+        
+        # Memory admission control shared by all calls on this client
+        self.budget = None
+        if max_inflight_bytes:
+            self.budget = ByteBudget(max_inflight_bytes, block=block_on_budget, timeout=budget_timeout)
         
         # Initialize transport
-        self.transport = Transport(api_key, base_url, sandbox)
+        if local:
+            self.transport = LocalTransport(workers, self.budget)
+        else:
+            self.transport = Transport(
+                api_key, base_url, sandbox, self.budget, rate_limiter,
+                max_retries=max_retries, max_retry_wait=max_retry_wait
+            )
         
         # Initialize resources
-        self.optimize = Optimize(self.transport)
+        self.optimize = Optimize(self.transport, predictor, concurrency)
         self.usage = Usage(self.transport)
         self.limits = Limits(self.transport)
         self.validate = Validate(self.transport)
+    
+    def metrics(self) -> dict:
+        """Client-side runtime metrics"""
+        metrics = {"concurrency": self.optimize.concurrency.stats()}
+        if self.budget is not None:
+            metrics["inflight_bytes"] = self.budget.stats()
+        if self.rate_limiter is not None:
+            metrics["rate_limit"] = self.rate_limiter.stats()
+        if not self.local:
+            metrics["retries"] = self.transport.retries
+        return metrics
+    
+    def close(self):
+        """Release connections (and local worker processes)"""
+        self.optimize.close()
+        self.transport.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
 
 
 __version__ = "1.0.0"
-__all__ = ["Shrinkix", "ApiError", "NetworkError"]
+__all__ = ["Shrinkix", "ApiError", "NetworkError", "AdmissionError", "SavingsPredictor", "ByteBudget",
+           "SharedRateLimiter", "AdaptiveLimiter", "Progress"]
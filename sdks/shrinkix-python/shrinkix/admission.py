@@ -0,0 +1,159 @@
+"""
+Memory Admission Control
+Caps image bytes held in flight (uploads being sent, responses being buffered)
+across all threads sharing a client
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+from .errors import AdmissionError
+
+
+class ByteBudget:
+    """
+    Blocking byte semaphore
+
+    Example:
+        budget = ByteBudget(256 * 1024 * 1024)
+        with budget.reserve(len(data)):
+            ...  # at most 256MB reserved across all threads
+    """
+
+    def __init__(self, max_bytes: int, block: bool = True, timeout: Optional[float] = None):
+        """
+        Args:
+            max_bytes: Total bytes that may be reserved at once
+            block: Wait for room (True) or fail fast with AdmissionError (False)
+            timeout: Maximum wait in seconds when blocking (optional, waits forever)
+        """
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+
+        self.max_bytes = max_bytes
+        self.block = block
+        self.timeout = timeout
+
+        self._in_use = 0
+        self._peak = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._cond = threading.Condition()
+
+    @property
+    def in_use(self) -> int:
+        """Bytes currently reserved"""
+        with self._cond:
+            return self._in_use
+
+    def acquire(self, nbytes: int) -> None:
+        """Reserve bytes, waiting for room if configured to block"""
+        if nbytes <= 0:
+            return
+
+        with self._cond:
+            if nbytes > self.max_bytes:
+                self._rejected += 1
+                raise AdmissionError(
+                    f"{nbytes} bytes can never fit the in-flight budget of {self.max_bytes} bytes",
+                    requested=nbytes, in_use=self._in_use, max_bytes=self.max_bytes
+                )
+
+            if self._in_use + nbytes > self.max_bytes:
+                if not self.block:
+                    self._rejected += 1
+                    raise AdmissionError(
+                        f"In-flight budget exhausted ({self._in_use}/{self.max_bytes} bytes in use)",
+                        requested=nbytes, in_use=self._in_use, max_bytes=self.max_bytes
+                    )
+
+                deadline = None if self.timeout is None else time.monotonic() + self.timeout
+                self._waiting += 1
+                try:
+                    while self._in_use + nbytes > self.max_bytes:
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            self._rejected += 1
+                            raise AdmissionError(
+                                f"Timed out after {self.timeout}s waiting for {nbytes} bytes of in-flight budget",
+                                requested=nbytes, in_use=self._in_use, max_bytes=self.max_bytes
+                            )
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            self._in_use += nbytes
+            self._admitted += 1
+            self._peak = max(self._peak, self._in_use)
+
+    def try_acquire(self, nbytes: int) -> bool:
+        """Reserve bytes only if they fit right now (never waits, never counts as rejected)"""
+        if nbytes <= 0:
+            return True
+        with self._cond:
+            if self._in_use + nbytes > self.max_bytes:
+                return False
+            self._in_use += nbytes
+            self._peak = max(self._peak, self._in_use)
+            return True
+
+    def release(self, nbytes: int) -> None:
+        """Return reserved bytes"""
+        if nbytes <= 0:
+            return
+        with self._cond:
+            self._in_use -= nbytes
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes: int):
+        """Hold a reservation for the duration of a with-block"""
+        self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current usage and counters"""
+        with self._cond:
+            return {
+                "max_bytes": self.max_bytes,
+                "in_use": self._in_use,
+                "peak": self._peak,
+                "waiting": self._waiting,
+                "admitted": self._admitted,
+                "rejected": self._rejected
+            }
+
+
+def upload_values(files: Any) -> List[Any]:
+    """
+    File contents of a requests-style files argument: a dict or a list of
+    (field, value) pairs, values being bytes, file objects or (name, content[,
+    content type]) tuples
+    """
+    if not files:
+        return []
+    pairs = files.items() if isinstance(files, dict) else files
+    return [value[1] if isinstance(value, tuple) else value for _, value in pairs]
+
+
+def payload_size(files: Any) -> int:
+    """Total size of multipart file values (bytes, (name, bytes) tuples or file objects)"""
+    total = 0
+    for value in upload_values(files):
+        if isinstance(value, (bytes, bytearray)):
+            total += len(value)
+            continue
+        try:
+            total += os.fstat(value.fileno()).st_size - value.tell()
+        except (AttributeError, OSError, ValueError):
+            pos = value.tell()
+            value.seek(0, os.SEEK_END)
+            total += value.tell() - pos
+            value.seek(pos)
+    return total
@@ -0,0 +1,181 @@
+"""
+Tiered Variant Cache
+In-memory LRU backed by an optional disk directory
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Any, Optional
+
+
+@dataclass
+class CacheEntry:
+    """An optimized image variant"""
+    data: bytes
+    content_type: str
+    etag: str
+    created_at: float
+    # Validators of the original it was made from: digest, etag, last_modified
+    source: Optional[Dict[str, str]] = None
+
+    @classmethod
+    def create(cls, data: bytes, content_type: str, source: Optional[Dict[str, str]] = None) -> "CacheEntry":
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        return cls(data=data, content_type=content_type, etag=f'"{digest}"', created_at=time.time(), source=source)
+
+
+class TieredCache:
+    """
+    Memory LRU in front of a disk directory
+
+    Memory hits are served without I/O. Disk hits are promoted to memory.
+    Entries older than `ttl` seconds are treated as misses.
+
+    Example:
+        cache = TieredCache(max_memory_bytes=64 * 1024 * 1024, directory="/var/cache/shrinkix")
+    """
+
+    def __init__(
+        self,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        directory: Optional[str] = None,
+        ttl: Optional[float] = None
+    ):
+        """
+        Args:
+            max_memory_bytes: Memory tier budget in bytes
+            directory: Disk tier location (optional, memory only when omitted)
+            ttl: Maximum entry age in seconds (optional, no expiry when omitted)
+        """
+        self.max_memory_bytes = max_memory_bytes
+        self.directory = directory
+        self.ttl = ttl
+
+        self._memory: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _expired(self, entry: CacheEntry) -> bool:
+        return self.ttl is not None and time.time() - entry.created_at > self.ttl
+
+    def get_memory(self, key: str) -> Optional[CacheEntry]:
+        """Memory tier lookup only (never touches disk)"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry):
+                self._evict(key)
+                return None
+            self._memory.move_to_end(key)
+            self._stats["memory_hits"] += 1
+            return entry
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Look up a variant in memory, then on disk"""
+        entry = self.get_memory(key)
+        if entry is not None:
+            return entry
+
+        entry = self._read_disk(key)
+        if entry is None or self._expired(entry):
+            with self._lock:
+                self._stats["misses"] += 1
+            return None
+
+        with self._lock:
+            self._stats["disk_hits"] += 1
+        self._store_memory(key, entry)
+        return entry
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        """Store a variant in both tiers"""
+        self._store_memory(key, entry)
+        self._write_disk(key, entry)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and memory usage"""
+        with self._lock:
+            return dict(self._stats, memory_entries=len(self._memory), memory_bytes=self._memory_bytes)
+
+    def _store_memory(self, key: str, entry: CacheEntry) -> None:
+        if len(entry.data) > self.max_memory_bytes:
+            return
+        with self._lock:
+            self._evict(key)
+            self._memory[key] = entry
+            self._memory_bytes += len(entry.data)
+            while self._memory_bytes > self.max_memory_bytes:
+                oldest = next(iter(self._memory))
+                self._evict(oldest)
+
+    def _evict(self, key: str) -> None:
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= len(entry.data)
+
+    def _paths(self, key: str):
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        base = os.path.join(self.directory, name[:2], name)
+        return base + ".bin", base + ".json"
+
+    def _read_disk(self, key: str) -> Optional[CacheEntry]:
+        if not self.directory:
+            return None
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(data_path, "rb") as f:
+                data = f.read()
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(
+            data=data,
+            content_type=meta["content_type"],
+            etag=meta["etag"],
+            created_at=meta["created_at"],
+            source=meta.get("source")
+        )
+
+    def _write_disk(self, key: str, entry: CacheEntry) -> None:
+        if not self.directory:
+            return
+        data_path, meta_path = self._paths(key)
+        meta = {
+            "key": key,
+            "content_type": entry.content_type,
+            "etag": entry.etag,
+            "created_at": entry.created_at,
+            "source": entry.source,
+        }
+        try:
+            os.makedirs(os.path.dirname(data_path), exist_ok=True)
+            # Data first, metadata last: a reader never sees metadata without its data
+            _atomic_write(data_path, entry.data)
+            _atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+        except OSError:
+            pass  # Disk tier is best effort; memory tier still holds the entry
+
+
+def _atomic_write(path: str, content: bytes) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,186 @@
+"""
+Adaptive Concurrency
+AIMD limiter steered by the gradient between the best and the current latency
+"""
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+
+class AdaptiveLimiter:
+    """
+    In-flight request limit that follows the server's real capacity
+
+    Each completed call reports its latency (normalised per byte uploaded, so
+    large and small images compare). While smoothed latency stays within
+    `tolerance` of the best smoothed latency seen, the limit grows by one per round trip. When latency grows,
+    the limit shrinks by the gradient (best * tolerance / current); a 429 or
+    503 halves it. Decreases happen at most once per round trip, so one slow
+    burst is not punished once per request.
+
+    Example:
+        limiter = AdaptiveLimiter(initial_limit=4, max_limit=32)
+        client = Shrinkix(api_key="sk_live_xxx", concurrency=limiter)
+        results = client.optimize.optimize_many(paths, quality=80)
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 32,
+        tolerance: float = 1.5,
+        backoff: float = 0.5,
+        smoothing: float = 0.2,
+        drift: float = 0.002
+    ):
+        """
+        Args:
+            initial_limit: Starting in-flight limit
+            min_limit: Lower bound for the limit
+            max_limit: Upper bound for the limit (also sizes the bulk thread pool)
+            tolerance: Latency ratio over the minimum still treated as "no queueing"
+            backoff: Multiplier applied on 429/503
+            smoothing: Weight of each new sample in the latency average (0-1)
+            drift: Per-sample upward drift of the minimum so a changed baseline is relearned
+        """
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError("Expected 1 <= min_limit <= initial_limit <= max_limit")
+
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.drift = drift
+
+        self._limit = float(initial_limit)
+        self._inflight = 0
+        self._waiting = 0
+        self._min_latency: Optional[float] = None
+        self._latency: Optional[float] = None
+        self._gradient = 1.0
+        self._started = 0        # calls admitted so far
+        self._decreased_at = 0   # calls admitted when the limit last decreased
+        self._drops = 0
+        self._samples = 0
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """Current in-flight limit"""
+        with self._cond:
+            return int(self._limit)
+
+    def acquire(self) -> int:
+        """
+        Wait for an in-flight slot
+
+        Returns:
+            Ticket to pass back to release()
+        """
+        with self._cond:
+            self._waiting += 1
+            try:
+                while self._inflight >= int(self._limit):
+                    self._cond.wait()
+            finally:
+                self._waiting -= 1
+            self._inflight += 1
+            self._started += 1
+            return self._started
+
+    def release(self, ticket: int, latency: Optional[float] = None, dropped: bool = False) -> None:
+        """
+        Return a slot and feed the outcome back into the limit
+
+        Args:
+            ticket: Value returned by acquire()
+            latency: Seconds (or seconds per byte) the call took; None if it failed otherwise
+            dropped: The server shed the call (429/503)
+        """
+        with self._cond:
+            inflight = self._inflight
+            self._inflight -= 1
+
+            # Only calls started after the last decrease may trigger another one
+            may_decrease = ticket > self._decreased_at
+
+            if dropped:
+                self._drop(may_decrease)
+            elif latency is not None and latency > 0:
+                self._sample(latency, inflight, may_decrease)
+
+            self._cond.notify_all()
+
+    def drop(self, ticket: int) -> None:
+        """
+        Report a 429/503 for a call that keeps its slot to retry
+
+        Args:
+            ticket: Value returned by acquire()
+        """
+        with self._cond:
+            self._drop(ticket > self._decreased_at)
+
+    def _drop(self, may_decrease: bool) -> None:
+        self._drops += 1
+        if may_decrease:
+            self._decrease(self.backoff)
+
+    def _sample(self, latency: float, inflight: int, may_decrease: bool) -> None:
+        self._samples += 1
+        if self._latency is None:
+            self._min_latency = self._latency = latency
+        else:
+            # Baseline is the best *smoothed* latency: single fast outliers don't set it
+            self._latency += self.smoothing * (latency - self._latency)
+            self._min_latency = min(self._latency, self._min_latency * (1 + self.drift))
+
+        self._gradient = max(0.5, min(1.0, self._min_latency * self.tolerance / self._latency))
+
+        if self._gradient < 1.0:
+            if may_decrease:
+                self._decrease(self._gradient)
+        elif inflight * 2 >= self._limit:
+            # Additive increase: +1 per round trip, and only when the limit is actually in use
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+
+    def _decrease(self, factor: float) -> None:
+        self._limit = max(self.min_limit, self._limit * factor)
+        self._decreased_at = self._started
+
+    @contextmanager
+    def slot(self):
+        """
+        Hold a slot for a with-block; call the yielded function to report the outcome
+
+        Example:
+            with limiter.slot() as report:
+                response = send()
+                report(latency=elapsed)
+        """
+        ticket = self.acquire()
+        outcome = {}
+
+        def report(latency: Optional[float] = None, dropped: bool = False) -> None:
+            outcome.update(latency=latency, dropped=dropped)
+
+        try:
+            yield report
+        finally:
+            self.release(ticket, **outcome)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current limit, gradient and latency estimates"""
+        with self._cond:
+            return {
+                "limit": int(self._limit),
+                "gradient": round(self._gradient, 3),
+                "inflight": self._inflight,
+                "waiting": self._waiting,
+                "min_latency": self._min_latency,
+                "latency": self._latency,
+                "samples": self._samples,
+                "drops": self._drops
+            }
@@ -39,3 +39,14 @@ class NetworkError(Exception):
         super().__init__(message)
         self.message = message
         self.original_error = original_error
+
+
+class AdmissionError(Exception):
+    """Raised when a call would exceed the client's in-flight byte budget"""
+    
+    def __init__(self, message: str, requested: int = 0, in_use: int = 0, max_bytes: int = 0):
+        super().__init__(message)
+        self.message = message
+        self.requested = requested
+        self.in_use = in_use
+        self.max_bytes = max_bytes
@@ -0,0 +1,310 @@
+"""
+Local Engine
+Runs optimizations in-process with Pillow, mirroring the server's engineService.
+Useful for CI, tests and offline batch jobs (no network, no quota).
+"""
+import io
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Optional, Tuple
+
+from .admission import ByteBudget, payload_size
+from .errors import ApiError
+from .streaming import ProgressTracker
+
+
+# Adaptive quality tiers by input size (engineService._compress)
+_QUALITY_TIERS = (
+    (50 * 1024, 90),         # < 50KB: likely already optimized
+    (500 * 1024, 82),        # 50KB - 500KB
+    (2 * 1024 * 1024, 78),   # 500KB - 2MB
+)
+_QUALITY_LARGE = 75          # > 2MB
+
+_PIL_FORMATS = {"jpeg": "JPEG", "png": "PNG", "webp": "WEBP", "avif": "AVIF"}
+
+
+class _EngineFailure(Exception):
+    """Picklable error raised inside worker processes"""
+
+    def __init__(self, code: str, message: str, status_code: int):
+        super().__init__(code, message, status_code)
+        self.code = code
+        self.message = message
+        self.status_code = status_code
+
+
+def _adaptive_quality(input_size: int) -> int:
+    for limit, quality in _QUALITY_TIERS:
+        if input_size < limit:
+            return quality
+    return _QUALITY_LARGE
+
+
+def _resize(image, width: Optional[int], height: Optional[int], method: str):
+    """sharp resize with withoutEnlargement: 'fit' -> inside, 'fill' -> cover"""
+    from PIL import Image, ImageOps
+
+    src_w, src_h = image.size
+    scale_w = width / src_w if width else None
+    scale_h = height / src_h if height else None
+
+    if method == "fill" and scale_w and scale_h:
+        if max(scale_w, scale_h) > 1:
+            return image
+        return ImageOps.fit(image, (width, height), Image.LANCZOS)
+
+    scale = min(s for s in (scale_w, scale_h) if s)
+    if scale >= 1:
+        return image
+    size = (max(1, round(src_w * scale)), max(1, round(src_h * scale)))
+    return image.resize(size, Image.LANCZOS)
+
+
+def _crop(image, ratio: Tuple[int, int]):
+    """Centre crop to the widest region with the given aspect ratio"""
+    src_w, src_h = image.size
+    ratio_w, ratio_h = ratio
+    width = min(src_w, max(1, round(src_h * ratio_w / ratio_h)))
+    height = min(src_h, max(1, round(src_w * ratio_h / ratio_w)))
+    left = (src_w - width) // 2
+    top = (src_h - height) // 2
+    return image.crop((left, top, left + width, top + height))
+
+
+def _crop_ratio(crop: Optional[Dict[str, Any]]) -> Optional[Tuple[int, int]]:
+    """{"mode": "center", "ratio": "16:9"} -> (16, 9); only centre crops are supported"""
+    if not crop or not crop.get("mode"):
+        return None
+    if crop["mode"] != "center":
+        raise ValueError(f"Crop mode '{crop['mode']}' is not supported by the local engine")
+    try:
+        ratio_w, ratio_h = (int(part) for part in str(crop.get("ratio", "")).split(":"))
+    except ValueError:
+        raise ValueError(f"Crop ratio must look like '16:9', got {crop.get('ratio')!r}")
+    if ratio_w <= 0 or ratio_h <= 0:
+        raise ValueError(f"Crop ratio must be positive, got {crop.get('ratio')!r}")
+    return ratio_w, ratio_h
+
+
+def _encode(content: bytes, options: Dict[str, Any]) -> Tuple[bytes, Dict[str, Any]]:
+    """Worker: compress one image with engineService's settings"""
+    from PIL import Image, UnidentifiedImageError
+
+    input_size = len(content)
+    try:
+        image = Image.open(io.BytesIO(content))
+        image.load()
+    except (UnidentifiedImageError, OSError, ValueError):
+        raise _EngineFailure("CORRUPTED_IMAGE", "Image file is corrupted or invalid", 400)
+
+    source_format = (image.format or "").lower()
+    exif = image.info.get("exif")
+    icc_profile = image.info.get("icc_profile")
+
+    # 1. Crop, then resize
+    crop = options.get("crop")
+    if crop:
+        image = _crop(image, crop)
+
+    width, height = options.get("width"), options.get("height")
+    if width or height:
+        image = _resize(image, width, height, options.get("method") or "fit")
+
+    # 2. Format & quality
+    fmt = options.get("format")
+    target = (fmt or source_format).lower()
+    if target == "jpg":
+        target = "jpeg"
+    if target in _PIL_FORMATS and _PIL_FORMATS[target] not in Image.SAVE:
+        Image.init()  # encoders register lazily
+    if target not in _PIL_FORMATS or _PIL_FORMATS[target] not in Image.SAVE:
+        raise _EngineFailure("UNSUPPORTED_FORMAT", f"Format '{target}' is not supported by the local engine", 415)
+
+    quality = options.get("quality") or _adaptive_quality(input_size)
+
+    if target == "jpeg":
+        # mozjpeg in sharp: progressive with optimized Huffman tables
+        if image.mode not in ("RGB", "L", "CMYK"):
+            image = image.convert("RGB")
+        save_options = {"quality": quality, "optimize": True, "progressive": True}
+    elif target == "png":
+        # sharp png({ quality }) enables palette quantisation; compressionLevel 6
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+        image = image.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+        save_options = {"compress_level": 6}
+    elif target == "webp":
+        # effort 4 (same 0-6 scale as Pillow's method)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        save_options = {"quality": quality, "method": 4}
+    else:
+        # avif effort 3 == libavif speed 6 (sharp maps speed = 9 - effort)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        save_options = {"quality": quality, "speed": 6}
+
+    # 3. Metadata: stripped unless preserve is requested
+    if options.get("preserve"):
+        if exif:
+            save_options["exif"] = exif
+        if icc_profile:
+            save_options["icc_profile"] = icc_profile
+
+    # 4. Output
+    output = io.BytesIO()
+    image.save(output, _PIL_FORMATS[target], **save_options)
+    data = output.getvalue()
+
+    # 5. Return original if compression made it larger (only without crop/resize/convert)
+    if len(data) >= input_size and not crop and not width and not height and not fmt:
+        data = content
+        target = source_format
+
+    return data, {"format": target, "width": image.width, "height": image.height}
+
+
+def _read_upload(value) -> bytes:
+    if isinstance(value, tuple):
+        value = value[1]
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    return value.read()
+
+
+def _json_param(value) -> Optional[Dict[str, Any]]:
+    if not value:
+        return None
+    return json.loads(value) if isinstance(value, str) else value
+
+
+class LocalTransport:
+    """
+    Drop-in Transport that serves /optimize from a local process pool
+
+    Example:
+        client = Shrinkix(local=True)
+        result = client.optimize.optimize(file="photo.jpg", format="webp")
+    """
+
+    def __init__(self, workers: Optional[int] = None, budget: Optional[ByteBudget] = None):
+        """
+        Args:
+            workers: Worker processes (optional, defaults to all cores)
+            budget: In-flight byte budget shared by concurrent calls (optional)
+        """
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            raise ImportError("The local engine requires Pillow: pip install shrinkix[local]")
+
+        self.workers = workers or os.cpu_count() or 1
+        self.budget = budget
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            # A pool inherited across fork() is unusable in the child
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def request(
+        self,
+        method: str,
+        endpoint: str,
+        data: Optional[Dict[str, Any]] = None,
+        files: Optional[Dict[str, Any]] = None,
+        json: Optional[Dict[str, Any]] = None,
+        raw: bool = False,
+        progress: Optional[ProgressTracker] = None,
+        stream: bool = False
+    ) -> Dict[str, Any]:
+        """Handle a request locally"""
+        if method == "POST" and endpoint == "/optimize" and files and not stream:
+            if self.budget is None:
+                return self._optimize(_read_upload(files["image"]), data or {}, progress)
+            with self.budget.reserve(payload_size(files)):
+                return self._optimize(_read_upload(files["image"]), data or {}, progress)
+
+        if method == "POST" and endpoint == "/optimize/precheck":
+            # No shared result cache locally: always upload (i.e. encode)
+            raise ApiError("No cached result", "CACHE_MISS", 404)
+
+        raise ApiError(f"{method} {endpoint} is not available in local mode", "NOT_AVAILABLE_LOCALLY", 501)
+
+    def get(self, endpoint: str, **kwargs) -> Dict[str, Any]:
+        """GET request"""
+        return self.request("GET", endpoint, **kwargs)
+
+    def post(self, endpoint: str, **kwargs) -> Dict[str, Any]:
+        """POST request"""
+        return self.request("POST", endpoint, **kwargs)
+
+    def close(self) -> None:
+        """Shut down worker processes"""
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown()
+            self._pool = None
+
+    def _optimize(
+        self,
+        content: bytes,
+        data: Dict[str, Any],
+        progress: Optional[ProgressTracker] = None
+    ) -> Dict[str, Any]:
+        # Nothing is transferred: the input counts as uploaded once read, the output once encoded
+        if progress is not None:
+            progress.upload(len(content))
+
+        resize = _json_param(data.get("resize"))
+        options = {
+            "crop": _crop_ratio(_json_param(data.get("crop"))),
+            "format": data.get("format"),
+            "quality": int(data["quality"]) if data.get("quality") else None,
+            "method": resize.get("fit") if resize else None,
+            "width": int(resize["width"]) if resize and resize.get("width") else None,
+            "height": int(resize["height"]) if resize and resize.get("height") else None,
+            "preserve": data.get("metadata") == "keep",
+        }
+
+        try:
+            output, info = self._executor().submit(_encode, content, options).result()
+        except _EngineFailure as e:
+            raise ApiError(e.message, e.code, e.status_code)
+
+        operations = ["compress"]
+        if options["width"] or options["height"]:
+            operations.append("resize")
+        if options["crop"]:
+            operations.append("crop")
+        if options["format"]:
+            operations.append("convert")
+        if options["preserve"]:
+            operations.append("metadata")
+
+        if progress is not None:
+            progress.expect_download(len(output))
+            progress.download(len(output))
+
+        request_id = f"local_{uuid.uuid4().hex[:8]}"
+        return {
+            "data": output,
+            "rate_limit": {"limit": None, "remaining": None, "reset": None, "request_id": request_id},
+            "headers": {
+                "X-Engine": "local",
+                "X-Original-Size": str(len(content)),
+                "X-Optimized-Size": str(len(output)),
+                "X-Savings-Percent": str(round((1 - len(output) / len(content)) * 100, 1)),
+                "X-Operations": ",".join(operations),
+                "X-Output-Format": info["format"],
+            }
+        }
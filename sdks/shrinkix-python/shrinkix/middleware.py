@@ -0,0 +1,569 @@
+"""
+On-the-fly Optimization Middleware
+Optimizes image responses from WSGI (Django, Flask) and ASGI (FastAPI, Starlette)
+apps based on query params, e.g. /media/photo.jpg?width=800&format=auto
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+from urllib.parse import parse_qsl, urlencode
+
+from .cache import CacheEntry, TieredCache
+from .errors import ApiError, NetworkError
+from .predictor import inspect_image
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".avif")
+
+# Variants that may be requested. Anything else is refused before it can reach
+# the API, so the number of variants (and billed calls) per image is bounded.
+DEFAULT_WIDTHS = (64, 128, 256, 384, 640, 750, 828, 1080, 1200, 1920, 2048, 3840)
+DEFAULT_QUALITIES = (50, 60, 70, 75, 80, 85, 90)
+
+_CONTENT_TYPES = {
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+    "avif": "image/avif",
+}
+_QUERY_PARAMS = ("width", "height", "format", "quality")
+
+# Dropped when fetching the original from the wrapped app: we always need the full
+# body, and the client's validators are for the variant, not the original
+_ORIGIN_SKIP_HEADERS = ("if-none-match", "if-modified-since", "if-range", "range", "accept-encoding")
+
+# Sent when the response may be user-specific (Authorization, Set-Cookie)
+_PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+_STATUS_LINES = {200: "200 OK", 304: "304 Not Modified", 400: "400 Bad Request"}
+
+
+class VariantNotAllowed(ValueError):
+    """Query params ask for a variant outside the configured allow-list"""
+
+
+@dataclass
+class Variant:
+    """Requested image variant parsed from the query string"""
+    width: Optional[int]
+    height: Optional[int]
+    format: Optional[str]
+    quality: Optional[int]
+    negotiated: bool  # True when the format depends on the Accept header
+
+    def cache_key(self, path: str, query: str) -> str:
+        parts = [
+            f"w={self.width or ''}",
+            f"h={self.height or ''}",
+            f"f={self.format or 'orig'}",
+            f"q={self.quality or ''}",
+        ]
+        return f"{path}?{query}|{'|'.join(parts)}"
+
+
+@dataclass
+class _Origin:
+    """Response from the wrapped app for the original image"""
+    status: int
+    status_line: str
+    headers: List[Tuple[str, str]]
+    body: bytes
+
+    def header(self, name: str) -> Optional[str]:
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return None
+
+    def validators(self) -> Dict[str, str]:
+        """What a cached variant remembers about this original"""
+        source = {"digest": hashlib.sha256(self.body).hexdigest()}
+        if self.header("etag"):
+            source["etag"] = self.header("etag")
+        if self.header("last-modified"):
+            source["last_modified"] = self.header("last-modified")
+        return source
+
+
+def _allowed_int(name: str, value: Optional[str], allowed: Sequence[int]) -> Optional[int]:
+    if value is None or value == "":
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise VariantNotAllowed(f"{name} must be an integer")
+    if number not in allowed:
+        raise VariantNotAllowed(f"{name}={number} is not allowed")
+    return number
+
+
+def _conditional_headers(entry: Optional[CacheEntry]) -> List[Tuple[str, str]]:
+    """Revalidation headers for the original behind a cached variant"""
+    if entry is None or not entry.source:
+        return []
+    headers = []
+    if entry.source.get("etag"):
+        headers.append(("if-none-match", entry.source["etag"]))
+    if entry.source.get("last_modified"):
+        headers.append(("if-modified-since", entry.source["last_modified"]))
+    return headers
+
+
+def _still_valid(entry: Optional[CacheEntry], origin: _Origin) -> bool:
+    """Whether the wrapped app confirmed the original behind `entry` is unchanged"""
+    if entry is None or not entry.source:
+        return False
+    if origin.status == 304:
+        return True
+    # Apps that ignore conditional requests send the full body again
+    return origin.status == 200 and origin.validators()["digest"] == entry.source.get("digest")
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in tags or f"W/{etag}" in tags
+
+
+class _SingleFlight:
+    """Coalesces concurrent calls for the same key into one (threads)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Dict[str, Any]] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"event": threading.Event()}
+
+        if not leader:
+            call["event"].wait()
+            if "error" in call:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["event"].set()
+
+
+class _AsyncSingleFlight:
+    """Coalesces concurrent calls for the same key into one (asyncio)"""
+
+    def __init__(self):
+        self._calls: Dict[str, "asyncio.Future"] = {}
+
+    async def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        future = self._calls.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_event_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+
+class _VariantOptimizer:
+    """Request parsing, optimization and response building shared by WSGI and ASGI"""
+
+    def __init__(
+        self,
+        client,
+        cache: Optional[TieredCache] = None,
+        formats: Sequence[str] = ("avif", "webp"),
+        cache_control: Optional[str] = None,
+        extensions: Sequence[str] = IMAGE_EXTENSIONS,
+        widths: Sequence[int] = DEFAULT_WIDTHS,
+        heights: Optional[Sequence[int]] = None,
+        qualities: Sequence[int] = DEFAULT_QUALITIES,
+        output_formats: Sequence[str] = tuple(_CONTENT_TYPES)
+    ):
+        """
+        Args:
+            client: Shrinkix client used to optimize variants
+            cache: Variant cache (optional, 64MB memory-only TieredCache by default)
+            formats: Formats offered for format=auto, in order of preference
+            cache_control: Cache-Control header sent with optimized variants
+                           (optional, the wrapped app's own header by default).
+                           Responses to requests with Authorization, or whose
+                           original set a cookie, are always private.
+            extensions: Path suffixes that are intercepted
+            widths: Allowed width params
+            heights: Allowed height params (optional, same as widths by default)
+            qualities: Allowed quality params
+            output_formats: Allowed explicit format params (format=auto is always allowed)
+        """
+        self.client = client
+        self.cache = cache if cache is not None else TieredCache()
+        self.formats = tuple(formats)
+        self.cache_control = cache_control
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.widths = frozenset(widths)
+        self.heights = frozenset(heights if heights is not None else widths)
+        self.qualities = frozenset(qualities)
+        self.output_formats = frozenset("jpeg" if f == "jpg" else f for f in output_formats)
+
+    def parse(self, path: str, query_string: str, accept: str) -> Optional[Tuple[Variant, str]]:
+        """
+        Variant plus the query string left for the wrapped app (None = not ours)
+
+        Raises:
+            VariantNotAllowed: A param is outside the allow-list
+        """
+        if not path.lower().endswith(self.extensions):
+            return None
+
+        params = parse_qsl(query_string, keep_blank_values=True)
+        ours = {key: value for key, value in params if key in _QUERY_PARAMS}
+        if not ours:
+            return None
+        rest = urlencode([(key, value) for key, value in params if key not in _QUERY_PARAMS])
+
+        fmt = (ours.get("format") or "auto").lower()
+        if fmt == "jpg":
+            fmt = "jpeg"
+
+        negotiated = fmt == "auto"
+        if negotiated:
+            fmt = next((f for f in self.formats if _CONTENT_TYPES[f] in accept), None)
+        elif fmt not in self.output_formats or fmt not in _CONTENT_TYPES:
+            raise VariantNotAllowed(f"format={fmt} is not allowed")
+
+        variant = Variant(
+            width=_allowed_int("width", ours.get("width"), self.widths),
+            height=_allowed_int("height", ours.get("height"), self.heights),
+            format=fmt,
+            quality=_allowed_int("quality", ours.get("quality"), self.qualities),
+            negotiated=negotiated
+        )
+        return variant, rest
+
+    def optimize(self, origin: _Origin, path: str, variant: Variant) -> CacheEntry:
+        """Run the original through the API (blocking)"""
+        upload = io.BytesIO(origin.body)
+        upload.name = os.path.basename(path)
+
+        resize = {key: value for key, value in (("width", variant.width), ("height", variant.height)) if value}
+        result = self.client.optimize.optimize(
+            file=upload,
+            resize=resize or None,
+            format="jpg" if variant.format == "jpeg" else variant.format,
+            quality=variant.quality
+        )
+
+        detected = inspect_image(result.data[:64], len(result.data)).format
+        content_type = origin.header("content-type") or "application/octet-stream"
+        return CacheEntry.create(result.data, _CONTENT_TYPES.get(detected, content_type), origin.validators())
+
+    def cache_control_for(self, origin: _Origin, authorized: bool) -> str:
+        """Cache-Control for a variant of this original"""
+        if authorized or origin.header("set-cookie") is not None:
+            return _PRIVATE_CACHE_CONTROL
+        origin_value = origin.header("cache-control")
+        if origin_value and ("private" in origin_value.lower() or "no-store" in origin_value.lower()):
+            return origin_value
+        # Without instructions from the app, browsers and CDNs revalidate (cheap with the ETag)
+        return self.cache_control or origin_value or "no-cache"
+
+    def response(
+        self,
+        entry: CacheEntry,
+        variant: Variant,
+        origin: _Origin,
+        authorized: bool,
+        if_none_match: Optional[str],
+        head: bool
+    ) -> Tuple[int, List[Tuple[str, str]], bytes]:
+        """Status, headers and body for a cached variant (304 when the ETag matches)"""
+        headers = [("ETag", entry.etag), ("Cache-Control", self.cache_control_for(origin, authorized))]
+        if variant.negotiated:
+            headers.append(("Vary", "Accept"))
+        # Session refreshes from the app still reach the client
+        headers.extend((key, value) for key, value in origin.headers if key.lower() == "set-cookie")
+
+        if if_none_match and _etag_matches(if_none_match, entry.etag):
+            return 304, headers, b""
+
+        headers.append(("Content-Type", entry.content_type))
+        headers.append(("Content-Length", str(len(entry.data))))
+        return 200, headers, b"" if head else entry.data
+
+    @staticmethod
+    def rejection(error: VariantNotAllowed) -> Tuple[int, List[Tuple[str, str]], bytes]:
+        body = str(error).encode("utf-8")
+        return 400, [("Content-Type", "text/plain; charset=utf-8"), ("Content-Length", str(len(body)))], body
+
+    def log_failure(self, path: str, error: Exception) -> None:
+        logger.warning("Shrinkix optimization failed for %s, serving original: %s", path, error)
+
+
+class ShrinkixMiddleware(_VariantOptimizer):
+    """
+    WSGI middleware (Django, Flask)
+
+    Every request still reaches the wrapped app (conditionally once a variant
+    is cached), so its authorization runs each time and a changed original
+    is re-optimized.
+
+    Example (Django wsgi.py):
+        from shrinkix import Shrinkix
+        from shrinkix.middleware import ShrinkixMiddleware
+        from shrinkix.cache import TieredCache
+
+        application = ShrinkixMiddleware(
+            get_wsgi_application(),
+            client=Shrinkix(api_key="sk_live_xxx"),
+            cache=TieredCache(directory="/var/cache/shrinkix")
+        )
+    """
+
+    def __init__(self, app, client, **options):
+        super().__init__(client, **options)
+        self.app = app
+        self._flight = _SingleFlight()
+
+    def __call__(self, environ, start_response):
+        method = environ.get("REQUEST_METHOD", "GET")
+        path = environ.get("PATH_INFO", "")
+        parsed = None
+        try:
+            if method in ("GET", "HEAD"):
+                parsed = self.parse(path, environ.get("QUERY_STRING", ""), environ.get("HTTP_ACCEPT", ""))
+        except VariantNotAllowed as e:
+            status, headers, body = self.rejection(e)
+            start_response(_STATUS_LINES[status], headers)
+            return [body]
+        if parsed is None:
+            return self.app(environ, start_response)
+
+        variant, rest = parsed
+        key = variant.cache_key(path, rest)
+
+        entry = self.cache.get(key)
+        origin = self._fetch_origin(environ, rest, entry)
+        if not _still_valid(entry, origin):
+            if origin.status != 200:
+                start_response(origin.status_line, origin.headers)
+                return [b"" if method == "HEAD" else origin.body]
+
+            flight_key = f"{key}|{origin.validators()['digest']}"
+            outcome = self._flight.do(flight_key, lambda: self._fill(key, path, variant, origin))
+            if isinstance(outcome, _Origin):
+                start_response(outcome.status_line, outcome.headers)
+                return [b"" if method == "HEAD" else outcome.body]
+            entry = outcome
+
+        status, headers, body = self.response(
+            entry, variant, origin, "HTTP_AUTHORIZATION" in environ,
+            environ.get("HTTP_IF_NONE_MATCH"), method == "HEAD"
+        )
+        start_response(_STATUS_LINES[status], headers)
+        return [body]
+
+    def _fill(self, key: str, path: str, variant: Variant, origin: _Origin) -> Union[CacheEntry, _Origin]:
+        try:
+            entry = self.optimize(origin, path, variant)
+        except (ApiError, NetworkError) as e:
+            self.log_failure(path, e)
+            return origin
+
+        self.cache.set(key, entry)
+        return entry
+
+    def _fetch_origin(self, environ, rest: str, entry: Optional[CacheEntry]) -> _Origin:
+        sub_environ = dict(environ)
+        sub_environ["REQUEST_METHOD"] = "GET"
+        sub_environ["QUERY_STRING"] = rest
+        for name in _ORIGIN_SKIP_HEADERS:
+            sub_environ.pop("HTTP_" + name.upper().replace("-", "_"), None)
+        for name, value in _conditional_headers(entry):
+            sub_environ["HTTP_" + name.upper().replace("-", "_")] = value
+
+        captured: Dict[str, Any] = {}
+        chunks: List[bytes] = []
+
+        def start_response(status, headers, exc_info=None):
+            captured["status"] = status
+            captured["headers"] = list(headers)
+            return chunks.append
+
+        iterable = self.app(sub_environ, start_response)
+        try:
+            for chunk in iterable:
+                chunks.append(chunk)
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+        status_line = captured.get("status", "500 Internal Server Error")
+        return _Origin(int(status_line.split(" ", 1)[0]), status_line, captured.get("headers", []), b"".join(chunks))
+
+
+class ShrinkixASGIMiddleware(_VariantOptimizer):
+    """
+    ASGI middleware (FastAPI, Starlette)
+
+    API calls and disk I/O run in the default thread pool executor. As with
+    the WSGI middleware, the wrapped app sees every request.
+
+    Example:
+        from shrinkix import Shrinkix
+        from shrinkix.middleware import ShrinkixASGIMiddleware
+
+        app.add_middleware(ShrinkixASGIMiddleware, client=Shrinkix(api_key="sk_live_xxx"))
+    """
+
+    def __init__(self, app, client, **options):
+        super().__init__(client, **options)
+        self.app = app
+        self._flight = _AsyncSingleFlight()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+
+        headers = {
+            key.decode("latin-1").lower(): value.decode("latin-1")
+            for key, value in scope.get("headers", [])
+        }
+        path = scope.get("path", "")
+        try:
+            parsed = self.parse(path, scope.get("query_string", b"").decode("latin-1"), headers.get("accept", ""))
+        except VariantNotAllowed as e:
+            await self._send(send, *self.rejection(e))
+            return
+        if parsed is None:
+            await self.app(scope, receive, send)
+            return
+
+        variant, rest = parsed
+        key = variant.cache_key(path, rest)
+        head = scope["method"] == "HEAD"
+        loop = asyncio.get_event_loop()
+
+        entry = self.cache.get_memory(key)
+        if entry is None:
+            entry = await loop.run_in_executor(None, self.cache.get, key)
+
+        origin = await self._fetch_origin(scope, rest, entry)
+        if not _still_valid(entry, origin):
+            if origin.status != 200:
+                await self._send(send, origin.status, origin.headers, b"" if head else origin.body)
+                return
+
+            flight_key = f"{key}|{origin.validators()['digest']}"
+            outcome = await self._flight.do(flight_key, lambda: self._fill(key, path, variant, origin))
+            if isinstance(outcome, _Origin):
+                await self._send(send, outcome.status, outcome.headers, b"" if head else outcome.body)
+                return
+            entry = outcome
+
+        status, response_headers, body = self.response(
+            entry, variant, origin, "authorization" in headers, headers.get("if-none-match"), head
+        )
+        await self._send(send, status, response_headers, body)
+
+    async def _fill(self, key: str, path: str, variant: Variant, origin: _Origin) -> Union[CacheEntry, _Origin]:
+        loop = asyncio.get_event_loop()
+        try:
+            entry = await loop.run_in_executor(None, self.optimize, origin, path, variant)
+        except (ApiError, NetworkError) as e:
+            self.log_failure(path, e)
+            return origin
+
+        await loop.run_in_executor(None, self.cache.set, key, entry)
+        return entry
+
+    async def _fetch_origin(self, scope, rest: str, entry: Optional[CacheEntry]) -> _Origin:
+        sub_scope = dict(scope)
+        sub_scope["method"] = "GET"
+        sub_scope["query_string"] = rest.encode("latin-1")
+        sub_scope["headers"] = [
+            (key, value) for key, value in scope.get("headers", [])
+            if key.decode("latin-1").lower() not in _ORIGIN_SKIP_HEADERS
+        ] + [(name.encode("latin-1"), value.encode("latin-1")) for name, value in _conditional_headers(entry)]
+
+        start: Dict[str, Any] = {}
+        chunks: List[bytes] = []
+        finished = asyncio.Event()
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # Report a disconnect only once the app has finished responding
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    finished.set()
+
+        try:
+            await self.app(sub_scope, receive, send)
+        finally:
+            finished.set()
+
+        status = start.get("status", 500)
+        headers = [
+            (key.decode("latin-1"), value.decode("latin-1"))
+            for key, value in start.get("headers", [])
+        ]
+        return _Origin(status, str(status), headers, b"".join(chunks))
+
+    @staticmethod
+    async def _send(send, status: int, headers: List[Tuple[str, str]], body: bytes) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in headers],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+__all__ = [
+    "ShrinkixMiddleware",
+    "ShrinkixASGIMiddleware",
+    "Variant",
+    "VariantNotAllowed",
+    "IMAGE_EXTENSIONS",
+    "DEFAULT_WIDTHS",
+    "DEFAULT_QUALITIES",
+]
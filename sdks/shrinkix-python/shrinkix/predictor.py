@@ -0,0 +1,359 @@
+"""
+Savings Predictor
+Learns from past optimize results and predicts whether re-encoding will shrink a file
+"""
+import json
+import os
+import random
+import struct
+import threading
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Tuple, Union, BinaryIO
+
+
+# Bytes read from the start of a file to find format, dimensions and JPEG tables.
+# Large EXIF/XMP segments can push SOF past 64KB, so read a little more.
+HEADER_BYTES = 128 * 1024
+
+# Standard IJG luminance quantization table (ITU-T T.81, Annex K)
+_STD_LUMINANCE = [
+    16, 11, 10, 16, 24, 40, 51, 61,
+    12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56,
+    14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77,
+    24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101,
+    72, 92, 95, 98, 112, 100, 103, 99,
+]
+_STD_LUMINANCE_SUM = sum(_STD_LUMINANCE)
+
+# Bucket edges used to group similar files together
+_BPP_EDGES = (0.1, 0.2, 0.4, 0.8, 1.5, 3.0)
+_QUALITY_EDGES = (60, 75, 85, 92)
+
+
+@dataclass
+class ImageInfo:
+    """Header-level facts about an image (no pixel decode)"""
+    format: Optional[str]
+    width: Optional[int]
+    height: Optional[int]
+    size: int
+    jpeg_quality: Optional[int] = None
+
+    @property
+    def pixels(self) -> Optional[int]:
+        if not self.width or not self.height:
+            return None
+        return self.width * self.height
+
+    @property
+    def bytes_per_pixel(self) -> Optional[float]:
+        pixels = self.pixels
+        return self.size / pixels if pixels else None
+
+
+@dataclass
+class Prediction:
+    """Predicted outcome for a single file"""
+    savings: Optional[float]  # expected fraction saved (0.0 - 1.0), None if unknown
+    samples: int              # observations backing the estimate
+    skip: bool                # True when savings fall below the threshold
+
+
+@dataclass
+class PredictorStats:
+    """
+    Quality of skip decisions, measured on files that were actually optimized
+
+    In "skip" mode only explore_rate of predicted skips reach the API, so
+    their outcomes are weighted by 1 / explore_rate: the confusion counts
+    are estimates for all files, not raw tallies.
+    """
+    observations: int
+    evaluated: float
+    true_positives: float
+    false_positives: float
+    false_negatives: float
+    true_negatives: float
+    skipped: int
+    precision: Optional[float]
+    recall: Optional[float]
+
+
+def read_header(file: Union[str, bytes, BinaryIO], limit: int = HEADER_BYTES) -> Tuple[bytes, int]:
+    """Read the first bytes of a file and its total size, leaving file objects where they were"""
+    if isinstance(file, str):
+        with open(file, "rb") as f:
+            return f.read(limit), os.path.getsize(file)
+
+    if isinstance(file, (bytes, bytearray)):
+        return bytes(file[:limit]), len(file)
+
+    pos = file.tell()
+    header = file.read(limit)
+    try:
+        size = os.fstat(file.fileno()).st_size - pos
+    except (AttributeError, OSError, ValueError):
+        file.seek(0, os.SEEK_END)
+        size = file.tell() - pos
+    file.seek(pos)
+    return header, size
+
+
+def inspect_image(header: bytes, size: int) -> ImageInfo:
+    """Detect format, dimensions and (for JPEG) estimated encoder quality from header bytes"""
+    if header[:8] == b"\x89PNG\r\n\x1a\n" and len(header) >= 24:
+        width, height = struct.unpack(">II", header[16:24])
+        return ImageInfo("png", width, height, size)
+
+    if header[:3] == b"\xff\xd8\xff":
+        return _inspect_jpeg(header, size)
+
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        width, height = _webp_dimensions(header)
+        return ImageInfo("webp", width, height, size)
+
+    if header[4:8] == b"ftyp":
+        width = height = None
+        idx = header.find(b"ispe")
+        if idx != -1 and len(header) >= idx + 16:
+            width, height = struct.unpack(">II", header[idx + 8:idx + 16])
+        return ImageInfo("avif", width, height, size)
+
+    return ImageInfo(None, None, None, size)
+
+
+def _inspect_jpeg(data: bytes, size: int) -> ImageInfo:
+    width = height = quality = None
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        # Standalone markers carry no length
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+
+        length = struct.unpack(">H", data[i + 2:i + 4])[0]
+        segment = data[i + 4:i + 2 + length]
+
+        if marker == 0xDB and quality is None:
+            quality = _estimate_jpeg_quality(segment)
+        elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC) and len(segment) >= 5:
+            height, width = struct.unpack(">HH", segment[1:5])
+
+        if marker == 0xDA or (width and quality is not None):
+            break
+        i += 2 + length
+
+    return ImageInfo("jpeg", width, height, size, jpeg_quality=quality)
+
+
+def _estimate_jpeg_quality(segment: bytes) -> Optional[int]:
+    """Invert IJG quality scaling using the luminance (table 0) quantization table"""
+    j = 0
+    while j < len(segment):
+        precision, table_id = segment[j] >> 4, segment[j] & 0x0F
+        entry_size = 2 if precision else 1
+        raw = segment[j + 1:j + 1 + 64 * entry_size]
+        if len(raw) < 64 * entry_size:
+            return None
+        if table_id == 0:
+            values = struct.unpack(">64H", raw) if precision else raw
+            scale = sum(values) * 100.0 / _STD_LUMINANCE_SUM
+            if scale <= 1:
+                return 100
+            quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+            return max(1, min(100, int(round(quality))))
+        j += 1 + 64 * entry_size
+    return None
+
+
+def _webp_dimensions(data: bytes) -> Tuple[Optional[int], Optional[int]]:
+    chunk = data[12:16]
+    if chunk == b"VP8 " and len(data) >= 30:
+        width, height = struct.unpack("<HH", data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and len(data) >= 25:
+        bits = struct.unpack("<I", data[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(data) >= 30:
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return width, height
+    return None, None
+
+
+def _bucket(value: Optional[float], edges: Tuple) -> int:
+    if value is None:
+        return -1
+    for idx, edge in enumerate(edges):
+        if value < edge:
+            return idx
+    return len(edges)
+
+
+class SavingsPredictor:
+    """
+    Predicts re-encoding savings from past results
+
+    Results are grouped by format, bytes-per-pixel and (for JPEG) estimated
+    encoder quality. The most specific group with enough history wins.
+
+    Example:
+        predictor = SavingsPredictor(threshold=0.05)
+        client = Shrinkix(api_key="sk_live_xxx", predictor=predictor)
+        result = client.optimize.optimize(file="photo.jpg")
+        if result.skipped:
+            print("Already optimized, upload skipped")
+        print(predictor.stats())
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.05,
+        min_samples: int = 20,
+        mode: str = "skip",
+        explore_rate: float = 0.05,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            threshold: Minimum expected savings (fraction) worth an upload
+            min_samples: Observations a group needs before it is trusted
+            mode: "skip" returns the original without calling the API,
+                  "flag" still calls the API and only marks the result
+            explore_rate: Fraction of would-be skips still sent in "skip" mode,
+                          so precision and recall keep being measured (0
+                          turns measuring off: both are reported as None)
+            seed: Random seed for exploration (optional)
+        """
+        if mode not in ("skip", "flag"):
+            raise ValueError("mode must be 'skip' or 'flag'")
+
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.mode = mode
+        self.explore_rate = explore_rate
+
+        self._groups: Dict[str, list] = {}  # key -> [count, savings_sum]
+        self._counts = {"tp": 0, "fp": 0, "fn": 0, "tn": 0, "observations": 0, "skipped": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _keys(self, info: ImageInfo):
+        fmt = info.format or "unknown"
+        bpp = _bucket(info.bytes_per_pixel, _BPP_EDGES)
+        quality = _bucket(info.jpeg_quality, _QUALITY_EDGES)
+        return [f"{fmt}|{bpp}|{quality}", f"{fmt}|{bpp}", fmt]
+
+    def predict(self, info: ImageInfo) -> Prediction:
+        """Predict savings for an image"""
+        with self._lock:
+            return self._predict(info)
+
+    def _predict(self, info: ImageInfo) -> Prediction:
+        for key in self._keys(info):
+            count, total = self._groups.get(key, (0, 0.0))
+            if count >= self.min_samples:
+                savings = total / count
+                return Prediction(savings=savings, samples=count, skip=savings < self.threshold)
+        return Prediction(savings=None, samples=0, skip=False)
+
+    def should_skip(self, prediction: Prediction) -> bool:
+        """Whether a call should be skipped (exploration lets some through)"""
+        if self.mode != "skip" or not prediction.skip:
+            return False
+        with self._lock:
+            if self._random.random() < self.explore_rate:
+                return False
+            self._counts["skipped"] += 1
+            return True
+
+    def observe(self, info: ImageInfo, original_size: int, optimized_size: int) -> None:
+        """Record an actual result (scores the prior prediction, then learns from it)"""
+        if original_size <= 0:
+            return
+        savings = max(0.0, 1.0 - optimized_size / original_size)
+
+        with self._lock:
+            prediction = self._predict(info)
+            if prediction.savings is not None:
+                pointless = savings < self.threshold
+                if prediction.skip:
+                    # In skip mode this file is one of the explored few: it
+                    # stands for 1 / explore_rate files like it
+                    weight = 1.0
+                    if self.mode == "skip" and self.explore_rate > 0:
+                        weight = 1.0 / self.explore_rate
+                    self._counts["tp" if pointless else "fp"] += weight
+                else:
+                    self._counts["fn" if pointless else "tn"] += 1
+
+            self._counts["observations"] += 1
+            for key in self._keys(info):
+                group = self._groups.setdefault(key, [0, 0.0])
+                group[0] += 1
+                group[1] += savings
+
+    def stats(self) -> PredictorStats:
+        """Precision/recall of skip decisions ("positive" = savings below threshold)"""
+        with self._lock:
+            c = dict(self._counts)
+        flagged = c["tp"] + c["fp"]
+        pointless = c["tp"] + c["fn"]
+        # Without exploration no predicted skip is ever checked
+        measurable = self.mode == "flag" or self.explore_rate > 0
+        return PredictorStats(
+            observations=c["observations"],
+            evaluated=c["tp"] + c["fp"] + c["fn"] + c["tn"],
+            true_positives=c["tp"],
+            false_positives=c["fp"],
+            false_negatives=c["fn"],
+            true_negatives=c["tn"],
+            skipped=c["skipped"],
+            precision=c["tp"] / flagged if flagged and measurable else None,
+            recall=c["tp"] / pointless if pointless and measurable else None
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize learned state"""
+        with self._lock:
+            return {
+                "threshold": self.threshold,
+                "groups": {key: list(value) for key, value in self._groups.items()},
+                "counts": dict(self._counts)
+            }
+
+    def save(self, path: str) -> None:
+        """Persist learned state to a JSON file"""
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "SavingsPredictor":
+        """Restore a predictor saved with save()"""
+        with open(path) as f:
+            state = json.load(f)
+        kwargs.setdefault("threshold", state.get("threshold", 0.05))
+        predictor = cls(**kwargs)
+        predictor._groups = {key: list(value) for key, value in state.get("groups", {}).items()}
+        predictor._counts.update(state.get("counts", {}))
+        return predictor
+
+
+__all__ = [
+    "SavingsPredictor",
+    "Prediction",
+    "PredictorStats",
+    "ImageInfo",
+    "inspect_image",
+    "read_header",
+]
@@ -0,0 +1,206 @@
+"""
+Shared Rate Limiter
+Token bucket kept in a lock-protected mmap file, so every process on a host
+using the same API key draws from one budget (gunicorn/Celery prefork fleets)
+"""
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import weakref
+from typing import Dict, Any, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: the bucket is only shared between threads
+    fcntl = None
+
+
+# tokens, updated_at, rate (req/sec), blocked_until
+_STATE = struct.Struct("dddd")
+
+# Each limiter's thread lock is held across fork() so no child inherits it mid-use
+_limiters: "weakref.WeakSet[SharedRateLimiter]" = weakref.WeakSet()
+_held_at_fork = []
+
+
+def _before_fork() -> None:
+    _held_at_fork[:] = list(_limiters)
+    for limiter in _held_at_fork:
+        limiter._lock.acquire()
+
+
+def _after_fork() -> None:
+    for limiter in _held_at_fork:
+        limiter._lock.release()
+    _held_at_fork.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_before_fork, after_in_parent=_after_fork, after_in_child=_after_fork)
+
+
+class SharedRateLimiter:
+    """
+    Cross-process pacing for one API key
+
+    The rate starts at `rate` and follows the server's X-RateLimit-Limit
+    (requests per second) once seen. A 429 with Retry-After pauses every
+    process sharing the bucket. Requests reserve a slot and sleep until it
+    comes up, so waiting processes are served in order instead of polling.
+
+    Example:
+        limiter = SharedRateLimiter("sk_live_xxx")
+        client = Shrinkix(api_key="sk_live_xxx", rate_limiter=limiter)
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        rate: float = 1.0,
+        burst: Optional[float] = None,
+        directory: Optional[str] = None
+    ):
+        """
+        Args:
+            api_key: API key the budget belongs to (only its hash is used)
+            rate: Requests per second until the server reports its limit
+            burst: Bucket capacity (optional, defaults to max(1, rate))
+            directory: Location of the state file (optional, defaults to the temp dir)
+        """
+        digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(directory or tempfile.gettempdir(), f"shrinkix-ratelimit-{digest}.bin")
+        self.initial_rate = rate
+        self.burst = burst
+
+        self._pid: Optional[int] = None
+        self._fd: Optional[int] = None
+        self._map: Optional[mmap.mmap] = None
+        # Guards the handles and counters below; never replaced (see _before_fork)
+        self._lock = threading.Lock()
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._paused = 0
+        _limiters.add(self)
+
+    def _open(self) -> None:
+        """(Re)open the shared file (called with self._lock held); flock is not valid across fork"""
+        if self._pid == os.getpid():
+            return
+        # After fork the inherited descriptor shares the parent's flock; use our own
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(fd).st_size < _STATE.size:
+            os.ftruncate(fd, _STATE.size)  # zero-filled: rate 0 means "not yet initialised"
+        self._fd = fd
+        self._map = mmap.mmap(fd, _STATE.size)
+        self._pid = os.getpid()
+
+    def _locked(self, update):
+        """Run update(state) -> (new_state, result) under the thread and file locks"""
+        with self._lock:
+            self._open()
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                state = _STATE.unpack_from(self._map, 0)
+                new_state, result = update(state)
+                if new_state is not None:
+                    _STATE.pack_into(self._map, 0, *new_state)
+                return result
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _capacity(self, rate: float) -> float:
+        return self.burst if self.burst is not None else max(1.0, rate)
+
+    def acquire(self) -> float:
+        """
+        Wait for a request slot
+
+        Returns:
+            Seconds spent waiting
+        """
+        def reserve(state):
+            tokens, updated_at, rate, blocked_until = state
+            now = time.time()
+            if rate <= 0:
+                rate, tokens, updated_at = self.initial_rate, self._capacity(self.initial_rate), now
+
+            # Refill, then take a token; a negative balance is a queue of reserved slots
+            start = max(now, blocked_until)
+            tokens = min(self._capacity(rate), tokens + (start - updated_at) * rate) - 1
+            wait = start - now + (-tokens / rate if tokens < 0 else 0.0)
+            if wait > 0:
+                self._waits += 1
+                self._wait_seconds += wait
+            return (tokens, start, rate, blocked_until), wait
+
+        wait = self._locked(reserve)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def observe(self, limit: Optional[str], status_code: int, retry_after: Optional[str] = None) -> None:
+        """Learn the plan rate and honour 429 Retry-After for every process"""
+        try:
+            rate = float(limit) if limit else None
+        except ValueError:
+            rate = None
+        if rate is not None and rate <= 0:
+            rate = None
+
+        pause = None
+        if status_code == 429:
+            try:
+                pause = float(retry_after) if retry_after else 1.0
+            except ValueError:
+                pause = 1.0
+
+        if rate is None and pause is None:
+            return
+
+        def update(state):
+            tokens, updated_at, current, blocked_until = state
+            if rate is not None:
+                current = rate
+            if pause is not None:
+                blocked_until = max(blocked_until, time.time() + pause)
+                tokens = min(tokens, 0.0)
+                self._paused += 1
+            return (tokens, updated_at, current, blocked_until), None
+
+        self._locked(update)
+
+    def stats(self) -> Dict[str, Any]:
+        """Shared bucket state plus this process's wait counters"""
+        def read(state):
+            return None, (state, self._waits, self._wait_seconds, self._paused)
+
+        (tokens, updated_at, rate, blocked_until), waits, wait_seconds, paused = self._locked(read)
+        rate = rate or self.initial_rate
+        now = time.time()
+        if now > updated_at:
+            tokens = min(self._capacity(rate), tokens + (now - updated_at) * rate)
+        return {
+            "rate": rate,
+            "tokens": round(tokens, 3),
+            "paused_for": max(0.0, blocked_until - time.time()),
+            "waits": waits,
+            "wait_seconds": round(wait_seconds, 3),
+            "throttled": paused
+        }
+
+    def close(self) -> None:
+        """Release this process's handles (the shared file is kept)"""
+        with self._lock:
+            if self._pid == os.getpid() and self._map is not None:
+                self._map.close()
+                os.close(self._fd)
+            self._pid = self._fd = self._map = None
@@ -1,9 +1,30 @@
 """
 Optimize Resource
 """
-from typing import Dict, Any, Optional, Union, BinaryIO
-from dataclasses import dataclass
+from typing import Dict, Any, Callable, List, Optional, Tuple, Union, BinaryIO, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from dataclasses import dataclass, field
+import asyncio
+import functools
+import hashlib
+import json
 import os
+import re
+import threading
+import time
+
+from ..errors import ApiError, NetworkError
+from ..predictor import SavingsPredictor, ImageInfo, Prediction, inspect_image, read_header
+from ..concurrency import AdaptiveLimiter
+from ..streaming import Progress, ProgressTracker, iter_zip_entries
+from ..transport import RETRY_STATUS
+
+# Latency samples are normalised to seconds per MB; smaller uploads count as 64KB
+_LATENCY_FLOOR_BYTES = 64 * 1024
+
+# Files per batch request (limit of /v1/optimize/batch)
+BATCH_MAX_FILES = 10
 
 
 @dataclass
@@ -16,14 +37,138 @@ class OptimizeResult:
     operations: list
     usage: Dict[str, Any]
     rate_limit: Dict[str, Any]
-    request_id: str
+    request_id: Optional[str]
+    skipped: bool = False
+    cached: bool = False
+    flagged: bool = False
+    predicted_savings: Optional[float] = None
+    server_timing: Dict[str, float] = field(default_factory=dict)
+
+
+def _parse_server_timing(value: Optional[str]) -> Dict[str, float]:
+    """Server-Timing header -> {metric: duration ms}, e.g. {"queue": 3.0, "encode": 41.0, "cpu": 39.2}"""
+    timing = {}
+    for metric in (value or "").split(","):
+        name, *params = [part.strip() for part in metric.split(";")]
+        if not name:
+            continue
+        timing[name] = 0.0
+        for param in params:
+            key, _, number = param.partition("=")
+            if key.strip().lower() == "dur":
+                try:
+                    timing[name] = float(number)
+                except ValueError:
+                    pass
+    return timing
+
+
+def _parse_headers(headers: Dict[str, Any], original_size: Optional[int], data: bytes) -> Dict[str, Any]:
+    """Read size/savings metadata sent alongside the binary result"""
+    lowered = {k.lower(): v for k, v in headers.items()}
+    original = lowered.get("x-original-size")
+    optimized = lowered.get("x-optimized-size")
+    original = int(original) if original else original_size
+    optimized = int(optimized) if optimized else len(data)
+
+    savings = {}
+    if original:
+        savings = {
+            "bytes": original - optimized,
+            "percent": round((1 - optimized / original) * 100, 1)
+        }
+
+    operations = lowered.get("x-operations")
+    server_timing = _parse_server_timing(lowered.get("server-timing"))
+    return {
+        "original": {"size": original} if original else {},
+        "optimized": {"size": optimized},
+        "savings": savings,
+        "operations": operations.split(",") if operations else [],
+        "server_timing": server_timing,
+        # Served from the server's result cache: nothing was encoded
+        "cached": lowered.get("x-cache", "").upper() == "HIT" or (
+            "cache" in server_timing and "encode" not in server_timing
+        )
+    }
+
+
+def _read_file(file: Union[str, bytes, BinaryIO]) -> Tuple[Optional[str], bytes]:
+    """Load file contents along with a filename the server can infer the format from"""
+    if isinstance(file, str):
+        with open(file, "rb") as f:
+            return os.path.basename(file), f.read()
+    if isinstance(file, (bytes, bytearray)):
+        return None, bytes(file)
+    name = getattr(file, "name", None)
+    return (os.path.basename(name) if isinstance(name, str) else None), file.read()
+
+
+def _file_size(file: Union[str, bytes, BinaryIO]) -> Optional[int]:
+    if isinstance(file, str):
+        return os.path.getsize(file)
+    if isinstance(file, (bytes, bytearray)):
+        return len(file)
+    # Bytes left from the current position, i.e. what gets uploaded
+    try:
+        return os.fstat(file.fileno()).st_size - file.tell()
+    except (AttributeError, OSError, ValueError):
+        pass
+    try:
+        pos = file.tell()
+        end = file.seek(0, os.SEEK_END)
+        file.seek(pos)
+        return end - pos
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _upload_names(files: List[Union[str, bytes, BinaryIO]]) -> List[str]:
+    """
+    Filenames for a batch: "<index>.<format>", from the detected image format
+
+    The server names each archive entry after its upload, but multer reads
+    multipart filenames as latin1 while requests sends UTF-8. Plain ASCII
+    names built from the index keep the entry -> file mapping exact.
+    """
+    names = []
+    for index, file in enumerate(files):
+        fmt = inspect_image(*read_header(file)).format
+        if fmt is None:
+            # Not recognised here: keep the file's own extension if it is plain ASCII
+            name = file if isinstance(file, str) else getattr(file, "name", None)
+            ext = os.path.splitext(name)[1].lstrip(".").lower() if isinstance(name, str) else ""
+            fmt = ext if re.fullmatch(r"[a-z0-9]+", ext) else "bin"
+        names.append(f"{index}.{fmt}")
+    return names
+
+
+def _upload_content_type(upload_name: str) -> str:
+    """The API only accepts image/* parts in a batch"""
+    ext = os.path.splitext(upload_name)[1].lstrip(".")
+    return f"image/{ext}" if ext in ("jpeg", "png", "webp", "avif") else "application/octet-stream"
+
+
+def _batch_entry_name(upload_name: str) -> str:
+    stem, ext = os.path.splitext(upload_name)
+    return f"{stem}-min{ext}"
 
 
 class Optimize:
     """Handles image optimization operations"""
     
-    def __init__(self, transport):
+    def __init__(
+        self,
+        transport,
+        predictor: Optional[SavingsPredictor] = None,
+        concurrency: Optional[AdaptiveLimiter] = None
+    ):
         self.transport = transport
+        self.predictor = predictor
+        self.concurrency = concurrency or AdaptiveLimiter()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_pid: Optional[int] = None
+        self._lock = threading.Lock()
     
     def optimize(
         self,
@@ -32,7 +177,9 @@ class Optimize:
         crop: Optional[Dict[str, Any]] = None,
         format: Optional[str] = None,
         quality: Optional[int] = None,
-        metadata: Optional[str] = None
+        metadata: Optional[str] = None,
+        precheck: bool = False,
+        on_progress: Optional[Callable[[Progress], None]] = None
     ) -> OptimizeResult:
         """
         Optimize an image
@@ -44,25 +191,29 @@ class Optimize:
             format: Output format (jpg|png|webp|avif)
             quality: 1-100
             metadata: strip|keep
+            precheck: Send the file hash first and skip the upload when the
+                      server already holds the optimized result
+            on_progress: Called with a Progress (bytes uploaded/downloaded)
+                         as the transfer advances
         
         Returns:
             OptimizeResult with optimized image and metadata
         """
-        # Prepare files
-        if isinstance(file, str):
-            files = {"image": open(file, "rb")}
-        elif isinstance(file, bytes):
-            files = {"image": file}
-        else:
-            files = {"image": file}
-        
+        # Savings prediction only applies to plain re-compression: the server
+        # hands back the original untouched only when nothing else is requested.
+        # Groups are learnt at the default quality, so an explicit one bypasses too
+        info = prediction = None
+        if self.predictor is not None and not (resize or crop or format or quality):
+            info = inspect_image(*read_header(file))
+            prediction = self.predictor.predict(info)
+            if self.predictor.should_skip(prediction):
+                return self._skipped(file, info, prediction)
+
         # Prepare data
         data = {}
         if resize:
-            import json
             data["resize"] = json.dumps(resize)
         if crop:
-            import json
             data["crop"] = json.dumps(crop)
         if format:
             data["format"] = format
@@ -70,18 +221,324 @@ class Optimize:
             data["quality"] = str(quality)
         if metadata:
             data["metadata"] = metadata
+
+        # Prepare files
+        if precheck:
+            filename, content = _read_file(file)
+            cached = self._precheck(content, filename, data)
+            if cached is not None:
+                return self._result(cached, info, prediction)
+            files = {"image": (filename, content) if filename else content}
+        elif isinstance(file, str):
+            files = {"image": open(file, "rb")}
+        else:
+            files = {"image": file}
+        
+        # optimize_iter() passes one tracker shared by all its files
+        progress = on_progress
+        if on_progress is not None and not isinstance(on_progress, ProgressTracker):
+            progress = ProgressTracker(on_progress, _file_size(file))
         
         # Make request
-        result = self.transport.post("/optimize", files=files, data=data)
+        result = self.transport.post("/optimize", files=files, data=data, progress=progress)
+        return self._result(result, info, prediction)
+
+    def optimize_many(
+        self,
+        files: Iterable[Union[str, bytes, BinaryIO]],
+        return_exceptions: bool = False,
+        **options
+    ) -> Iterator[OptimizeResult]:
+        """
+        Optimize many images concurrently under the adaptive concurrency limit
+        
+        Args:
+            files: File paths, bytes, or file objects
+            return_exceptions: Yield ApiError/NetworkError in place of failed
+                               results instead of raising the first one
+            **options: Same keyword arguments as optimize()
         
-        # Parse response (for now, return raw - would parse JSON in production)
+        Returns:
+            Iterator of OptimizeResult in input order
+        """
+        pool = self._executor()
+        futures = [pool.submit(self._limited, file, options) for file in files]
+        try:
+            for future in futures:
+                try:
+                    yield future.result()
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    yield e
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def optimize_iter(
+        self,
+        files: Iterable[Union[str, bytes, BinaryIO]],
+        batch: bool = False,
+        on_progress: Optional[Callable[[Progress], None]] = None,
+        return_exceptions: bool = False,
+        **options
+    ) -> Iterator[Tuple[int, OptimizeResult]]:
+        """
+        Optimize many images, yielding each result as soon as it is ready
+        
+        Unlike optimize_many(), results come in completion order, so work on
+        finished images (e.g. a CDN upload) overlaps with the rest still
+        being encoded.
+        
+        Args:
+            files: File paths, bytes, or file objects
+            batch: Send the files in ZIP batch requests of up to
+                   BATCH_MAX_FILES instead of one call per file. Entries are
+                   yielded while the archive is still streaming. Batches use
+                   the server's default settings, so options are not allowed
+            on_progress: Called with a Progress (bytes uploaded/downloaded,
+                         summed over all files) as transfers advance. Runs on
+                         the transfer threads
+            return_exceptions: Yield ApiError/NetworkError in place of failed
+                               results instead of raising the first one
+            **options: Same keyword arguments as optimize() (per-file calls only)
+        
+        Returns:
+            Iterator of (index, OptimizeResult) pairs, index being the
+            file's position in files
+        """
+        files = list(files)
+        progress = None
+        if on_progress is not None:
+            sizes = [_file_size(file) for file in files]
+            progress = ProgressTracker(on_progress, None if None in sizes else sum(sizes))
+        
+        if batch:
+            if options:
+                raise ValueError(f"Batch requests take no options: {', '.join(sorted(options))}")
+            yield from self._iter_batches(files, progress, return_exceptions)
+            return
+        
+        if progress is not None:
+            options["on_progress"] = progress
+        pool = self._executor()
+        futures = {pool.submit(self._limited, file, options): index for index, file in enumerate(files)}
+        try:
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    result = e
+                yield futures[future], result
+        finally:
+            for future in futures:
+                future.cancel()
+
+    async def optimize_async(self, file: Union[str, bytes, BinaryIO], **options) -> OptimizeResult:
+        """
+        Optimize an image without blocking the event loop
+        
+        Calls share the adaptive concurrency limit with optimize_many(), so
+        asyncio.gather() over many files is paced the same way.
+        
+        Args:
+            file: File path, bytes, or file object
+            **options: Same keyword arguments as optimize()
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor(), functools.partial(self._limited, file, options))
+
+    def close(self) -> None:
+        """Shut down the bulk thread pool"""
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                # Threads beyond the current limit just wait for a slot
+                self._pool = ThreadPoolExecutor(max_workers=self.concurrency.max_limit)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _limited(self, file: Union[str, bytes, BinaryIO], options: Dict[str, Any]) -> OptimizeResult:
+        """
+        optimize() inside a concurrency slot, reporting latency or shedding back
+
+        The transport retries 429/503 itself: each retry still counts as a
+        drop, and its Retry-After pause is left out of the latency sample.
+        """
+        size = _file_size(file)
+        ticket = self.concurrency.acquire()
+        outcome: Dict[str, Any] = {}
+        paused = 0.0
+
+        def retried(error: ApiError, wait: float) -> None:
+            nonlocal paused
+            self.concurrency.drop(ticket)
+            paused += wait
+
+        try:
+            start = time.monotonic()
+            with self.transport.retry_hook(retried):
+                try:
+                    result = self.optimize(file, **options)
+                except ApiError as e:
+                    outcome["dropped"] = e.status_code in RETRY_STATUS
+                    raise
+            # Skipped and cache-hit results involve no encode: their near-zero
+            # times would read as an idle server and push the limit up
+            if not (result.skipped or result.cached):
+                elapsed = time.monotonic() - start - paused
+                outcome["latency"] = elapsed * 1024 * 1024 / max(size or 0, _LATENCY_FLOOR_BYTES)
+            return result
+        finally:
+            self.concurrency.release(ticket, **outcome)
+
+    def _precheck(self, content: bytes, filename: Optional[str], data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Ask the server for a cached result by content hash (None on a miss)"""
+        payload = dict(data)
+        payload["hash"] = hashlib.sha256(content).hexdigest()
+        if filename:
+            payload["filename"] = filename
+
+        try:
+            return self.transport.post("/optimize/precheck", json=payload, raw=True)
+        except ApiError as e:
+            if e.code == "CACHE_MISS":
+                return None
+            raise
+
+    def _result(
+        self,
+        result: Dict[str, Any],
+        info: Optional[ImageInfo],
+        prediction: Optional[Prediction]
+    ) -> OptimizeResult:
+        """Build an OptimizeResult from a transport response"""
+        parsed = _parse_headers(result["headers"], info.size if info else None, result["data"])
+
+        if info is not None:
+            self.predictor.observe(info, info.size, parsed["optimized"]["size"])
+
         return OptimizeResult(
             data=result["data"],
-            original={},  # Would parse from response
-            optimized={},
-            savings={},
-            operations=[],
+            original=parsed["original"],
+            optimized=parsed["optimized"],
+            savings=parsed["savings"],
+            operations=parsed["operations"],
+            usage={},
+            rate_limit=result["rate_limit"],
+            request_id=result["rate_limit"]["request_id"],
+            flagged=bool(prediction and prediction.skip),
+            predicted_savings=prediction.savings if prediction else None,
+            cached=parsed["cached"],
+            server_timing=parsed["server_timing"]
+        )
+
+    def _iter_batches(
+        self,
+        files: List[Union[str, bytes, BinaryIO]],
+        progress: Optional[ProgressTracker],
+        return_exceptions: bool
+    ) -> Iterator[Tuple[int, Any]]:
+        """Send files in batch requests and yield each archive entry as it arrives"""
+        names = _upload_names(files)
+        
+        for start in range(0, len(files), BATCH_MAX_FILES):
+            indices = range(start, min(start + BATCH_MAX_FILES, len(files)))
+            sizes = {index: _file_size(files[index]) for index in indices}
+            # The server names each entry after its upload: 3.jpeg -> 3-min.jpeg
+            expected = {_batch_entry_name(names[index]): index for index in indices}
+            
+            opened = []
+            uploads = []
+            for index in indices:
+                file = files[index]
+                if isinstance(file, str):
+                    file = open(file, "rb")
+                    opened.append(file)
+                uploads.append(("images[]", (names[index], file, _upload_content_type(names[index]))))
+            
+            finished = set()
+            failures = {}
+            try:
+                result = self.transport.post("/optimize/batch", files=uploads, stream=True, progress=progress)
+                with closing(result["data"]) as chunks:
+                    for name, content in iter_zip_entries(chunks):
+                        if name == "manifest.json":
+                            failures = {
+                                entry["filename"]: entry["error"]
+                                for entry in json.loads(content).get("files", []) if entry.get("error")
+                            }
+                            continue
+                        index = expected.get(name)
+                        if index is None:
+                            continue  # not one of ours (upload names are unique)
+                        finished.add(index)
+                        yield index, self._batch_result(content, sizes[index], result)
+            except (ApiError, NetworkError, ValueError) as e:
+                # The whole request failed, or the archive broke off part way
+                if isinstance(e, ValueError):
+                    e = NetworkError("Batch archive was cut short or malformed", e)
+                if not return_exceptions:
+                    raise e
+                for index in indices:
+                    if index not in finished:
+                        yield index, e
+                continue
+            finally:
+                for file in opened:
+                    file.close()
+            
+            # Entries the server could not compress are only listed in manifest.json
+            for index in indices:
+                if index in finished:
+                    continue
+                error = ApiError(
+                    message=failures.get(names[index], "Missing from the batch archive"),
+                    code="COMPRESSION_FAILED",
+                    status_code=500,
+                    request_id=result["rate_limit"]["request_id"],
+                    details={"filename": names[index]},
+                    rate_limit=result["rate_limit"]
+                )
+                if not return_exceptions:
+                    raise error
+                yield index, error
+
+    def _batch_result(self, content: bytes, original_size: Optional[int], result: Dict[str, Any]) -> OptimizeResult:
+        """OptimizeResult for one entry of a batch archive"""
+        parsed = _parse_headers({}, original_size, content)
+        return OptimizeResult(
+            data=content,
+            original=parsed["original"],
+            optimized=parsed["optimized"],
+            savings=parsed["savings"],
+            operations=["compress"],
             usage={},
             rate_limit=result["rate_limit"],
             request_id=result["rate_limit"]["request_id"]
         )
+
+    def _skipped(self, file: Union[str, bytes, BinaryIO], info: ImageInfo, prediction: Prediction) -> OptimizeResult:
+        """Result for a file the predictor expects not to shrink (original bytes, no API call)"""
+        _, data = _read_file(file)
+        size = {"size": len(data), "format": info.format, "width": info.width, "height": info.height}
+        return OptimizeResult(
+            data=data,
+            original=size,
+            optimized=dict(size),
+            savings={"bytes": 0, "percent": 0.0},
+            operations=[],
+            usage={},
+            rate_limit={},
+            request_id=None,
+            skipped=True,
+            flagged=True,
+            predicted_savings=prediction.savings
+        )
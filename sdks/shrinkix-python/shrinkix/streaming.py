@@ -0,0 +1,375 @@
+"""
+Streaming Transfers
+Byte-level upload/download progress, a multipart body that reports what it
+sends, and a ZIP reader that yields archive entries while the response is
+still arriving
+"""
+import binascii
+import os
+import struct
+import threading
+import zlib
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from urllib3.fields import RequestField
+
+from .admission import upload_values
+
+
+@dataclass
+class Progress:
+    """Bytes transferred so far, summed over every file of a call"""
+    uploaded: int
+    upload_total: Optional[int]  # image bytes to send (None when a size is unknown)
+    downloaded: int
+    download_total: Optional[int]  # Content-Length of responses started so far (None when streamed)
+
+
+class ProgressTracker:
+    """
+    Thread-safe byte counters feeding a progress callback
+
+    Example:
+        tracker = ProgressTracker(lambda p: print(f"{p.uploaded}/{p.upload_total}"), upload_total=size)
+    """
+
+    def __init__(self, callback: Callable[[Progress], None], upload_total: Optional[int] = None):
+        """
+        Args:
+            callback: Called with a Progress after every change. Runs on the
+                      thread doing the transfer, one call at a time
+            upload_total: Image bytes the call will upload (optional)
+        """
+        self.callback = callback
+        self._uploaded = 0
+        self._upload_total = upload_total
+        self._downloaded = 0
+        self._download_total: Optional[int] = 0
+        self._lock = threading.Lock()
+
+    def upload(self, nbytes: int) -> None:
+        """Count image bytes sent (negative when a retry resends them)"""
+        with self._lock:
+            self._uploaded += nbytes
+            self._report()
+
+    def expect_download(self, length: Optional[int]) -> None:
+        """A response started; length is its Content-Length (None when streamed)"""
+        with self._lock:
+            if length is None or self._download_total is None:
+                self._download_total = None
+            else:
+                self._download_total += length
+            self._report()
+
+    def download(self, nbytes: int) -> None:
+        """Count response bytes received"""
+        with self._lock:
+            self._downloaded += nbytes
+            self._report()
+
+    def snapshot(self) -> Progress:
+        with self._lock:
+            return self._progress()
+
+    def _progress(self) -> Progress:
+        return Progress(self._uploaded, self._upload_total, self._downloaded, self._download_total)
+
+    def _report(self) -> None:
+        # Under the lock, so callbacks never interleave or run out of order
+        self.callback(self._progress())
+
+
+class MultipartBody:
+    """
+    multipart/form-data body streamed from the files instead of built in memory
+
+    Encoded the same way requests encodes data=/files=. requests sends it
+    with a Content-Length and reads it block by block, so every read() is
+    counted as uploaded.
+    """
+
+    def __init__(self, data: Optional[Dict[str, Any]], files: Any, progress: Optional[ProgressTracker] = None):
+        """
+        Args:
+            data: Form fields
+            files: Dict or list of (field, value) pairs; values are bytes,
+                   file objects or (filename, bytes or file object[, content
+                   type]) tuples
+            progress: Tracker credited with the file bytes sent (optional)
+        """
+        self.progress = progress
+        self.boundary = binascii.hexlify(os.urandom(16)).decode("ascii")
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+
+        # Parts: (bytes or file object, length, start position, counts as upload)
+        self._parts: List[Tuple[Any, int, int, bool]] = []
+        for name, value in (data or {}).items():
+            self._add_header(RequestField(name, b""))
+            self._add_bytes(str(value).encode("utf-8"), False)
+            self._add_bytes(b"\r\n", False)
+
+        pairs = files.items() if isinstance(files, dict) else files
+        for (name, value), source in zip(pairs, upload_values(files)):
+            filename = value[0] if isinstance(value, tuple) else _guess_filename(value) or name
+            content_type = value[2] if isinstance(value, tuple) and len(value) > 2 else None
+            self._add_header(RequestField(name, b"", filename=filename), content_type)
+            self._add_source(source)
+            self._add_bytes(b"\r\n", False)
+        self._add_bytes(f"--{self.boundary}--\r\n".encode("ascii"), False)
+
+        self._length = sum(length for _, length, _, _ in self._parts)
+        self._index = 0
+        self._offset = 0
+        self._sent = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def read(self, size: int = -1) -> bytes:
+        """Next bytes of the body (b"" at the end)"""
+        out = []
+        wanted = self._length if size is None or size < 0 else size
+        counted = 0
+
+        while wanted > 0 and self._index < len(self._parts):
+            source, length, _, is_file = self._parts[self._index]
+            count = min(wanted, length - self._offset)
+            if isinstance(source, bytes):
+                chunk = source[self._offset:self._offset + count]
+            else:
+                chunk = source.read(count)
+                if len(chunk) < count:
+                    raise IOError("File shrank while it was being uploaded")
+            out.append(chunk)
+            wanted -= count
+            self._offset += count
+            if is_file:
+                counted += count
+            if self._offset >= length:
+                self._index += 1
+                self._offset = 0
+
+        if counted:
+            self._sent += counted
+            if self.progress is not None:
+                self.progress.upload(counted)
+        return b"".join(out)
+
+    def rewind(self) -> None:
+        """Start over for a retry; the bytes already counted are taken back"""
+        for source, _, start, _ in self._parts:
+            if not isinstance(source, bytes):
+                source.seek(start)
+        self._index = 0
+        self._offset = 0
+        if self._sent and self.progress is not None:
+            self.progress.upload(-self._sent)
+        self._sent = 0
+
+    def _add_header(self, field: RequestField, content_type: Optional[str] = None) -> None:
+        field.make_multipart(content_type=content_type)
+        self._add_bytes(f"--{self.boundary}\r\n{field.render_headers()}".encode("utf-8"), False)
+
+    def _add_bytes(self, data: bytes, is_file: bool) -> None:
+        self._parts.append((data, len(data), 0, is_file))
+
+    def _add_source(self, source: Any) -> None:
+        if isinstance(source, (bytes, bytearray)):
+            self._add_bytes(bytes(source), True)
+            return
+        try:
+            start = source.tell()
+            source.seek(0, os.SEEK_END)
+            length = source.tell() - start
+            source.seek(start)
+        except (AttributeError, OSError, ValueError):
+            # Not seekable (pipe, socket): the length has to be known up front
+            self._add_bytes(source.read(), True)
+            return
+        self._parts.append((source, length, start, True))
+
+
+def _guess_filename(value: Any) -> Optional[str]:
+    name = getattr(value, "name", None)
+    if isinstance(name, str) and name and name[0] != "<" and name[-1] != ">":
+        return os.path.basename(name)
+    return None
+
+
+# ZIP signatures (APPNOTE 4.3.7, 4.3.9, 4.3.12, 4.3.16)
+_LOCAL_HEADER = b"PK\x03\x04"
+_DATA_DESCRIPTOR = b"PK\x07\x08"
+_CENTRAL_HEADER = b"PK\x01\x02"
+_END_OF_CENTRAL_DIRECTORY = b"PK\x05\x06"
+
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+_STORED = 0
+_DEFLATED = 8
+
+
+class _ChunkReader:
+    """Pull exact byte counts out of an iterator of chunks"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+
+    def fill(self, nbytes: int) -> bool:
+        """Buffer at least nbytes; False if the stream ends first"""
+        while len(self._buffer) < nbytes:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return False
+            self._buffer += chunk
+        return True
+
+    def take(self, nbytes: int) -> bytes:
+        if not self.fill(nbytes):
+            raise ValueError("ZIP stream ended before the central directory")
+        data = bytes(self._buffer[:nbytes])
+        del self._buffer[:nbytes]
+        return data
+
+    def take_some(self) -> bytes:
+        """Whatever is buffered, or the next chunk"""
+        if not self.fill(1):
+            raise ValueError("ZIP stream ended before the central directory")
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+    def unread(self, data: bytes) -> None:
+        self._buffer[:0] = data
+
+
+def iter_zip_entries(chunks: Iterable[bytes]) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yield (name, content) for each file of a ZIP archive as soon as its data
+    has arrived, reading local file headers front to back
+
+    Handles the streamed layout that archiver writes: sizes left out of the
+    local header and sent in a data descriptor after the entry. Stored and
+    deflated entries are supported; the CRC of every entry is checked.
+    """
+    reader = _ChunkReader(chunks)
+
+    while True:
+        signature = reader.take(4)
+        if signature in (_CENTRAL_HEADER, _END_OF_CENTRAL_DIRECTORY):
+            return  # central directory: every entry has been read
+        if signature != _LOCAL_HEADER:
+            raise ValueError("Not a ZIP stream")
+
+        (_, flags, method, _, _, crc, compressed_size, size,
+         name_length, extra_length) = struct.unpack("<HHHHHIIIHH", reader.take(26))
+        raw_name = reader.take(name_length)
+        extra = _extra_fields(reader.take(extra_length))
+        name = raw_name.decode("utf-8" if flags & _FLAG_UTF8 else "cp437")
+
+        zip64 = 0x0001 in extra
+        if zip64 and len(extra[0x0001]) >= 16:
+            size, compressed_size = struct.unpack("<QQ", extra[0x0001][:16])
+
+        if flags & _FLAG_DATA_DESCRIPTOR:
+            if method == _STORED:
+                content, crc = _read_stored_until_descriptor(reader, zip64)
+            else:
+                content, consumed = _inflate(reader, method, None)
+                crc = _read_descriptor(reader, zip64, consumed)
+        else:
+            if method == _STORED:
+                content = reader.take(compressed_size)
+            else:
+                content, _ = _inflate(reader, method, compressed_size)
+
+        if zlib.crc32(content) != crc:
+            raise ValueError(f"CRC mismatch in ZIP entry {name}")
+        if not name.endswith("/"):
+            yield name, content
+
+
+def _extra_fields(extra: bytes) -> Dict[int, bytes]:
+    fields = {}
+    pos = 0
+    while pos + 4 <= len(extra):
+        field_id, length = struct.unpack_from("<HH", extra, pos)
+        fields[field_id] = extra[pos + 4:pos + 4 + length]
+        pos += 4 + length
+    return fields
+
+
+def _inflate(reader: _ChunkReader, method: int, compressed_size: Optional[int]) -> Tuple[bytes, int]:
+    """Decompress a deflated entry; returns (content, compressed bytes consumed)"""
+    if method != _DEFLATED:
+        raise ValueError(f"Unsupported ZIP compression method {method}")
+
+    inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+    out = []
+    consumed = 0
+    while not inflater.eof:
+        if compressed_size is None:
+            chunk = reader.take_some()
+        else:
+            chunk = reader.take(min(compressed_size - consumed, 64 * 1024))
+        consumed += len(chunk)
+        out.append(inflater.decompress(chunk))
+        if compressed_size is not None and consumed >= compressed_size:
+            break
+
+    # The deflate stream knows where it ends; the rest belongs to what follows
+    reader.unread(inflater.unused_data)
+    consumed -= len(inflater.unused_data)
+    out.append(inflater.flush())
+    return b"".join(out), consumed
+
+
+def _read_descriptor(reader: _ChunkReader, zip64: bool, compressed_size: int) -> int:
+    """Read the data descriptor after an entry whose length is known; returns its CRC"""
+    signature = reader.take(4)
+    if signature != _DATA_DESCRIPTOR:
+        reader.unread(signature)  # the signature is optional
+    crc, written = struct.unpack("<IQ" if zip64 else "<II", reader.take(12 if zip64 else 8))
+    if written != compressed_size:
+        raise ValueError("ZIP data descriptor does not match the entry")
+    reader.take(8 if zip64 else 4)  # uncompressed size
+    return crc
+
+
+def _read_stored_until_descriptor(reader: _ChunkReader, zip64: bool) -> Tuple[bytes, int]:
+    """
+    Read a stored entry of unknown length
+
+    Stored data can contain anything, so the end is the first data
+    descriptor signature followed by the CRC and size of the bytes before it.
+    """
+    descriptor = struct.Struct("<4sIQQ" if zip64 else "<4sIII")
+    parts = []
+    size = 0
+    crc = 0
+    pending = bytearray()
+
+    while True:
+        start = 0
+        while True:
+            found = pending.find(_DATA_DESCRIPTOR, start)
+            if found == -1 or len(pending) < found + descriptor.size:
+                break
+            _, expected_crc, compressed, uncompressed = descriptor.unpack_from(pending, found)
+            candidate_crc = zlib.crc32(pending[:found], crc)
+            if expected_crc == candidate_crc and compressed == uncompressed == size + found:
+                parts.append(bytes(pending[:found]))
+                reader.unread(bytes(pending[found + descriptor.size:]))
+                return b"".join(parts), candidate_crc
+            start = found + 1
+
+        # Everything before a possible (incomplete) descriptor is entry data
+        keep = found if found != -1 else max(len(pending) - len(_DATA_DESCRIPTOR) + 1, 0)
+        if keep:
+            crc = zlib.crc32(pending[:keep], crc)
+            size += keep
+            parts.append(bytes(pending[:keep]))
+            del pending[:keep]
+        pending += reader.take_some()
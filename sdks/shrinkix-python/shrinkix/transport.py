@@ -1,26 +1,76 @@
 """
 HTTP Transport Layer
 """
+import os
+import random
+import threading
+import time
 import requests
-from typing import Dict, Any, Optional
-from .errors import ApiError, NetworkError
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Callable, Iterator, List, Optional, Tuple
+from .errors import ApiError, NetworkError, AdmissionError
+from .admission import ByteBudget, payload_size, upload_values
+from .ratelimit import SharedRateLimiter
+from .streaming import MultipartBody, ProgressTracker
+
+# Response bytes read at a time when counting download progress
+DOWNLOAD_CHUNK = 64 * 1024
+
+# 429: rate limited, 503: server queue full (SERVER_BUSY)
+RETRY_STATUS = (429, 503)
+
+
+def retry_delay(retry_after: Optional[str]) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds or HTTP-date)"""
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
 
 
 class Transport:
     """Handles all API communication"""
     
-    def __init__(self, api_key: str, base_url: str = "https://api.shrinkix.com/v1", sandbox: bool = False):
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = "https://api.shrinkix.com/v1",
+        sandbox: bool = False,
+        budget: Optional[ByteBudget] = None,
+        rate_limiter: Optional[SharedRateLimiter] = None,
+        max_retries: int = 2,
+        max_retry_wait: float = 30.0
+    ):
         self.api_key = api_key
         self.base_url = base_url
         self.sandbox = sandbox
+        self.budget = budget
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.max_retry_wait = max_retry_wait
+        self.retries = 0
+        self._retries_lock = threading.Lock()
+        self._local = threading.local()
+        self._new_session()
+    
+    def _new_session(self):
         self.session = requests.Session()
         self.session.headers.update({
-            "Authorization": f"Bearer {api_key}",
+            "Authorization": f"Bearer {self.api_key}",
             "User-Agent": "shrinkix-python/1.0.0"
         })
         
-        if sandbox:
+        if self.sandbox:
             self.session.headers.update({"X-Mode": "sandbox"})
+        
+        self._pid = os.getpid()
     
     def request(
         self,
@@ -28,19 +78,143 @@ class Transport:
         endpoint: str,
         data: Optional[Dict[str, Any]] = None,
         files: Optional[Dict[str, Any]] = None,
-        json: Optional[Dict[str, Any]] = None
+        json: Optional[Dict[str, Any]] = None,
+        raw: bool = False,
+        progress: Optional[ProgressTracker] = None,
+        stream: bool = False
     ) -> Dict[str, Any]:
-        """Make HTTP request"""
-        url = f"{self.base_url}{endpoint}"
+        """
+        Make HTTP request
+        
+        429 and 503 responses are retried up to max_retries times, waiting for
+        Retry-After. Waits longer than max_retry_wait (e.g. a monthly quota
+        reset) are not retried; the ApiError is raised instead.
+        
+        endpoint is relative to base_url, or a full URL. With progress, the
+        upload is streamed and bytes sent/received are reported. With stream,
+        "data" is an iterator over the response body chunks; close it to
+        release the connection (and the call's byte budget) early.
+        """
+        positions = _file_positions(files)
+        upload = MultipartBody(data, files, progress) if progress is not None and files else None
         
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._send(method, endpoint, data, files, json, raw, upload, progress, stream)
+            except ApiError as e:
+                if attempt >= self.max_retries or e.status_code not in RETRY_STATUS:
+                    raise
+                
+                wait = retry_delay(e.retry_after)
+                if wait is None:
+                    if e.status_code == 429:
+                        raise  # no hint how long the limit lasts
+                    wait = 2 ** attempt  # 503 without Retry-After: exponential backoff
+                if wait > self.max_retry_wait:
+                    raise
+                
+                # A shared limiter already pauses every process until Retry-After
+                if not (e.status_code == 429 and self.rate_limiter is not None):
+                    time.sleep(wait * (1 + random.uniform(0, 0.1)))
+                
+                # Bulk calls retry from many pool threads at once
+                with self._retries_lock:
+                    self.retries += 1
+                on_retry = getattr(self._local, "on_retry", None)
+                if on_retry is not None:
+                    on_retry(e, wait)
+                _rewind(positions)
+                if upload is not None:
+                    upload.rewind()
+        
+        raise AssertionError("unreachable")
+    
+    @contextmanager
+    def retry_hook(self, on_retry: Callable[[ApiError, float], None]):
+        """
+        Call on_retry(error, wait) for each 429/503 retried by this thread
+        inside the with-block; wait is the Retry-After pause in seconds
+        """
+        previous = getattr(self._local, "on_retry", None)
+        self._local.on_retry = on_retry
         try:
-            response = self.session.request(
-                method=method,
-                url=url,
-                data=data,
-                files=files,
-                json=json
-            )
+            yield
+        finally:
+            self._local.on_retry = previous
+    
+    def _send(
+        self,
+        method: str,
+        endpoint: str,
+        data: Optional[Dict[str, Any]],
+        files: Optional[Dict[str, Any]],
+        json: Optional[Dict[str, Any]],
+        raw: bool,
+        upload: Optional[MultipartBody] = None,
+        progress: Optional[ProgressTracker] = None,
+        stream: bool = False
+    ) -> Dict[str, Any]:
+        """Single HTTP attempt"""
+        url = endpoint if "://" in endpoint else f"{self.base_url}{endpoint}"
+        upload_size = payload_size(files) if self.budget else 0
+        
+        # Pooled connections inherited across fork() share sockets with the parent
+        if self._pid != os.getpid():
+            self._new_session()
+        
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        
+        # Upload bytes stay reserved until the response body has been read:
+        # the encoded request is still referenced by the response until then
+        reserved = 0
+        try:
+            if self.budget is not None:
+                self.budget.acquire(upload_size)
+                reserved = upload_size
+            
+            if upload is not None:
+                response = self.session.request(
+                    method=method,
+                    url=url,
+                    data=upload,
+                    headers={"Content-Type": upload.content_type},
+                    stream=True
+                )
+            else:
+                response = self.session.request(
+                    method=method,
+                    url=url,
+                    data=data,
+                    files=files,
+                    json=json,
+                    stream=self.budget is not None or progress is not None or stream
+                )
+            
+            length = response.headers.get("content-length")
+            length = int(length) if length and length.isdigit() else None
+            if progress is not None and response.ok:
+                progress.expect_download(length)
+            
+            # A streamed body is left for the caller to read, but it is
+            # reserved here all the same
+            streamed = stream and response.ok
+            if self.budget is not None or (progress is not None and not streamed):
+                try:
+                    if self.budget is not None:
+                        extra = length if length is not None else upload_size
+                        if not self.budget.try_acquire(extra):
+                            # Waiting while holding could deadlock against another call
+                            # doing the same: let go, then wait for the total in one go
+                            self.budget.release(reserved)
+                            reserved = 0
+                            self.budget.acquire(upload_size + extra)
+                        reserved = upload_size + extra
+                    if not streamed:
+                        _buffer(response, progress if response.ok else None)
+                except AdmissionError:
+                    response.close()
+                    raise
             
             # Extract rate limit headers
             rate_limit = {
@@ -50,9 +224,18 @@ class Transport:
                 "request_id": response.headers.get("x-request-id")
             }
             
+            if self.rate_limiter is not None:
+                self.rate_limiter.observe(
+                    rate_limit["limit"], response.status_code, response.headers.get("retry-after")
+                )
+            
             # Handle errors
             if not response.ok:
-                body = response.json()
+                try:
+                    body = response.json()
+                except ValueError:
+                    # Not from the API (e.g. a proxy's HTML error page)
+                    body = {"error": f"HTTP_{response.status_code}", "message": response.reason or "API Error"}
                 raise ApiError(
                     message=body.get("message", "API Error"),
                     code=body.get("error", "UNKNOWN_ERROR"),
@@ -64,15 +247,32 @@ class Transport:
                     retry_after=response.headers.get("retry-after")
                 )
             
+            if stream:
+                # The reservation now goes with the body and is released once it is read
+                body = _StreamedBody(response, progress, self.budget, reserved)
+                reserved = 0
+                return {
+                    "data": body,
+                    "rate_limit": rate_limit,
+                    "headers": dict(response.headers)
+                }
+            
             # Return response with metadata
             return {
-                "data": response.content if files else response.json(),
+                "data": response.content if files or raw else response.json(),
                 "rate_limit": rate_limit,
                 "headers": dict(response.headers)
             }
             
         except requests.RequestException as e:
             raise NetworkError("Network request failed", e)
+        finally:
+            if self.budget is not None:
+                self.budget.release(reserved)
+    
+    def close(self):
+        """Close the HTTP session"""
+        self.session.close()
     
     def get(self, endpoint: str, **kwargs) -> Dict[str, Any]:
         """GET request"""
@@ -81,3 +281,75 @@ class Transport:
     def post(self, endpoint: str, **kwargs) -> Dict[str, Any]:
         """POST request"""
         return self.request("POST", endpoint, **kwargs)
+
+
+def _file_positions(files: Any) -> List[Tuple[Any, int]]:
+    """Remember where each uploaded file object starts so a retry can resend it"""
+    return [
+        (value, value.tell()) for value in upload_values(files)
+        if hasattr(value, "seek") and hasattr(value, "tell")
+    ]
+
+
+def _rewind(positions: List[Tuple[Any, int]]) -> None:
+    for value, position in positions:
+        value.seek(position)
+
+
+def _buffer(response: requests.Response, progress: Optional[ProgressTracker]) -> None:
+    """Read the whole body now, counting it as downloaded"""
+    if progress is None:
+        response.content
+        return
+    chunks = []
+    for chunk in response.iter_content(DOWNLOAD_CHUNK):
+        chunks.append(chunk)
+        progress.download(len(chunk))
+    # What requests itself stores once the body has been read
+    response._content = b"".join(chunks)
+    response._content_consumed = True
+
+
+class _StreamedBody:
+    """
+    Response body chunks as they arrive. The connection and the call's budget
+    reservation are released at the end of the body, on an error or on close()
+    """
+    
+    def __init__(
+        self,
+        response: requests.Response,
+        progress: Optional[ProgressTracker],
+        budget: Optional[ByteBudget] = None,
+        reserved: int = 0
+    ):
+        self._response = response
+        self._progress = progress
+        self._budget = budget
+        self._reserved = reserved
+        self._chunks = response.iter_content(DOWNLOAD_CHUNK)
+    
+    def __iter__(self) -> Iterator[bytes]:
+        return self
+    
+    def __next__(self) -> bytes:
+        try:
+            chunk = next(self._chunks)
+        except requests.RequestException as e:
+            self.close()
+            raise NetworkError("Network request failed", e)
+        except BaseException:
+            self.close()
+            raise
+        if self._progress is not None:
+            self._progress.download(len(chunk))
+        return chunk
+    
+    def close(self) -> None:
+        self._response.close()
+        budget, self._budget = self._budget, None
+        if budget is not None:
+            budget.release(self._reserved)
+    
+    def __del__(self):
+        self.close()
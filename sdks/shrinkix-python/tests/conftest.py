@@ -0,0 +1,71 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        server = self.server
+        with server.lock:
+            server.requests.append((self.command, self.path, dict(self.headers), body))
+            responder = server.responses.pop(0) if server.responses else server.default
+        status, headers, payload = responder(self, body) if callable(responder) else responder
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if isinstance(payload, (bytes, bytearray)):
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        else:
+            # Iterable of chunks: chunked transfer encoding
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for chunk in payload:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+    do_GET = do_POST = _handle
+
+
+class FakeApi:
+    """Local HTTP server answering with queued (status, headers, body) responses"""
+
+    def __init__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.responses = []
+        self.server.default = (404, {}, b'{"error": "NOT_FOUND"}')
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def queue(self, *responses):
+        """Responses are (status, headers, body) tuples or callables(handler, body) returning one"""
+        self.server.responses.extend(responses)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def api():
+    server = FakeApi()
+    yield server
+    server.close()
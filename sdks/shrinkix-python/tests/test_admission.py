@@ -0,0 +1,125 @@
+import io
+import threading
+import time
+
+import pytest
+
+from shrinkix.admission import ByteBudget, payload_size
+from shrinkix.errors import AdmissionError
+from shrinkix.transport import Transport
+
+
+def test_reserve_and_release():
+    budget = ByteBudget(100)
+    with budget.reserve(60):
+        assert budget.in_use == 60
+        assert budget.try_acquire(40)
+        assert not budget.try_acquire(1)
+        budget.release(40)
+    assert budget.in_use == 0
+    assert budget.stats()["peak"] == 100
+
+
+def test_too_large_is_rejected_at_once():
+    budget = ByteBudget(100)
+    with pytest.raises(AdmissionError) as e:
+        budget.acquire(101)
+    assert e.value.requested == 101
+    assert budget.stats()["rejected"] == 1
+
+
+def test_non_blocking_rejects_when_full():
+    budget = ByteBudget(100, block=False)
+    budget.acquire(80)
+    with pytest.raises(AdmissionError):
+        budget.acquire(30)
+
+
+def test_blocking_waits_for_release():
+    budget = ByteBudget(100)
+    budget.acquire(80)
+    acquired = threading.Event()
+
+    def waiter():
+        budget.acquire(30)
+        acquired.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    time.sleep(0.05)
+    assert not acquired.is_set() and budget.stats()["waiting"] == 1
+    budget.release(80)
+    assert acquired.wait(1)
+    thread.join()
+    assert budget.in_use == 30
+
+
+def test_timeout():
+    budget = ByteBudget(100, timeout=0.05)
+    budget.acquire(100)
+    with pytest.raises(AdmissionError):
+        budget.acquire(1)
+
+
+def test_payload_size(tmp_path):
+    path = tmp_path / "a.bin"
+    path.write_bytes(b"x" * 100)
+    with open(path, "rb") as f:
+        f.read(10)
+        stream = io.BytesIO(b"y" * 50)
+        files = [("a", f), ("b", ("b.png", b"z" * 7)), ("c", stream), ("d", b"w" * 3)]
+        assert payload_size(files) == 90 + 7 + 50 + 3
+        assert stream.tell() == 0
+
+
+def test_upload_stays_reserved_while_response_is_read(api):
+    budget = ByteBudget(10_000)
+    api.queue((200, {"Content-Type": "image/png"}, b"r" * 300))
+    transport = Transport("key", base_url=api.url, budget=budget)
+
+    result = transport.post("/optimize", files={"image": ("a.png", b"u" * 1000)})
+    assert result["data"] == b"r" * 300
+    assert budget.stats()["peak"] == 1300
+    assert budget.in_use == 0
+
+
+def test_response_waits_without_holding_upload(api):
+    # Another call holds most of the budget: growing the reservation must not
+    # wait while still holding the upload bytes
+    budget = ByteBudget(2000, timeout=2)
+    api.queue((200, {"Content-Type": "image/png"}, b"r" * 800))
+    transport = Transport("key", base_url=api.url, budget=budget)
+
+    budget.acquire(1000)
+    threading.Timer(0.2, budget.release, args=(1000,)).start()
+    result = transport.post("/optimize", files={"image": ("a.png", b"u" * 500)})
+    assert len(result["data"]) == 800
+    assert budget.in_use == 0
+
+
+def test_upload_plus_response_larger_than_budget(api):
+    budget = ByteBudget(1000)
+    api.queue((200, {"Content-Type": "image/png"}, b"r" * 600))
+    transport = Transport("key", base_url=api.url, budget=budget)
+    with pytest.raises(AdmissionError):
+        transport.post("/optimize", files={"image": ("a.png", b"u" * 500)})
+    assert budget.in_use == 0
+
+
+def test_streamed_body_stays_reserved_until_read(api):
+    budget = ByteBudget(10_000)
+    # Chunked: no Content-Length, so the upload size stands in for the body
+    api.queue((200, {"Content-Type": "application/zip"}, iter([b"r" * 300] * 3)))
+    api.queue((200, {"Content-Type": "application/zip"}, b"r" * 300))
+    transport = Transport("key", base_url=api.url, budget=budget)
+
+    result = transport.post("/optimize/batch", files={"images[]": ("a.png", b"u" * 1000)}, stream=True)
+    assert budget.stats()["in_use"] == 2000
+    assert b"".join(result["data"]) == b"r" * 900
+    assert budget.stats()["in_use"] == 0
+
+    # Closing without reading lets go as well
+    result = transport.post("/optimize/batch", files={"images[]": ("a.png", b"u" * 1000)}, stream=True)
+    assert budget.stats()["in_use"] == 1300
+    result["data"].close()
+    assert budget.stats()["in_use"] == 0
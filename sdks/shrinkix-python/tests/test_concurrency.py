@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from shrinkix.concurrency import AdaptiveLimiter
+
+
+def _round_trip(limiter, latency, calls=None, **outcome):
+    """Run `calls` (default: the current limit) concurrent calls reporting the same outcome"""
+    tickets = [limiter.acquire() for _ in range(calls or limiter.limit)]
+    for ticket in tickets:
+        limiter.release(ticket, latency=latency, **outcome)
+
+
+def test_rejects_inconsistent_bounds():
+    with pytest.raises(ValueError):
+        AdaptiveLimiter(initial_limit=1, min_limit=2)
+
+
+def test_grows_about_one_per_round_trip_at_steady_latency():
+    limiter = AdaptiveLimiter(initial_limit=4, max_limit=32)
+    # Steady load: the pool is refilled up to the limit as calls finish
+    inflight = []
+    for round_trip in range(5):
+        for _ in range(limiter.limit):
+            while len(inflight) < limiter.limit:
+                inflight.append(limiter.acquire())
+            limiter.release(inflight.pop(0), latency=0.1)
+    assert limiter.limit == 8  # roughly +1 per round trip
+
+
+def test_never_exceeds_max_limit():
+    limiter = AdaptiveLimiter(initial_limit=4, max_limit=6)
+    for _ in range(20):
+        _round_trip(limiter, 0.1)
+    assert limiter.limit == 6
+
+
+def test_unused_limit_does_not_grow():
+    limiter = AdaptiveLimiter(initial_limit=8)
+    for _ in range(20):
+        _round_trip(limiter, 0.1, calls=1)
+    assert limiter.limit == 8
+
+
+def test_rising_latency_shrinks_the_limit():
+    limiter = AdaptiveLimiter(initial_limit=16, max_limit=32, smoothing=1.0)
+    _round_trip(limiter, 0.1)
+    _round_trip(limiter, 0.3)
+    stats = limiter.stats()
+    assert stats["gradient"] == pytest.approx(0.5, abs=0.03)
+    assert stats["limit"] == 8
+
+
+def test_decreases_once_per_round_trip():
+    limiter = AdaptiveLimiter(initial_limit=16, min_limit=1, max_limit=32)
+    tickets = [limiter.acquire() for _ in range(16)]
+    for ticket in tickets:
+        limiter.release(ticket, dropped=True)
+    # Sixteen drops from one round trip only halve the limit once
+    assert limiter.limit == 8
+    assert limiter.stats()["drops"] == 16
+
+
+def test_drop_respects_min_limit():
+    limiter = AdaptiveLimiter(initial_limit=2, min_limit=2)
+    _round_trip(limiter, None, dropped=True)
+    assert limiter.limit == 2
+
+
+def test_acquire_blocks_at_the_limit():
+    limiter = AdaptiveLimiter(initial_limit=1, max_limit=1)
+    ticket = limiter.acquire()
+    admitted = threading.Event()
+
+    def second():
+        limiter.release(limiter.acquire(), latency=0.1)
+        admitted.set()
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    time.sleep(0.05)
+    assert not admitted.is_set() and limiter.stats()["waiting"] == 1
+    limiter.release(ticket, latency=0.1)
+    assert admitted.wait(1)
+    thread.join()
+
+
+def test_slot_reports_outcome():
+    limiter = AdaptiveLimiter(initial_limit=4)
+    with limiter.slot() as report:
+        report(dropped=True)
+    assert limiter.limit == 2
+
+    # An exception in the block still returns the slot (no outcome reported)
+    with pytest.raises(RuntimeError):
+        with limiter.slot():
+            raise RuntimeError("send failed")
+    assert limiter.stats()["inflight"] == 0
+    assert limiter.limit == 2
+
+
+def test_drop_keeps_the_slot():
+    limiter = AdaptiveLimiter(initial_limit=8)
+    ticket = limiter.acquire()
+    limiter.drop(ticket)
+    limiter.drop(ticket)  # a second retry of the same call does not halve again
+    assert limiter.limit == 4
+    assert limiter.stats()["inflight"] == 1
+    limiter.release(ticket, latency=0.1)
+    assert limiter.stats()["drops"] == 2
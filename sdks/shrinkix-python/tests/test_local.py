@@ -0,0 +1,106 @@
+import io
+
+import pytest
+
+from shrinkix.errors import ApiError
+
+Image = pytest.importorskip("PIL.Image")
+
+from shrinkix.local import LocalTransport, _adaptive_quality, _encode, _EngineFailure  # noqa: E402
+
+
+def _image(fmt="PNG", size=(200, 100)):
+    buf = io.BytesIO()
+    image = Image.new("RGB", size)
+    for x in range(0, size[0], 7):
+        image.putpixel((x, x % size[1]), (x % 255, 90, 200))
+    image.save(buf, fmt)
+    return buf.getvalue()
+
+
+def _decode(data):
+    return Image.open(io.BytesIO(data))
+
+
+def test_adaptive_quality_tiers():
+    assert _adaptive_quality(10 * 1024) == 90
+    assert _adaptive_quality(100 * 1024) == 82
+    assert _adaptive_quality(1024 * 1024) == 78
+    assert _adaptive_quality(5 * 1024 * 1024) == 75
+
+
+def test_fit_keeps_aspect_and_never_enlarges():
+    data, info = _encode(_image(), {"width": 100})
+    assert (info["width"], info["height"]) == (100, 50)
+
+    data, info = _encode(_image(), {"width": 400, "format": "png"})
+    assert (info["width"], info["height"]) == (200, 100)
+
+
+def test_fill_crops_to_box():
+    data, info = _encode(_image(), {"width": 50, "height": 50, "method": "fill"})
+    assert _decode(data).size == (50, 50)
+
+
+def test_center_crop_to_ratio():
+    data, info = _encode(_image(), {"crop": (1, 1), "format": "png"})
+    assert _decode(data).size == (100, 100)
+
+    # Crop first, then resize
+    data, info = _encode(_image(size=(200, 200)), {"crop": (16, 9), "width": 100})
+    assert (info["width"], info["height"]) == (100, 56)
+
+
+def test_transport_crops_or_refuses_the_crop():
+    transport = LocalTransport(workers=1)
+    try:
+        response = transport.post(
+            "/optimize",
+            files={"image": ("a.png", _image())},
+            data={"crop": '{"mode": "center", "ratio": "1:1"}'}
+        )
+        with pytest.raises(ValueError):
+            transport.post("/optimize", files={"image": _image()}, data={"crop": '{"mode": "smart"}'})
+    finally:
+        transport.close()
+    assert response["headers"]["X-Operations"] == "compress,crop"
+    assert _decode(response["data"]).size == (100, 100)
+
+
+def test_converts_format():
+    data, info = _encode(_image(), {"format": "jpg", "quality": 70})
+    assert info["format"] == "jpeg" and _decode(data).format == "JPEG"
+
+
+def test_keeps_original_when_output_is_larger():
+    original = _image("JPEG", (8, 8))
+    data, info = _encode(original, {"quality": 100})
+    assert len(data) <= len(original)
+
+
+def test_corrupted_input():
+    with pytest.raises(_EngineFailure) as e:
+        _encode(b"not an image", {})
+    assert e.value.code == "CORRUPTED_IMAGE"
+
+
+def test_transport_mirrors_api_headers():
+    transport = LocalTransport(workers=1)
+    try:
+        response = transport.post(
+            "/optimize",
+            files={"image": ("a.png", io.BytesIO(_image()))},
+            data={"format": "webp", "resize": '{"width": 100}'}
+        )
+    finally:
+        transport.close()
+    assert response["headers"]["X-Operations"] == "compress,resize,convert"
+    assert response["headers"]["X-Output-Format"] == "webp"
+    assert _decode(response["data"]).size == (100, 50)
+
+
+def test_transport_refuses_server_only_endpoints():
+    transport = LocalTransport(workers=1)
+    with pytest.raises(ApiError) as e:
+        transport.get("/usage")
+    assert e.value.code == "NOT_AVAILABLE_LOCALLY"
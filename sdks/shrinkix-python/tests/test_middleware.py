@@ -0,0 +1,196 @@
+import asyncio
+import hashlib
+
+import pytest
+
+from shrinkix.cache import TieredCache
+from shrinkix.middleware import ShrinkixASGIMiddleware, ShrinkixMiddleware
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+
+class FakeResult:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeOptimize:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def optimize(self, file, **options):
+        self.calls.append(options)
+        return FakeResult(b"variant:" + file.read()[-4:])
+
+
+class FakeClient:
+    """Stands in for Shrinkix: records optimize calls"""
+
+    def __init__(self):
+        self.calls = []
+        self.optimize = FakeOptimize(self.calls)
+
+
+class ImageApp:
+    """WSGI app serving one image, with ETag revalidation and optional auth"""
+
+    def __init__(self, body=PNG, require_auth=False, headers=()):
+        self.body = body
+        self.require_auth = require_auth
+        self.headers = list(headers)
+        self.requests = []
+
+    def __call__(self, environ, start_response):
+        self.requests.append(environ)
+        if self.require_auth and environ.get("HTTP_AUTHORIZATION") != "Bearer ok":
+            start_response("403 Forbidden", [("Content-Type", "text/plain")])
+            return [b"forbidden"]
+
+        etag = '"%s"' % hashlib.md5(self.body).hexdigest()
+        if environ.get("HTTP_IF_NONE_MATCH") == etag:
+            start_response("304 Not Modified", [("ETag", etag)] + self.headers)
+            return [b""]
+        start_response("200 OK", [("Content-Type", "image/png"), ("ETag", etag)] + self.headers)
+        return [self.body]
+
+
+def call(app, query, **environ):
+    environ.setdefault("REQUEST_METHOD", "GET")
+    environ.setdefault("PATH_INFO", "/media/photo.png")
+    environ["QUERY_STRING"] = query
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured["status"] = status
+        captured["headers"] = dict(headers)
+
+    body = b"".join(app(environ, start_response))
+    return int(captured["status"].split()[0]), captured["headers"], body
+
+
+@pytest.fixture
+def client():
+    return FakeClient()
+
+
+def test_optimizes_once_then_revalidates(client):
+    origin = ImageApp()
+    app = ShrinkixMiddleware(origin, client=client, cache=TieredCache())
+
+    status, headers, body = call(app, "width=640")
+    assert status == 200 and body.startswith(b"variant:")
+    status, _, again = call(app, "width=640")
+    assert status == 200 and again == body
+    assert len(client.calls) == 1
+
+    # The cached hit was a conditional request to the app
+    assert origin.requests[-1]["HTTP_IF_NONE_MATCH"]
+
+    status, _, _ = call(app, "width=640", HTTP_IF_NONE_MATCH=headers["ETag"])
+    assert status == 304
+
+
+def test_changed_original_is_optimized_again(client):
+    origin = ImageApp()
+    app = ShrinkixMiddleware(origin, client=client, cache=TieredCache())
+    _, _, first = call(app, "width=640")
+    origin.body = PNG + b"new!"
+    _, _, second = call(app, "width=640")
+    assert first != second and len(client.calls) == 2
+
+
+def test_cache_hits_still_run_app_authorization(client):
+    origin = ImageApp(require_auth=True)
+    app = ShrinkixMiddleware(origin, client=client, cache=TieredCache())
+
+    status, headers, _ = call(app, "width=640", HTTP_AUTHORIZATION="Bearer ok")
+    assert status == 200
+    assert headers["Cache-Control"] == "private, no-cache"
+
+    status, _, body = call(app, "width=640")
+    assert status == 403 and body == b"forbidden"
+    assert len(client.calls) == 1
+
+
+def test_set_cookie_makes_variant_private(client):
+    origin = ImageApp(headers=[("Cache-Control", "public, max-age=600"), ("Set-Cookie", "s=1")])
+    app = ShrinkixMiddleware(origin, client=client, cache=TieredCache())
+    _, headers, _ = call(app, "width=640")
+    assert headers["Cache-Control"] == "private, no-cache"
+    assert headers["Set-Cookie"] == "s=1"
+
+
+def test_cache_control_follows_app(client):
+    app = ShrinkixMiddleware(ImageApp(headers=[("Cache-Control", "public, max-age=600")]), client=client)
+    assert call(app, "width=640")[1]["Cache-Control"] == "public, max-age=600"
+
+    app = ShrinkixMiddleware(ImageApp(), client=client)
+    assert call(app, "width=640")[1]["Cache-Control"] == "no-cache"
+
+    app = ShrinkixMiddleware(ImageApp(), client=client, cache_control="public, max-age=60")
+    assert call(app, "width=640")[1]["Cache-Control"] == "public, max-age=60"
+
+
+@pytest.mark.parametrize("query", ["width=641", "width=abc", "quality=77", "format=gif", "height=99999"])
+def test_variants_outside_allow_list_are_refused(client, query):
+    origin = ImageApp()
+    app = ShrinkixMiddleware(origin, client=client)
+    status, _, _ = call(app, query)
+    assert status == 400
+    assert client.calls == [] and origin.requests == []
+
+
+def test_custom_allow_list(client):
+    app = ShrinkixMiddleware(ImageApp(), client=client, widths=(500,), qualities=(75,), output_formats=("webp",))
+    assert call(app, "width=500&quality=75&format=webp")[0] == 200
+    assert call(app, "width=640")[0] == 400
+    assert call(app, "format=png")[0] == 400
+
+
+def test_other_requests_pass_through(client):
+    origin = ImageApp()
+    app = ShrinkixMiddleware(origin, client=client)
+    status, _, body = call(app, "")
+    assert status == 200 and body == PNG
+    assert client.calls == []
+
+
+def test_asgi_runs_app_authorization_on_hits(client):
+    async def origin(scope, receive, send):
+        headers = dict(scope["headers"])
+        if headers.get(b"authorization") != b"Bearer ok":
+            await send({"type": "http.response.start", "status": 403, "headers": []})
+            await send({"type": "http.response.body", "body": b"forbidden"})
+            return
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"image/png")]})
+        await send({"type": "http.response.body", "body": PNG})
+
+    app = ShrinkixASGIMiddleware(origin, client=client)
+
+    async def request(headers):
+        scope = {"type": "http", "method": "GET", "path": "/a.png", "query_string": b"width=640", "headers": headers}
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            messages.append(message)
+
+        await app(scope, receive, send)
+        return messages[0]["status"]
+
+    assert asyncio.run(request([(b"authorization", b"Bearer ok")])) == 200
+    assert asyncio.run(request([])) == 403
+    assert asyncio.run(request([(b"authorization", b"Bearer ok")])) == 200
+    assert len(client.calls) == 1
+
+
+def test_source_validators_survive_disk_cache(client, tmp_path):
+    origin = ImageApp()
+    call(ShrinkixMiddleware(origin, client=client, cache=TieredCache(directory=str(tmp_path))), "width=640")
+
+    # A fresh process (empty memory tier) revalidates instead of re-optimizing
+    app = ShrinkixMiddleware(origin, client=client, cache=TieredCache(directory=str(tmp_path)))
+    assert call(app, "width=640")[0] == 200
+    assert len(client.calls) == 1
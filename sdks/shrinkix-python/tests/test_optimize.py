@@ -0,0 +1,54 @@
+import struct
+
+from shrinkix.concurrency import AdaptiveLimiter
+from shrinkix.predictor import SavingsPredictor, inspect_image
+from shrinkix.resources.optimize import Optimize
+from shrinkix.transport import Transport
+
+IMAGE_HEADERS = {"Content-Type": "image/png", "X-Original-Size": "1000", "X-Compressed-Size": "400"}
+
+
+def test_retried_busy_responses_count_as_drops(api):
+    api.queue(
+        (503, {"Retry-After": "0.3", "Content-Type": "application/json"}, b'{"error": "SERVER_BUSY"}'),
+        (200, IMAGE_HEADERS, b"r" * 400),
+    )
+    limiter = AdaptiveLimiter(initial_limit=8)
+    optimize = Optimize(Transport("key", base_url=api.url), concurrency=limiter)
+
+    [result] = optimize.optimize_many([b"u" * 1000])
+    assert result.data == b"r" * 400
+
+    stats = limiter.stats()
+    assert stats["drops"] == 1
+    assert limiter.limit == 4
+    # The Retry-After pause is not server latency: 0.3s over 64KB would be ~4.8s/MB
+    assert stats["samples"] == 1 and stats["latency"] < 1
+
+
+def test_cache_hits_are_not_latency_samples(api):
+    api.queue(
+        (200, {**IMAGE_HEADERS, "X-Cache": "HIT", "Server-Timing": 'cache;desc="hit"'}, b"r" * 400),
+        (200, {**IMAGE_HEADERS, "Server-Timing": 'cache;desc="hit"'}, b"r" * 400),
+        (200, {**IMAGE_HEADERS, "Server-Timing": "queue;dur=1, encode;dur=40"}, b"r" * 400),
+    )
+    limiter = AdaptiveLimiter(initial_limit=8)
+    optimize = Optimize(Transport("key", base_url=api.url), concurrency=limiter)
+
+    results = list(optimize.optimize_many([b"u" * 1000] * 3))
+    assert sorted(result.cached for result in results) == [False, True, True]
+    assert limiter.stats()["samples"] == 1
+
+
+def test_explicit_quality_bypasses_the_predictor(api):
+    api.queue((200, IMAGE_HEADERS, b"r" * 400))
+    predictor = SavingsPredictor(min_samples=1, explore_rate=0)
+    image = b"\x89PNG\r\n\x1a\n" + b"\x00\x00\x00\x0dIHDR" + struct.pack(">II", 100, 100) + b"\x00" * 1000
+    info = inspect_image(image, len(image))
+    predictor.observe(info, 1000, 1000)
+    optimize = Optimize(Transport("key", base_url=api.url), predictor=predictor)
+
+    assert optimize.optimize(image).skipped
+    result = optimize.optimize(image, quality=40)
+    assert not result.skipped and result.data == b"r" * 400
+    assert len(api.requests) == 1
@@ -0,0 +1,133 @@
+import io
+import struct
+
+import pytest
+
+from shrinkix.predictor import (
+    ImageInfo,
+    SavingsPredictor,
+    _STD_LUMINANCE,
+    _estimate_jpeg_quality,
+    inspect_image,
+)
+
+
+def _encode(fmt, size=(64, 48), mode="RGB", **params):
+    Image = pytest.importorskip("PIL.Image")
+    buf = io.BytesIO()
+    Image.new(mode, size, (200, 30, 30) if mode == "RGB" else (200, 30, 30, 128)).save(buf, fmt, **params)
+    return buf.getvalue()
+
+
+def _inspect(data):
+    return inspect_image(data, len(data))
+
+
+def test_png_dimensions():
+    info = _inspect(_encode("PNG", (321, 123)))
+    assert (info.format, info.width, info.height) == ("png", 321, 123)
+
+
+@pytest.mark.parametrize("progressive", [False, True])
+def test_jpeg_dimensions(progressive):
+    info = _inspect(_encode("JPEG", (640, 480), quality=80, progressive=progressive))
+    assert (info.format, info.width, info.height) == ("jpeg", 640, 480)
+
+
+@pytest.mark.parametrize("quality", [30, 50, 75, 90, 95])
+def test_jpeg_quality_estimate(quality):
+    info = _inspect(_encode("JPEG", quality=quality))
+    assert abs(info.jpeg_quality - quality) <= 2
+
+
+def test_jpeg_quality_from_standard_table():
+    # Quality 50 is the standard table itself; all-ones is (near) lossless
+    assert _estimate_jpeg_quality(b"\x00" + bytes(_STD_LUMINANCE)) == 50
+    assert _estimate_jpeg_quality(b"\x00" + bytes([1] * 64)) >= 99
+    # 16-bit tables and tables other than luminance (id 0) are skipped over
+    chroma = b"\x01" + bytes([99] * 64)
+    wide = b"\x10" + struct.pack(">64H", *_STD_LUMINANCE)
+    assert _estimate_jpeg_quality(chroma + wide) == 50
+    assert _estimate_jpeg_quality(b"\x00" + bytes(10)) is None
+
+
+@pytest.mark.parametrize("params,mode", [
+    ({"quality": 80}, "RGB"),
+    ({"lossless": True}, "RGB"),
+    ({"quality": 80}, "RGBA"),
+])
+def test_webp_dimensions(params, mode):
+    pytest.importorskip("PIL.WebPImagePlugin")
+    info = _inspect(_encode("WEBP", (300, 200), mode=mode, **params))
+    assert (info.format, info.width, info.height) == ("webp", 300, 200)
+
+
+def test_avif_dimensions():
+    ispe = b"ispe" + b"\x00" * 4 + struct.pack(">II", 800, 600)
+    box = struct.pack(">I", 8 + len(ispe)) + ispe
+    header = struct.pack(">I", 20) + b"ftypavif" + b"\x00" * 8 + box
+    info = _inspect(header)
+    assert (info.format, info.width, info.height) == ("avif", 800, 600)
+
+
+def test_unknown_format():
+    info = _inspect(b"GIF89a" + b"\x00" * 32)
+    assert info.format is None and info.width is None
+
+
+def _train(predictor, info, savings, count):
+    for _ in range(count):
+        predictor.observe(info, 1000, int(1000 * (1 - savings)))
+
+
+def test_predicts_after_min_samples():
+    predictor = SavingsPredictor(min_samples=5)
+    info = ImageInfo("jpeg", 100, 100, 5000, jpeg_quality=70)
+    _train(predictor, info, 0.01, 4)
+    assert predictor.predict(info).savings is None
+    _train(predictor, info, 0.01, 1)
+    prediction = predictor.predict(info)
+    assert prediction.skip and prediction.samples == 5
+
+
+def test_explored_skips_are_weighted():
+    predictor = SavingsPredictor(min_samples=1, mode="skip", explore_rate=0.1, seed=1)
+    pointless = ImageInfo("png", 100, 100, 5000)
+    useful = ImageInfo("jpeg", 100, 100, 5000, jpeg_quality=95)
+    _train(predictor, pointless, 0.0, 1)
+    _train(predictor, useful, 0.5, 1)
+
+    # One explored skip stands for ten files; one sent file counts once
+    predictor.observe(pointless, 1000, 1000)
+    predictor.observe(useful, 1000, 990)
+    stats = predictor.stats()
+    assert stats.true_positives == pytest.approx(10.0)
+    assert stats.false_negatives == 1
+    assert stats.recall == pytest.approx(10 / 11)
+
+
+def test_flag_mode_counts_are_unweighted():
+    predictor = SavingsPredictor(min_samples=1, mode="flag", explore_rate=0.1)
+    info = ImageInfo("png", 100, 100, 5000)
+    _train(predictor, info, 0.0, 3)
+    stats = predictor.stats()
+    assert stats.true_positives == 2
+    assert stats.precision == 1.0
+
+
+def test_no_exploration_reports_unknown():
+    predictor = SavingsPredictor(min_samples=1, mode="skip", explore_rate=0)
+    info = ImageInfo("jpeg", 100, 100, 5000)
+    _train(predictor, info, 0.5, 3)
+    stats = predictor.stats()
+    assert stats.precision is None and stats.recall is None
+
+
+def test_save_and_load(tmp_path):
+    predictor = SavingsPredictor(min_samples=2)
+    info = ImageInfo("png", 10, 10, 400)
+    _train(predictor, info, 0.3, 2)
+    path = str(tmp_path / "predictor.json")
+    predictor.save(path)
+    restored = SavingsPredictor.load(path, min_samples=2)
+    assert restored.predict(info).savings == pytest.approx(0.3, abs=0.01)
@@ -0,0 +1,92 @@
+import os
+import threading
+
+import pytest
+
+from shrinkix.ratelimit import SharedRateLimiter
+
+
+@pytest.fixture
+def make(tmp_path):
+    limiters = []
+
+    def factory(**kwargs):
+        limiter = SharedRateLimiter("sk_test_key", directory=str(tmp_path), **kwargs)
+        limiters.append(limiter)
+        return limiter
+
+    yield factory
+    for limiter in limiters:
+        limiter.close()
+
+
+def test_burst_then_paced(make):
+    limiter = make(rate=20, burst=2)
+    assert limiter.acquire() == 0
+    assert limiter.acquire() == 0
+    assert limiter.acquire() == pytest.approx(0.05, abs=0.02)
+    assert limiter.stats()["waits"] == 1
+
+
+def test_learns_server_rate(make):
+    limiter = make(rate=1000, burst=1)
+    limiter.acquire()
+    limiter.observe("10", 200)
+    assert limiter.stats()["rate"] == 10
+    assert limiter.acquire() == pytest.approx(0.1, abs=0.03)
+
+
+def test_retry_after_pauses_the_bucket(make):
+    limiter = make(rate=1000)
+    limiter.observe(None, 429, "0.2")
+    assert limiter.acquire() == pytest.approx(0.2, abs=0.05)
+    assert limiter.stats()["throttled"] == 1
+
+
+def test_bucket_is_shared_between_instances(make):
+    first, second = make(rate=10, burst=1), make(rate=10, burst=1)
+    assert first.acquire() == 0
+    assert second.acquire() == pytest.approx(0.1, abs=0.03)
+
+
+def test_threads_are_served_in_order(make):
+    limiter = make(rate=100, burst=1)
+    waits = []
+
+    def worker():
+        waits.append(limiter.acquire())
+
+    threads = [threading.Thread(target=worker) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Each thread reserved its own slot: waits are spread 10ms apart
+    assert sorted(round(wait, 2) for wait in waits) == pytest.approx([i / 100 for i in range(10)], abs=0.015)
+    stats = limiter.stats()
+    assert stats["waits"] == 9
+    assert stats["wait_seconds"] == pytest.approx(sum(waits), abs=0.001)
+
+
+def test_lock_survives_reopen(make):
+    limiter = make(rate=1000)
+    limiter.acquire()
+    lock = limiter._lock
+    limiter._pid = -1  # as seen from a forked child
+    limiter.acquire()
+    assert limiter._lock is lock
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="fork() not available")
+def test_forked_child_uses_shared_bucket(make):
+    limiter = make(rate=5, burst=1)
+    limiter.acquire()
+
+    pid = os.fork()
+    if pid == 0:
+        # Parent's token is spent: the child waits for the next slot
+        wait = limiter.acquire()
+        os._exit(0 if 0.1 < wait < 0.3 else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
@@ -0,0 +1,167 @@
+import io
+import json
+import random
+import zipfile
+
+import pytest
+from requests.models import RequestEncodingMixin
+
+from shrinkix.errors import ApiError
+from shrinkix.resources.optimize import Optimize
+from shrinkix.streaming import MultipartBody, Progress, ProgressTracker, iter_zip_entries
+from shrinkix.transport import Transport
+
+
+class _Unseekable(io.RawIOBase):
+    """Write-only stream: zipfile falls back to data descriptors, like archiver"""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data += b
+        return len(b)
+
+
+def _zip(entries, streamed=True):
+    """ZIP of (name, content, compress_type) entries"""
+    out = _Unseekable() if streamed else io.BytesIO()
+    with zipfile.ZipFile(out, "w") as archive:
+        for name, content, compress_type in entries:
+            archive.writestr(zipfile.ZipInfo(name), content, compress_type=compress_type)
+    return bytes(out.data) if streamed else out.getvalue()
+
+
+def _chunks(data, sizes):
+    pos = 0
+    while pos < len(data):
+        size = random.choice(sizes)
+        yield data[pos:pos + size]
+        pos += size
+
+
+ENTRIES = [
+    ("a-min.png", b"\x89PNG" + bytes(range(256)) * 40, zipfile.ZIP_STORED),
+    # Stored data that contains a data descriptor signature
+    ("b-min.jpg", b"\xff\xd8" + b"PK\x07\x08" * 50 + b"tail", zipfile.ZIP_STORED),
+    ("manifest.json", json.dumps({"files": [], "totals": {}}).encode() * 20, zipfile.ZIP_DEFLATED),
+]
+
+
+@pytest.mark.parametrize("streamed", [True, False])
+@pytest.mark.parametrize("sizes", [(1,), (7, 100, 4096), (1 << 20,)])
+def test_zip_entries_in_any_chunking(streamed, sizes):
+    random.seed(1)
+    data = _zip(ENTRIES, streamed)
+    entries = list(iter_zip_entries(_chunks(data, sizes)))
+    assert entries == [(name, content) for name, content, _ in ENTRIES]
+
+
+def test_zip_entry_is_yielded_before_the_archive_ends():
+    data = _zip(ENTRIES)
+    received = []
+
+    def chunks():
+        for chunk in _chunks(data, (512,)):
+            received.append(len(chunk))
+            yield chunk
+
+    entries = iter_zip_entries(chunks())
+    name, _ = next(entries)
+    assert name == "a-min.png"
+    assert sum(received) < len(data)
+
+
+def test_zip_stream_cut_short():
+    data = _zip(ENTRIES)
+    with pytest.raises(ValueError):
+        list(iter_zip_entries([data[:len(data) // 2]]))
+
+
+def test_zip_crc_mismatch():
+    data = bytearray(_zip(ENTRIES[:1], streamed=False))
+    data[40] ^= 0xFF  # inside the stored content
+    with pytest.raises(ValueError, match="CRC"):
+        list(iter_zip_entries([bytes(data)]))
+
+
+def test_multipart_body_matches_requests_encoding():
+    data = {"quality": 80, "format": "webp"}
+    files = [("images[]", ("a.png", b"A" * 5000, "image/png")), ("images[]", ("b.png", io.BytesIO(b"B" * 3000)))]
+    body = MultipartBody(data, files)
+
+    sent = b""
+    while True:
+        chunk = body.read(1000)
+        if not chunk:
+            break
+        sent += chunk
+    assert len(sent) == len(body)
+
+    expected_files = [("images[]", ("a.png", b"A" * 5000, "image/png")), ("images[]", ("b.png", b"B" * 3000))]
+    expected, content_type = RequestEncodingMixin._encode_files(expected_files, data)
+    theirs = content_type.split("boundary=")[1]
+    assert sent.replace(body.boundary.encode(), theirs.encode()) == expected
+
+
+def test_multipart_body_reports_file_bytes_and_rewinds():
+    reports = []
+    tracker = ProgressTracker(reports.append, upload_total=8000)
+    stream = io.BytesIO(b"x" * 100 + b"B" * 3000)
+    stream.seek(100)  # uploads from the current position
+    body = MultipartBody({"quality": 80}, [("a", ("a.png", b"A" * 5000)), ("b", ("b.png", stream))], tracker)
+
+    body.read(-1)
+    assert tracker.snapshot().uploaded == 8000  # form fields and boundaries are not counted
+
+    body.rewind()
+    assert stream.tell() == 100
+    assert tracker.snapshot().uploaded == 0
+    assert body.read(-1).count(b"B") == 3000
+    assert reports[-1] == Progress(8000, 8000, 0, 0)
+
+
+def test_progress_tracker_download_totals():
+    reports = []
+    tracker = ProgressTracker(reports.append)
+    tracker.expect_download(100)
+    tracker.expect_download(50)
+    tracker.download(120)
+    assert reports[-1] == Progress(0, None, 120, 150)
+
+    # One streamed response makes the total unknown for good
+    tracker.expect_download(None)
+    tracker.expect_download(10)
+    assert tracker.snapshot().download_total is None
+
+
+@pytest.mark.parametrize("on_progress", [None, lambda progress: None])
+def test_batch_goes_to_the_v1_endpoint(api, tmp_path, on_progress):
+    paths = []
+    # Non-ASCII names would not survive the server's latin1 decoding
+    for name in ("große.png", "b.png"):
+        path = tmp_path / name
+        path.write_bytes(b"\x89PNG\r\n\x1a\n" + b"\x00\x00\x00\x0dIHDR" + b"i" * 984)
+        paths.append(str(path))
+
+    manifest = {"files": [{"filename": "0.png", "outputFilename": "0-min.png"}, {"filename": "1.png", "error": "decode failed"}]}
+    archive = _zip([
+        ("0-min.png", b"o" * 400, zipfile.ZIP_STORED),
+        ("manifest.json", json.dumps(manifest).encode(), zipfile.ZIP_DEFLATED),
+    ])
+    api.queue((200, {"Content-Type": "application/zip"}, _chunks(archive, (256,))))
+
+    optimize = Optimize(Transport("key", base_url=api.url))
+    results = dict(optimize.optimize_iter(paths, batch=True, on_progress=on_progress, return_exceptions=True))
+
+    method, path, headers, body = api.requests[0]
+    assert (method, path) == ("POST", "/optimize/batch")
+    assert body.count(b'name="images[]"; filename="0.png"\r\nContent-Type: image/png') == 1
+    assert body.count(b'name="images[]"; filename="1.png"\r\nContent-Type: image/png') == 1
+    assert results[0].data == b"o" * 400
+    assert results[0].savings["percent"] == 60.0
+    assert isinstance(results[1], ApiError) and results[1].code == "COMPRESSION_FAILED"
+    assert str(results[1].message) == "decode failed"
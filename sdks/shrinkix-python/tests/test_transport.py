@@ -0,0 +1,75 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from shrinkix.errors import ApiError
+from shrinkix.transport import Transport
+
+
+def _rejecting_server(linger):
+    """
+    Server that answers 413 after the first 256KB of the body, like the API's
+    upload validator: response, then FIN, reading for `linger` seconds, close
+    """
+    listener = socket.create_server(("127.0.0.1", 0))
+
+    def serve():
+        conn, _ = listener.accept()
+        received = 0
+        while received < 256 * 1024:
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            received += len(chunk)
+        body = b'{"error": "IMAGE_SIZE_EXCEEDED", "message": "File too large"}'
+        conn.sendall(
+            b"HTTP/1.1 413 Payload Too Large\r\nContent-Type: application/json\r\n"
+            b"Connection: close\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+        )
+        conn.shutdown(socket.SHUT_WR)
+        conn.settimeout(0.05)
+        deadline = time.monotonic() + linger
+        while time.monotonic() < deadline:
+            try:
+                if not conn.recv(65536):
+                    break
+            except socket.timeout:
+                pass
+        conn.close()
+        listener.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return f"http://127.0.0.1:{listener.getsockname()[1]}"
+
+
+def test_early_rejection_is_an_api_error():
+    transport = Transport("key", base_url=_rejecting_server(linger=1.0), max_retries=0)
+    with pytest.raises(ApiError) as e:
+        transport.post("/optimize", files={"image": ("a.png", b"u" * (20 * 1024 * 1024))})
+    assert e.value.status_code == 413
+    assert e.value.code == "IMAGE_SIZE_EXCEEDED"
+
+
+def test_non_json_error_page(api):
+    api.queue((502, {"Content-Type": "text/html"}, b"<html>Bad Gateway</html>"))
+    transport = Transport("key", base_url=api.url, max_retries=0)
+    with pytest.raises(ApiError) as e:
+        transport.get("/usage")
+    assert e.value.status_code == 502
+    assert e.value.code == "HTTP_502"
+
+
+def test_retries_from_many_threads_are_all_counted(api):
+    busy = (503, {"Retry-After": "0", "Content-Type": "application/json"}, b'{"error": "SERVER_BUSY"}')
+    api.queue(*[busy] * 16)
+    api.server.default = (200, {"Content-Type": "application/json"}, b"{}")
+    transport = Transport("key", base_url=api.url, max_retries=20)
+
+    threads = [threading.Thread(target=transport.get, args=("/usage",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert transport.retries == 16